@@ -0,0 +1,361 @@
+"""
+性能测试，无需网络
+~~~~~~~~~~~~~~
+
+使用生成的卡牌和卡组数据 (与 HearthstoneJSON 及各数据源保存的 JSON 格式相同) 测试主要操作的耗时
+
+    # 使用 1000 和 10000 个卡组进行测试，并保存结果
+    python benchmarks.py --decks 1000 10000 --output before.json
+
+    # 修改代码后再次测试，并与之前的结果对比，若有操作慢了 20% 以上则返回非零值
+    python benchmarks.py --decks 1000 10000 --output after.json --compare before.json
+
+"""
+
+import argparse
+import glob
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import hsdata
+from hsdata import shared
+from hsdata.hearthstats import parse_deck_page
+from hsdata.memory import memory_report, trace_memory
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'fixtures')
+
+BASIC_CLASS_NAMES = hsdata.Careers.CLASS_NAMES[:9]
+
+CURRENT_SETS = ('CORE', 'EXPERT1', 'BRM', 'TGT', 'LOE', 'OG', 'KARA', 'GANGS')
+RARITIES = ('COMMON', 'COMMON', 'COMMON', 'RARE', 'RARE', 'EPIC', 'LEGENDARY')
+DUST = dict(FREE=None, COMMON=[40, 400, 5, 50], RARE=[100, 800, 20, 100],
+            EPIC=[400, 1600, 100, 400], LEGENDARY=[1600, 3200, 400, 1600])
+
+
+def make_cards_data(num_of_cards=2000, seed=0):
+    """
+    生成 HearthstoneJSON 格式的卡牌数据
+    :param num_of_cards: 卡牌数量 (不包括英雄)
+    :param seed: 随机数种子
+    :return: 卡牌 dict 列表
+    """
+
+    rnd = random.Random(seed)
+    cards_data = list()
+
+    for class_name in BASIC_CLASS_NAMES:
+        cards_data.append(dict(
+            id='HERO_{}'.format(class_name), dbfId=len(cards_data) + 1,
+            name='{} 英雄'.format(class_name), type='HERO', set='CORE',
+            playerClass=class_name, collectible=True, rarity='FREE'))
+
+    for i in range(num_of_cards):
+        # 约一半为中立卡牌，其余平均分配到各职业
+        if i % 2:
+            player_class = 'NEUTRAL'
+        else:
+            player_class = BASIC_CLASS_NAMES[(i // 2) % len(BASIC_CLASS_NAMES)]
+
+        rarity = rnd.choice(RARITIES)
+        card_set = rnd.choice(CURRENT_SETS) if rnd.random() > 0.15 else rnd.choice(hsdata.core.EXPIRED_SETS)
+        card_type = rnd.choice(('MINION', 'MINION', 'SPELL', 'WEAPON'))
+        cost = rnd.randint(0, 10)
+
+        card = dict(
+            id='SYN_{:06d}'.format(i), dbfId=len(cards_data) + 1,
+            name='合成卡牌 {} Synthetic {}'.format(i, rnd.choice(('Dragon', 'Totem', 'Murloc', 'Pirate'))),
+            text='<b>战吼:</b> 造成 {} 点伤害。'.format(rnd.randint(1, 6)),
+            type=card_type, set=card_set, playerClass=player_class,
+            cost=cost, rarity=rarity, collectible=rnd.random() > 0.1,
+            dust=DUST[rarity], mechanics=['BATTLECRY'], artist='Synthetic')
+
+        if card_type == 'MINION':
+            card.update(attack=rnd.randint(0, 12), health=rnd.randint(1, 12))
+        elif card_type == 'WEAPON':
+            card.update(attack=rnd.randint(1, 5), durability=rnd.randint(1, 4))
+
+        cards_data.append(card)
+
+    return cards_data
+
+
+def iter_deck_dicts(cards_data, num_of_decks, source, seed=0):
+    """
+    生成与 Decks.save() 格式相同的卡组 dict
+    :param cards_data: make_cards_data() 生成的卡牌数据
+    :param num_of_decks: 卡组数量
+    :param source: 卡组来源，HSBoxDeck.source 或 HearthStatsDeck.source
+    :param seed: 随机数种子
+    """
+
+    rnd = random.Random(seed)
+
+    pools = dict((class_name, list()) for class_name in BASIC_CLASS_NAMES)
+    neutral = list()
+    for card in cards_data:
+        if not card.get('collectible') or card['type'] == 'HERO':
+            continue
+        if card['playerClass'] == 'NEUTRAL':
+            neutral.append(card)
+        else:
+            pools[card['playerClass']].append(card)
+
+    created_at = datetime(2016, 12, 1)
+
+    for i in range(num_of_decks):
+        class_name = BASIC_CLASS_NAMES[i % len(BASIC_CLASS_NAMES)]
+        candidates = rnd.sample(pools[class_name], 12) + rnd.sample(neutral, 18)
+
+        cards = dict()
+        num_of_cards = 0
+        for card in candidates:
+            count = 1 if card['rarity'] == 'LEGENDARY' else min(2, 30 - num_of_cards)
+            cards[card['id']] = count
+            num_of_cards += count
+            if num_of_cards == 30:
+                break
+
+        games = rnd.randint(0, 200000)
+        wins = int(games * rnd.uniform(0.35, 0.65))
+        deck = dict(
+            name='合成卡组 {}'.format(i), id='{}_{:07d}'.format(source, i),
+            career=class_name, cards=cards, games=games, wins=wins, draws=0)
+
+        if source == hsdata.HSBoxDeck.source:
+            deck.update(
+                ranked_games=games // 2, ranked_wins=wins // 2, users=games // 20,
+                created_at=(created_at + timedelta(minutes=i)).strftime(hsdata.core.DATE_TIME_FORMAT),
+                duration=rnd.randint(300, 900))
+        else:
+            deck.update(
+                draws=rnd.randint(0, 10), creator_id=str(rnd.randint(1, 50000)),
+                win_rate_by_rank=dict((str(rank), rnd.uniform(0.3, 0.7)) for rank in range(1, 26)))
+
+        yield deck
+
+
+def write_json_list(path, items):
+    """逐项写入 JSON 列表，避免在内存中生成完整的字串"""
+    with open(path, 'w') as f:
+        f.write('[')
+        for i, item in enumerate(items):
+            if i:
+                f.write(',')
+            json.dump(item, f, ensure_ascii=False)
+        f.write(']')
+
+
+def timed(func, repeat=3):
+    """
+    多次运行并返回最短的耗时
+    :return: (耗时秒数, 最后一次运行的返回值)
+    """
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        seconds = time.perf_counter() - start
+        if best is None or seconds < best:
+            best = seconds
+    return best, result
+
+
+def bench_hearthstats_parser(repeat=1000):
+    """
+    使用保存的 HearthStats 卡组页面，测试页面解析的速度
+    :param repeat: 每个页面的解析次数
+    :return: 每秒解析的页面数
+    """
+
+    pages = list()
+    for path in sorted(glob.glob(os.path.join(FIXTURES_DIR, 'hearthstats_*.html'))):
+        with open(path, encoding='utf-8') as f:
+            pages.append(f.read())
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for page in pages:
+            parse_deck_page(page)
+    seconds = time.perf_counter() - start
+
+    return len(pages) * repeat / seconds
+
+
+def run_benchmarks(deck_sizes=(1000,), num_of_cards=2000, repeat=3, memory=True):
+    """
+    运行所有性能测试
+    :param deck_sizes: 卡组数量列表
+    :param num_of_cards: 卡牌数量
+    :param repeat: 每项测试的运行次数 (取最短耗时)
+    :param memory: 选项，同时统计内存占用，结果的名称以 "memory." 开头
+    :return: dict，key 为测试名称，value 为耗时秒数或内存字节数
+    """
+
+    results = dict()
+    data_dir = tempfile.mkdtemp(prefix='hsdata_bench_')
+
+    try:
+        hsdata.set_data_dir(data_dir)
+
+        cards_data = make_cards_data(num_of_cards)
+        cards_path = os.path.join(data_dir, hsdata.core.CARDS_JSON_FILE_NAME)
+        write_json_list(cards_path, cards_data)
+
+        cards = hsdata.core.CARDS
+        results['cards.load'], _ = timed(cards.load, repeat)
+        if memory:
+            for name, size in memory_report(cards).items():
+                results['memory.' + name] = size
+        results['cards.search'], _ = timed(
+            lambda: cards.search(in_name='Dragon', career='MAGE', return_first=False), repeat)
+
+        mage = hsdata.CAREERS.get('MAGE')
+
+        for num_of_decks in deck_sizes:
+            for decks_class in hsdata.HSBoxDecks, hsdata.HearthStatsDecks:
+                source = decks_class.deck_class.source
+                prefix = '{}.{}.'.format(source.lower(), num_of_decks)
+                json_path = os.path.join(data_dir, 'DECKS_{}_{}.json'.format(source, num_of_decks))
+                write_json_list(json_path, iter_deck_dicts(cards_data, num_of_decks, source))
+
+                decks = decks_class(json_path=json_path, auto_load=False)
+
+                results[prefix + 'decks.load'], _ = timed(decks.load, repeat)
+
+                if memory:
+                    with trace_memory() as t:
+                        decks.load()
+                    results['memory.' + prefix + 'decks.load.peak'] = t.peak
+                    for name, size in memory_report(cards, [decks]).items():
+                        if name.startswith('decks'):
+                            name = name.split(']', 1)[1].lstrip('.') or 'decks'
+                            results['memory.' + prefix + name] = size
+
+                save_path = json_path + '.saved'
+                results[prefix + 'decks.save'], _ = timed(lambda: decks.save(save_path), repeat)
+                os.remove(save_path)
+
+                results[prefix + 'decks.search'], _ = timed(
+                    lambda: decks.search(career=mage, min_games=1000, win_rate_top_n=10), repeat)
+                results[prefix + 'career_cards_stats'], _ = timed(
+                    lambda: decks.career_cards_stats(mage), repeat)
+                results[prefix + 'cards_value'], _ = timed(
+                    lambda: hsdata.cards_value(decks), repeat)
+
+                results[prefix + 'deck_generator.cards'], _ = timed(
+                    lambda: hsdata.DeckGenerator(mage, decks).cards, repeat)
+
+                shared_path = json_path + '.hsd'
+                results[prefix + 'shared.export'], _ = timed(
+                    lambda: shared.export_shared(shared_path, decks), repeat)
+                results[prefix + 'shared.attach'], dataset = timed(
+                    lambda: shared.SharedDataset(shared_path), repeat)
+                results[prefix + 'shared.decks.search'], _ = timed(
+                    lambda: dataset.decks.search(career=mage, min_games=1000, win_rate_top_n=10), repeat)
+                results[prefix + 'shared.career_cards_stats'], _ = timed(
+                    lambda: dataset.decks.career_cards_stats(mage), repeat)
+
+                pairs = list(zip(decks[0::2], decks[1::2]))[:1000]
+                results[prefix + 'diff_decks'], _ = timed(
+                    lambda: [hsdata.diff_decks(a, b) for a, b in pairs], repeat)
+
+                del decks
+    finally:
+        hsdata.set_data_dir('data')
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    return results
+
+
+def compare_results(base, current, threshold=1.2):
+    """
+    对比两次测试结果
+    :param base: 之前的结果
+    :param current: 当前的结果
+    :param threshold: 耗时超过之前的多少倍时视为性能下降
+    :return: 性能下降的测试名称列表
+    """
+
+    regressions = list()
+    for name in sorted(current):
+        if name not in base or not base[name]:
+            continue
+        ratio = current[name] / base[name]
+        flag = ''
+        if ratio > threshold:
+            regressions.append(name)
+            flag = '  <-- 变慢' if not name.startswith('memory.') else '  <-- 内存增加'
+        print('{:<50} {:>11} {:>11} {:>7.2f}x{}'.format(
+            name, _format_value(name, base[name]), _format_value(name, current[name]), ratio, flag))
+    return regressions
+
+
+def _format_value(name, value):
+    if name.startswith('memory.'):
+        return '{:.2f}MB'.format(value / 1024 / 1024)
+    return '{:.4f}s'.format(value)
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.realpath(__file__)),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='hsdata 离线性能测试')
+    parser.add_argument('--decks', type=int, nargs='+', default=[1000], help='卡组数量，可指定多个')
+    parser.add_argument('--cards', type=int, default=2000, help='卡牌数量')
+    parser.add_argument('--repeat', type=int, default=3, help='每项测试的运行次数')
+    parser.add_argument('--parser-repeat', type=int, default=1000, help='每个页面的解析次数')
+    parser.add_argument('--output', help='将结果保存为 JSON 文件')
+    parser.add_argument('--compare', help='与之前保存的结果对比')
+    parser.add_argument('--threshold', type=float, default=1.2, help='耗时或内存超过之前的多少倍时视为性能下降')
+    parser.add_argument('--no-memory', action='store_true', help='不统计内存占用')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    results = run_benchmarks(args.decks, args.cards, args.repeat, not args.no_memory)
+    pages_per_second = bench_hearthstats_parser(args.parser_repeat)
+    results['hearthstats.parse_deck_page'] = 1 / pages_per_second
+
+    for name in sorted(results):
+        print('{:<50} {:>11}'.format(name, _format_value(name, results[name])))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(dict(
+                commit=_git_commit(),
+                time=datetime.now().strftime(hsdata.core.DATE_TIME_FORMAT),
+                python=platform.python_version(),
+                decks=args.decks, cards=args.cards,
+                results=results,
+            ), f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            base = json.load(f)['results']
+        print()
+        regressions = compare_results(base, results, args.threshold)
+        if regressions:
+            print('\n{} 项测试退化: {}'.format(len(regressions), ', '.join(regressions)))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
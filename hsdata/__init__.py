@@ -50,15 +50,20 @@ GitHub: https://github.com/youfou/hsdata
 import logging
 
 from .core import (
-    Career, Careers, Card, Cards, Deck, Decks,
+    Career, Careers, Card, Cards, Deck, DeckCards, Decks, DecksView, DeckTotals, DeckValidator, Snapshot,
     MODE_STANDARD, MODE_WILD, CAREERS, CARDS,
+    HSData, DEFAULT_CONTEXT, current_context,
     set_data_dir, set_main_language, get_career, can_have, days_ago
 )
+from .archetypes import Archetypes
+from .cooccurrence import CardCooccurrence
 from .hearthstats import HearthStatsDeck, HearthStatsDecks
+from .history import DeckStatsHistory, GRANULARITY_HOUR, GRANULARITY_DAY
 from .hsbox import HSBoxDeck, HSBoxDecks
 from .utils import (
-    DeckGenerator,
+    DeckGenerator, BackgroundRefresher,
     diff_decks, decks_expired, get_all_decks,
+    refresh_decks, merge_decks, register_deck_source,
     cards_value, print_cards, cards_to_csv
 )
 
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+
+"""
+命令行入口
+
+    $ hsdata serve --source HSBOX --port 8000
+    $ python -m hsdata serve --json-path data/DECKS_HSBOX.json
+
+"""
+
+import argparse
+import logging
+from collections import OrderedDict
+from contextlib import ExitStack
+
+from . import core
+from .hearthstats import HearthStatsDecks
+from .hsbox import HSBoxDecks
+from .server import HSDataServer, DEFAULT_CACHE_SIZE
+from .utils import BackgroundRefresher
+
+# serve 命令可用的卡组数据源
+DECKS_CLASSES = OrderedDict([
+    (HSBoxDecks.deck_class.source, HSBoxDecks),
+    (HearthStatsDecks.deck_class.source, HearthStatsDecks),
+])
+
+
+def serve(args):
+    with ExitStack() as stack:
+        if args.language or args.data_dir:
+            stack.enter_context(core.HSData(args.language, args.data_dir).use())
+
+        decks = DECKS_CLASSES[args.source](json_path=args.json_path)
+        server = HSDataServer(decks, host=args.host, port=args.port, cache_size=args.cache_size)
+
+        if args.refresh_interval:
+            refresher = BackgroundRefresher(decks.update, args.refresh_interval, delay=args.refresh_interval)
+            refresher.start()
+            stack.callback(refresher.stop, 0)
+
+        server.run()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='hsdata', description='用数据玩炉石!')
+    subparsers = parser.add_subparsers(dest='command')
+
+    serve_parser = subparsers.add_parser('serve', help='启动本地 HTTP 查询服务')
+    serve_parser.add_argument('--host', default='127.0.0.1', help='监听地址')
+    serve_parser.add_argument('--port', type=int, default=8000, help='监听端口')
+    serve_parser.add_argument('--source', choices=list(DECKS_CLASSES), default=HSBoxDecks.deck_class.source,
+                              help='卡组数据源')
+    serve_parser.add_argument('--json-path', help='卡组数据的 JSON 文件路径')
+    serve_parser.add_argument('--language', help='主语言，例如 zhCN, enUS')
+    serve_parser.add_argument('--data-dir', help='数据目录')
+    serve_parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE, help='缓存的响应数量')
+    serve_parser.add_argument('--refresh-interval', type=int, help='在后台定期更新卡组数据的间隔秒数')
+    serve_parser.set_defaults(func=serve)
+
+    args = parser.parse_args(argv)
+    if not args.command:
+        parser.print_help()
+        return
+
+    logging.basicConfig(level=logging.INFO)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
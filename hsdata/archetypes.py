@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+
+"""
+卡组流派聚类
+~~~~~~~~~~
+
+按职业和模式将卡组聚类为若干流派 (k-medoids)，卡组之间的距离为 1 - 按数量加权的 Jaccard 系数
+
+* 每轮迭代中，一个中心卡组与所有卡组的距离通过卡牌的倒排索引一次算出，只涉及含有相同卡牌的卡组
+* 新的中心取与簇内平均卡牌数量最接近的卡组，无需计算簇内两两之间的距离
+* 各职业和模式之间相互独立，可通过 processes 参数分配到多个进程中
+* 聚类完成后，新增或变化的卡组可通过 update() 直接归入最近的流派，无需重新聚类
+
+    >>> import hsdata
+    >>> decks = hsdata.HSBoxDecks()
+    >>> archetypes = hsdata.Archetypes(decks, k=4)
+    >>> for archetype_id in archetypes.search('MAGE'):
+    >>>     print(archetype_id, archetypes.medoids[archetype_id].name, archetypes.decks_of(archetype_id).total_games)
+
+"""
+
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+from . import core
+from .core import MODE_STANDARD, get_career
+from .metrics import timed
+
+# 每个职业和模式的默认流派数量
+DEFAULT_K = 4
+
+# 默认的最大迭代次数
+DEFAULT_MAX_ITER = 10
+
+
+def archetype_id(class_name, mode, number):
+    """
+    :return: 流派ID，例如 MAGE:STANDARD:0
+    """
+    return '{}:{}:{}'.format(class_name, mode, number)
+
+
+def _vector(deck):
+    return tuple((card.id, count) for card, count in deck.cards.items())
+
+
+def _similarity(a, b):
+    """
+    按数量加权的 Jaccard 系数
+    :param a: dict(卡牌ID: 数量)
+    :param b: dict(卡牌ID: 数量)
+    """
+    if len(a) > len(b):
+        a, b = b, a
+    intersection = 0
+    for card_id, count in a.items():
+        other = b.get(card_id)
+        if other:
+            intersection += min(count, other)
+    union = sum(a.values()) + sum(b.values()) - intersection
+    return intersection / union if union else 0.0
+
+
+def _similarities(center, postings, sizes):
+    """
+    通过倒排索引一次算出中心与所有卡组的相似度
+    :param center: dict(卡牌ID: 数量)
+    :param postings: dict(卡牌ID: [(卡组序号, 数量), ...])
+    :param sizes: 各卡组的卡牌总数
+    :return: 各卡组的相似度列表
+    """
+
+    intersections = [0] * len(sizes)
+    for card_id, count in center.items():
+        for number, deck_count in postings.get(card_id, ()):
+            intersections[number] += min(count, deck_count)
+
+    center_size = sum(center.values())
+    return [
+        intersection / (center_size + size - intersection) if center_size + size else 0.0
+        for intersection, size in zip(intersections, sizes)]
+
+
+def _assign(dicts, medoids, postings, sizes):
+    """
+    :return: 各卡组最相似的中心的序号
+    """
+    columns = [_similarities(dicts[medoid], postings, sizes) for medoid in medoids]
+    return [max(range(len(medoids)), key=lambda i: columns[i][number]) for number in range(len(dicts))]
+
+
+def _cluster(vectors, k, max_iter=DEFAULT_MAX_ITER, seed=0):
+    """
+    k-medoids 聚类，可在其他进程中运行
+    :param vectors: [(卡牌ID, 数量), ...] 的列表，每个元素对应一个卡组
+    :return: (各卡组所属簇的序号, 各簇中心卡组的序号)
+    """
+
+    n = len(vectors)
+    dicts = [dict(vector) for vector in vectors]
+    sizes = [sum(d.values()) for d in dicts]
+    postings = dict()
+    for number, d in enumerate(dicts):
+        for card_id, count in d.items():
+            postings.setdefault(card_id, list()).append((number, count))
+
+    k = min(k, len(set(vectors)))
+    if not k:
+        return [0] * n, list()
+
+    # k-medoids++ 初始化: 距离已有中心越远的卡组，越可能成为下一个中心
+    rng = random.Random(seed)
+    medoids = [rng.randrange(n)]
+    best = _similarities(dicts[medoids[0]], postings, sizes)
+    while len(medoids) < k:
+        weights = [(1 - s) ** 2 for s in best]
+        for medoid in medoids:
+            weights[medoid] = 0
+        if not any(weights):
+            break
+        medoid = rng.choices(range(n), weights)[0]
+        medoids.append(medoid)
+        best = [max(a, b) for a, b in zip(best, _similarities(dicts[medoid], postings, sizes))]
+
+    # 先按初始的中心分配，max_iter 为 0 时也有结果；之后每次更新中心都重新分配，标签总与返回的中心一致
+    labels = _assign(dicts, medoids, postings, sizes)
+    for _ in range(max_iter):
+        # 新的中心: 与簇内平均卡牌数量最接近的卡组
+        new_medoids = list()
+        for cluster, medoid in enumerate(medoids):
+            members = [number for number, label in enumerate(labels) if label == cluster]
+            if not members:
+                new_medoids.append(medoid)
+                continue
+            mean = dict()
+            for number in members:
+                for card_id, count in dicts[number].items():
+                    mean[card_id] = mean.get(card_id, 0) + count / len(members)
+            new_medoids.append(max(members, key=lambda number: _similarity(dicts[number], mean)))
+
+        if new_medoids == medoids:
+            break
+        medoids = new_medoids
+        labels = _assign(dicts, medoids, postings, sizes)
+
+    return labels, medoids
+
+
+class Archetypes:
+    """
+    卡组流派，按职业和模式聚类，每个卡组对应一个流派ID
+    """
+
+    def __init__(self, decks=None, k=DEFAULT_K, max_iter=DEFAULT_MAX_ITER, min_games=0, processes=None, seed=0):
+        """
+        :param decks: 用于聚类的卡组合集
+        :param k: 每个职业和模式的流派数量
+        :param max_iter: 最大迭代次数
+        :param min_games: 只有游戏次数不少于此值的卡组参与聚类，其余卡组在聚类后直接归入最近的流派
+        :param processes: 进程数，不填写则在当前进程中依次聚类
+        :param seed: 随机数种子，相同的数据和种子总是得到相同的结果
+        """
+
+        self.k = k
+        self.max_iter = max_iter
+        self.min_games = min_games
+        self.seed = seed
+
+        # 卡组ID: 流派ID
+        self.labels = dict()
+        # 流派ID: 中心卡组
+        self.medoids = dict()
+        self._medoid_vectors = dict()
+        # 流派ID: 属于该流派的卡组合集
+        self._decks = dict()
+
+        if decks is not None:
+            self.fit(decks, processes)
+
+    @timed('stats.archetypes.fit')
+    def fit(self, decks, processes=None):
+        """
+        重新聚类
+        :param decks: 卡组合集
+        :param processes: 进程数，不填写则在当前进程中依次聚类
+        """
+
+        groups = dict()
+        for deck in decks:
+            if deck.career and (deck.games or 0) >= self.min_games:
+                groups.setdefault((deck.career.class_name, deck.mode), list()).append(deck)
+
+        keys = list(groups)
+        tasks = [([_vector(deck) for deck in groups[key]], self.k, self.max_iter, self.seed) for key in keys]
+        if processes:
+            with ProcessPoolExecutor(processes) as executor:
+                results = list(executor.map(_cluster, *zip(*tasks))) if tasks else list()
+        else:
+            results = [_cluster(*task) for task in tasks]
+
+        self.labels = dict()
+        self.medoids = dict()
+        self._medoid_vectors = dict()
+        self._decks = dict()
+
+        for key, (labels, medoids) in zip(keys, results):
+            group = groups[key]
+            for cluster, medoid in enumerate(medoids):
+                aid = archetype_id(key[0], key[1], cluster)
+                self.medoids[aid] = group[medoid]
+                self._medoid_vectors[aid] = dict(_vector(group[medoid]))
+                self._decks[aid] = core.Decks(cards=getattr(decks, 'cards', None))
+            for deck, label in zip(group, labels):
+                self._add(deck, archetype_id(key[0], key[1], label))
+
+        # 未参与聚类的卡组
+        for deck in decks:
+            if deck.id not in self.labels:
+                self.assign(deck)
+
+    def _add(self, deck, aid):
+        self.labels[deck.id] = aid
+        self._decks[aid].append(deck)
+
+    def nearest(self, deck):
+        """
+        :return: (与卡组最接近的流派ID, 相似度)，该职业和模式尚无流派时返回 (None, None)
+        """
+
+        if not deck.career:
+            return None, None
+        prefix = archetype_id(deck.career.class_name, deck.mode, '')
+        vector = dict(_vector(deck))
+        found = None, None
+        for aid, medoid_vector in self._medoid_vectors.items():
+            if aid.startswith(prefix):
+                similarity = _similarity(vector, medoid_vector)
+                if found[1] is None or similarity > found[1]:
+                    found = aid, similarity
+        return found
+
+    def assign(self, deck):
+        """
+        将卡组归入最近的流派 (若已有流派则先移出)，不改变流派的中心
+        :return: 流派ID，该职业和模式尚无流派时返回 None
+        """
+
+        self.remove(deck)
+        aid, _ = self.nearest(deck)
+        if aid is not None:
+            self._add(deck, aid)
+        return aid
+
+    def remove(self, deck):
+        """
+        将卡组移出其所在的流派
+        :param deck: 卡组或卡组ID
+        """
+
+        self._discard(getattr(deck, 'id', deck))
+
+    def _discard(self, deck_id):
+        aid = self.labels.pop(deck_id, None)
+        if aid is not None:
+            archetype_decks = self._decks[aid]
+            old = archetype_decks.get(deck_id)
+            if old is not None:
+                archetype_decks.remove(old)
+
+    @timed('stats.archetypes.update')
+    def update(self, decks):
+        """
+        根据最新的卡组合集更新各流派的卡组: 新增的卡组归入最近的流派，已不存在的卡组被移出，流派的中心不变
+        :param decks: 卡组合集
+        :return: 新归入的卡组数量
+        """
+
+        seen = set()
+        assigned = 0
+        for deck in decks:
+            seen.add(deck.id)
+            aid = self.labels.get(deck.id)
+            if aid is None or self._decks[aid].get(deck.id) is not deck:
+                self.assign(deck)
+                assigned += 1
+
+        for deck_id in [deck_id for deck_id in self.labels if deck_id not in seen]:
+            self._discard(deck_id)
+
+        return assigned
+
+    def label(self, deck):
+        """
+        :param deck: 卡组或卡组ID
+        :return: 卡组所属的流派ID
+        """
+        return self.labels.get(getattr(deck, 'id', deck))
+
+    def decks_of(self, aid):
+        """
+        :param aid: 流派ID
+        :return: 属于该流派的卡组合集 (Decks)，可直接读取 total_games 等累计数据或调用 career_cards_stats
+        """
+        return self._decks[aid]
+
+    def search(self, career, mode=MODE_STANDARD):
+        """
+        :return: 指定职业和模式的流派ID列表，按卡组数量倒排
+        """
+
+        prefix = archetype_id(get_career(career).class_name, mode, '')
+        found = [aid for aid in self._decks if aid.startswith(prefix)]
+        found.sort(key=lambda aid: len(self._decks[aid]), reverse=True)
+        return found
+
+    def __len__(self):
+        return len(self._decks)
+
+    def __repr__(self):
+        return '<{}: {} archetypes, {} decks>'.format(self.__class__.__name__, len(self._decks), len(self.labels))
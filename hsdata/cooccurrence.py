@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+
+"""
+卡牌共现统计
+~~~~~~~~~~
+
+按职业和模式统计每对卡牌同时出现在多少卡组中，以及这些卡组的游戏和获胜次数，
+用于查询"与某张卡牌搭配使用最多的卡牌"
+
+* 统计只需遍历一次卡组，每个卡组只产生其中卡牌两两组合的计数 (稀疏)
+* 每张卡牌的搭配卡牌单独保存，查询时只需对该卡牌的搭配卡牌排序
+* 更新卡组数据后调用 update()，只会重新统计新增、删除或有变化的卡组
+
+    >>> import hsdata
+    >>> decks = hsdata.HSBoxDecks()
+    >>> cooccurrence = hsdata.CardCooccurrence(decks, min_win_rate=0.55)
+    >>> cooccurrence.partners(hsdata.CARDS.search('火球术'), 'MAGE')
+
+"""
+
+import math
+from itertools import combinations
+
+from . import core
+from .core import MODE_STANDARD, get_career
+from .metrics import timed
+
+# 可用于排序的指标
+SORT_BY_DECKS = 'decks'
+SORT_BY_GAMES = 'games'
+SORT_BY_WIN_RATE = 'win_rate'
+SORT_BY_LIFT = 'lift'
+SORT_BY_PMI = 'pmi'
+
+
+class _Group:
+    """单个职业和模式的统计"""
+
+    def __init__(self):
+        # [卡组数, 游戏次数, 获胜次数]
+        self.totals = [0, 0, 0]
+        # 卡牌ID: [卡组数, 游戏次数, 获胜次数]
+        self.cards = dict()
+        # 卡牌ID: dict(搭配卡牌ID: [卡组数, 游戏次数, 获胜次数])，每对卡牌在两个方向上各保存一次
+        self.pairs = dict()
+
+
+def _add(values, games, wins, sign):
+    values[0] += sign
+    values[1] += sign * games
+    values[2] += sign * wins
+
+
+class CardCooccurrence:
+    """
+    卡牌共现统计，按 (职业, 模式) 分组
+    """
+
+    def __init__(self, decks=None, min_games=0, min_win_rate=0.0, cards=None):
+        """
+        :param decks: 用于统计的卡组合集
+        :param min_games: 只统计游戏次数不少于此值的卡组
+        :param min_win_rate: 只统计胜率不低于此值的卡组，例如只统计高胜率的卡组
+        :param cards: 用于将卡牌ID转化为卡牌对象，默认为 decks 所用的卡牌
+        """
+
+        self.min_games = min_games
+        self.min_win_rate = min_win_rate
+        self.cards = cards or getattr(decks, 'cards', None)
+
+        self._groups = dict()
+        # 卡组ID: (分组, 卡牌ID元组, 游戏次数, 获胜次数)
+        self._records = dict()
+
+        if decks:
+            self.update(decks)
+
+    def _record(self, deck):
+        """
+        :return: 卡组在统计中的记录，不符合条件的卡组返回 None
+        """
+
+        games = deck.games or 0
+        if games < self.min_games or (deck.win_rate or 0) < self.min_win_rate or not deck.career:
+            return
+        card_ids = tuple(sorted(set(card.id for card in deck.cards)))
+        return (deck.career.class_name, deck.mode), card_ids, games, deck.wins or 0
+
+    def _apply(self, record, sign):
+        key, card_ids, games, wins = record
+
+        group = self._groups.get(key)
+        if group is None:
+            group = self._groups[key] = _Group()
+
+        _add(group.totals, games, wins, sign)
+        for card_id in card_ids:
+            values = group.cards.get(card_id)
+            if values is None:
+                values = group.cards[card_id] = [0, 0, 0]
+            _add(values, games, wins, sign)
+
+        for a, b in combinations(card_ids, 2):
+            for card_id, partner_id in (a, b), (b, a):
+                partners = group.pairs.get(card_id)
+                if partners is None:
+                    partners = group.pairs[card_id] = dict()
+                values = partners.get(partner_id)
+                if values is None:
+                    values = partners[partner_id] = [0, 0, 0]
+                _add(values, games, wins, sign)
+                if not values[0]:
+                    del partners[partner_id]
+
+        if sign < 0:
+            for card_id in card_ids:
+                if not group.cards[card_id][0]:
+                    del group.cards[card_id]
+                    group.pairs.pop(card_id, None)
+
+    def add(self, deck):
+        """
+        加入或重新统计单个卡组
+        """
+
+        old = self._records.pop(deck.id, None)
+        if old:
+            self._apply(old, -1)
+        record = self._record(deck)
+        if record:
+            self._apply(record, 1)
+            self._records[deck.id] = record
+
+    def remove(self, deck):
+        """
+        移除单个卡组的统计
+        """
+
+        old = self._records.pop(deck.id, None)
+        if old:
+            self._apply(old, -1)
+
+    @timed('stats.cooccurrence.update')
+    def update(self, decks):
+        """
+        根据最新的卡组合集更新统计，只会重新统计新增、删除或有变化的卡组
+        :param decks: 卡组合集
+        :return: 重新统计的卡组数量
+        """
+
+        changed = 0
+        seen = set()
+        for deck in decks:
+            seen.add(deck.id)
+            record = self._record(deck)
+            old = self._records.get(deck.id)
+            if record == old:
+                continue
+            changed += 1
+            if old:
+                self._apply(old, -1)
+                del self._records[deck.id]
+            if record:
+                self._apply(record, 1)
+                self._records[deck.id] = record
+
+        for deck_id in [deck_id for deck_id in self._records if deck_id not in seen]:
+            changed += 1
+            self._apply(self._records.pop(deck_id), -1)
+
+        return changed
+
+    def _group(self, career, mode):
+        return self._groups.get((get_career(career).class_name, mode))
+
+    def card_stats(self, card, career, mode=MODE_STANDARD):
+        """
+        单张卡牌的统计
+        :return: dict，包括 decks, games, wins, win_rate；卡牌未出现时返回 None
+        """
+
+        group = self._group(career, mode)
+        values = group and group.cards.get(getattr(card, 'id', card))
+        if values:
+            return _stats_dict(values)
+
+    @timed('stats.cooccurrence.partners')
+    def partners(self, card, career, mode=MODE_STANDARD, top_k=10, sort_by=SORT_BY_LIFT, min_decks=1):
+        """
+        查询与指定卡牌搭配使用的卡牌
+
+        各项指标中的概率均按游戏次数加权，例如 P(A) 为包含 A 的卡组的游戏次数占总游戏次数的比例
+        lift: P(A, B) / (P(A) * P(B))，大于 1 表示两张卡牌比随机组合更常一起使用
+        pmi: lift 的自然对数
+
+        :param card: 卡牌或卡牌ID
+        :param career: 职业
+        :param mode: 模式
+        :param top_k: 返回的数量
+        :param sort_by: 排序的指标，可以是 decks, games, win_rate, lift, pmi
+        :param min_decks: 至少同时出现在多少个卡组中
+        :return: [(卡牌, 统计数据), ...]，统计数据包括 decks, games, wins, win_rate, lift, pmi
+        """
+
+        group = self._group(career, mode)
+        card_id = getattr(card, 'id', card)
+        if not group or card_id not in group.pairs:
+            return list()
+
+        total_games = group.totals[1]
+        card_games = group.cards[card_id][1]
+
+        found = list()
+        for partner_id, values in group.pairs[card_id].items():
+            if values[0] < min_decks:
+                continue
+            stats = _stats_dict(values)
+            partner_games = group.cards[partner_id][1]
+            if values[1] and card_games and partner_games:
+                stats['lift'] = values[1] * total_games / (card_games * partner_games)
+                stats['pmi'] = math.log(stats['lift'])
+            else:
+                stats['lift'] = stats['pmi'] = None
+            found.append((partner_id, stats))
+
+        found.sort(key=lambda x: (x[1][sort_by] is not None, x[1][sort_by]), reverse=True)
+
+        cards = self.cards or core.current_context().cards
+        return [(cards.get(partner_id), stats) for partner_id, stats in found[:top_k]]
+
+    @property
+    def groups(self):
+        """
+        :return: 已统计的 (class_name, mode) 列表
+        """
+        return list(self._groups)
+
+    def __len__(self):
+        return len(self._records)
+
+    def __repr__(self):
+        return '<{}: {} decks in {} groups>'.format(self.__class__.__name__, len(self._records), len(self._groups))
+
+
+def _stats_dict(values):
+    decks, games, wins = values
+    return dict(decks=decks, games=games, wins=wins, win_rate=wins / games if games else None)
@@ -11,22 +11,41 @@
 * Careers: 职业合集，附带一些实用的方法
 * Card: 单张卡牌
 * Cards: 卡牌合集，附带一些实用的方法
+* DeckCards: 紧凑的卡组卡牌列表，用法与 Counter 相同
 * Deck: 单个卡组
 * Decks: 卡组合集，附带一些实用的方法
+* DecksView: 卡组合集的只读视图，搜索和切片的结果
+* DeckTotals: 一组卡组的累计数据，由 Decks 实时维护
+* DeckValidator: 卡组校验器，用于批量检查卡组是否合法
+* Snapshot: 卡牌或卡组合集在某一时刻的只读快照
+* HSData: 数据上下文，包含主语言、数据目录、职业和卡牌，可在同一进程中同时使用多个
 
 """
 
+import heapq
 import json
 import logging
+import math
 import os
 import re
+import struct
+import threading
 import webbrowser
 from collections import Counter
+from collections.abc import Mapping, MutableMapping
+from contextlib import contextmanager
+from contextvars import ContextVar
 from copy import deepcopy
 from datetime import datetime, timedelta
+from types import MappingProxyType
+from weakref import WeakSet
 
 import requests
 
+from . import deckstrings
+from .lookup import CardLookup, PrefixIndex, PINYIN_LANGUAGES, normalize_name, pinyin_keys
+from .metrics import span, timed
+
 DATA_DIR = 'data'
 
 MODE_STANDARD = 'STANDARD'
@@ -38,6 +57,44 @@ CARDS_SOURCE_URL = 'https://api.hearthstonejson.com/v1/'
 
 PACKAGE_DIR = os.path.dirname(os.path.realpath(__file__))
 
+# 每个卡组的卡牌数量
+DECK_SIZE = 30
+
+# 卡组校验的拒绝原因
+REJECT_BAD_FORMAT = 'BAD_FORMAT'
+REJECT_UNKNOWN_CAREER = 'UNKNOWN_CAREER'
+REJECT_UNKNOWN_CARD = 'UNKNOWN_CARD'
+REJECT_NOT_COLLECTIBLE = 'NOT_COLLECTIBLE'
+REJECT_WRONG_CAREER = 'WRONG_CAREER'
+REJECT_TOO_MANY_COPIES = 'TOO_MANY_COPIES'
+REJECT_TOO_MANY_LEGENDARY = 'TOO_MANY_LEGENDARY'
+REJECT_WRONG_DECK_SIZE = 'WRONG_DECK_SIZE'
+REJECT_BAD_COUNT = 'BAD_COUNT'
+
+# 自动补全索引中值的类型
+AUTOCOMPLETE_CARD = 'card'
+AUTOCOMPLETE_CAREER = 'career'
+
+# 各职业基本英雄的 dbfId，用于生成卡组代码
+HERO_DBF_IDS = {
+    'WARRIOR': 7,
+    'SHAMAN': 1066,
+    'ROGUE': 930,
+    'PALADIN': 671,
+    'HUNTER': 31,
+    'DRUID': 274,
+    'WARLOCK': 893,
+    'MAGE': 637,
+    'PRIEST': 813,
+}
+
+# 卡组相似度的计算方式
+SIMILARITY_JACCARD = 'jaccard'
+SIMILARITY_COSINE = 'cosine'
+
+# 卡组合集中实时累计的卡组字段，修改这些字段时将同步更新所在合集的累计数据
+DECK_STATS_FIELDS = ('games', 'wins', 'draws')
+
 
 class Career:
     def __init__(self, class_name):
@@ -51,13 +108,16 @@ class Career:
         """
 
         try:
-            return CAREER_NAMES[self.class_name]
+            return current_context().career_names[self.class_name]
         except (TypeError, KeyError):
             return self.class_name
 
     @property
     def heroes(self):
-        return Careers.CAREER_HEROES.get(self.class_name, list())
+        """
+        当前上下文中该职业的英雄名称，在载入卡牌时获取
+        """
+        return list(current_context().cards.heroes.get(self.class_name, ()))
 
     def __repr__(self):
         return '<{}: {} ({})>'.format(
@@ -92,9 +152,6 @@ class Careers(list):
         'DREAM',
     )
 
-    # 各职业的英雄名称，将在 Cards.load() 时被添加
-    CAREER_HEROES = dict()
-
     def __init__(self):
         super(Careers, self).__init__()
 
@@ -130,7 +187,7 @@ class Careers(list):
             return self.get('NEUTRAL')
 
         # 需要载入卡牌来填充各职业的英雄关键词
-        CARDS.load_if_empty()
+        current_context().cards.load_if_empty()
 
         if isinstance(keywords, str):
             keywords = _split_keywords(keywords)
@@ -153,6 +210,148 @@ class Careers(list):
         return self[:9]
 
 
+class Snapshot:
+    """
+    卡牌或卡组合集在某一时刻的只读快照，包括全部元素和预先建好的索引
+
+    取得快照后，即使合集在其他线程中被刷新，快照的内容也不会改变，读取时无需加锁
+    """
+
+    __slots__ = ('items', 'index', 'version')
+
+    def __init__(self, items, index, version):
+        """
+        :param items: 元素列表
+        :param index: ID 与元素的对应关系
+        :param version: 合集的版本号，每次修改合集都会增加
+        """
+        self.items = tuple(items)
+        self.index = MappingProxyType(index)
+        self.version = version
+
+    def get(self, item_id):
+        return self.index.get(item_id)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __getitem__(self, item):
+        return self.items[item]
+
+    def __repr__(self):
+        return '<{}: {} items (version {})>'.format(self.__class__.__name__, len(self.items), self.version)
+
+
+class _SnapshotList(list):
+    """
+    可生成快照的列表，Cards 和 Decks 的基类
+
+    * snapshot 属性在首次读取时生成快照，快照与列表共用索引，直到列表被修改时才复制索引 (写时复制)
+    * 刷新数据时，应先在旁边构建好新的元素和索引，再通过 _publish() 一次性替换，读取方不会看到空的或不完整的合集
+    """
+
+    def __init__(self):
+        super(_SnapshotList, self).__init__()
+        self._index = dict()
+        self._version = 0
+        self._snapshot = None
+
+    @property
+    def snapshot(self):
+        """
+        当前内容的只读快照，需要在遍历期间保持一致时 (例如在服务中) 应使用快照而非合集本身
+        :return: Snapshot 对象
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            snapshot = Snapshot(self, self._index, self._version)
+            self._snapshot = snapshot
+        return snapshot
+
+    def _changed(self):
+        """
+        在修改内容之前调用，使当前的快照失效；若索引正被快照共用，则先复制一份
+        """
+        if self._snapshot is not None:
+            self._snapshot = None
+            self._index = dict(self._index)
+        self._version += 1
+
+    def _publish(self, items, index=None):
+        """
+        使用在旁边构建好的元素和索引替换当前内容，替换前即已建好新的快照
+        :param items: 新的元素列表
+        :param index: 新的索引，不填写则按元素的 id 属性生成
+        """
+
+        if index is None:
+            index = dict((item.id, item) for item in items)
+
+        snapshot = Snapshot(items, index, self._version + 1)
+
+        # 先发布新的快照：get 和 snapshot 只读取这一个引用，不会看到新旧混合的内容；之前取得的快照不受影响
+        self._snapshot = snapshot
+        self._index = index
+        self._version = snapshot.version
+        super(_SnapshotList, self).__setitem__(slice(None), snapshot.items)
+
+    def _get(self, item_id):
+        """
+        根据 id 获取元素，优先从当前快照中读取，避免在刷新数据期间读到与列表内容不一致的索引
+        """
+        snapshot = self._snapshot
+        if snapshot is not None:
+            return snapshot.get(item_id)
+        return self._index.get(item_id)
+
+    def append(self, item):
+        self._changed()
+        return super(_SnapshotList, self).append(item)
+
+    def extend(self, items):
+        self._changed()
+        return super(_SnapshotList, self).extend(items)
+
+    def insert(self, i, item):
+        self._changed()
+        return super(_SnapshotList, self).insert(i, item)
+
+    def remove(self, item):
+        self._changed()
+        return super(_SnapshotList, self).remove(item)
+
+    def pop(self, i=-1):
+        self._changed()
+        return super(_SnapshotList, self).pop(i)
+
+    def clear(self):
+        self._changed()
+        return super(_SnapshotList, self).clear()
+
+    def sort(self, *args, **kwargs):
+        self._changed()
+        return super(_SnapshotList, self).sort(*args, **kwargs)
+
+    def reverse(self):
+        self._changed()
+        return super(_SnapshotList, self).reverse()
+
+    def __setitem__(self, key, value):
+        self._changed()
+        return super(_SnapshotList, self).__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self._changed()
+        return super(_SnapshotList, self).__delitem__(key)
+
+    def __iadd__(self, other):
+        self._changed()
+        return super(_SnapshotList, self).__iadd__(other)
+
+
 class Card:
     """单张卡牌"""
 
@@ -186,17 +385,20 @@ class Card:
         self.classes = None
         self.multiClassGroup = None
         self.collectionText = None
+        # 卡牌的数字ID，用于卡组代码
+        self.dbfId = None
 
     @property
     def career(self):
-        return CAREERS.get(self.playerClass)
+        return current_context().careers.get(self.playerClass)
 
     @property
     def careers(self):
+        careers = current_context().careers
         if self.classes:
-            return list(map(lambda x: CAREERS.get(x), self.classes))
-        elif self.career == CAREERS.get('NEUTRAL'):
-            return CAREERS.basic
+            return list(map(lambda x: careers.get(x), self.classes))
+        elif self.playerClass == 'NEUTRAL':
+            return careers.basic
         elif self.career:
             return [self.career]
         else:
@@ -219,35 +421,95 @@ class Card:
         return hash('<__hs.Card__: name="{}", id="{}">'.format(self.name, self.id))
 
 
-class Cards(list):
+class Cards(_SnapshotList):
     """
     卡牌合集，附带一些实用的方法
     """
 
-    def __init__(self, json_path=None, update_if_not_found=True, lazy_load=False):
+    def __init__(self, json_path=None, update_if_not_found=True, lazy_load=False, language=None):
         """
         :param json_path: 读取或保存的JSON路径
         :param update_if_not_found: 选项，若上述文件不存在，则自动更新
         :param lazy_load: 选项，若为True，则在初始化时不载入实际数据，直到调用 get 或 search 方法
+        :param language: 卡牌数据的语言，默认为当前上下文的主语言
         """
         super(Cards, self).__init__()
 
+        context = current_context()
+
+        if not language:
+            language = context.language
+        self.language = language
+
         if not json_path:
-            json_path = os.path.join(DATA_DIR, CARDS_JSON_FILE_NAME)
+            json_path = os.path.join(context.data_dir, 'CARDS_{}.json'.format(language))
         self.json_path = json_path
 
-        self._index = dict()
-
         self.update_if_not_found = update_if_not_found
+        # 模糊查找的索引: (卡牌版本, 其他语言, CardLookup 对象)
+        self._lookup = None
+        # 自动补全的索引: (卡牌版本, 其他语言, PrefixIndex 对象, 已加入的卡牌名称)
+        self._prefix_index = None
+        # 自动补全中卡牌的权重
+        self._popularity = dict()
+        # 已载入的其他语言的卡牌合集
+        self._other_cards = dict()
+        # 数据目录中已下载卡牌数据的语言: (数据目录的修改时间, 语言列表)
+        self._languages = None
+        # dbfId 的索引: (卡牌版本, dict(dbfId: 卡牌))
+        self._dbf_index = None
+        # 卡牌ID的整数编号，用于 DeckCards，重新载入后编号不变
+        self._numbers = dict()
+        self._numbered = list()
+        self._numbers_lock = threading.Lock()
+        # 各职业的英雄名称: dict(class_name: [英雄名称, ...])，在载入时获取
+        self._heroes = dict()
 
         if not lazy_load:
             self.load()
 
+    @property
+    def heroes(self):
+        """
+        各职业的英雄名称，只读
+        :return: dict(class_name: [英雄名称, ...])
+        """
+        return MappingProxyType(self._heroes)
+
     def append(self, card):
+        self._changed()
         self._index[card.id] = card
+        number = self._numbers.get(card.id)
+        if number is not None:
+            self._numbered[number] = card
         return super(Cards, self).append(card)
 
+    def _publish(self, items, index=None):
+        super(Cards, self)._publish(items, index)
+        # 已编号的卡牌指向新载入的卡牌对象；新数据中已没有的卡牌保留原有的卡牌对象，已有的卡组仍可正常使用
+        for card_id, number in self._numbers.items():
+            card = self._index.get(card_id)
+            if card is not None:
+                self._numbered[number] = card
+
+    def card_number(self, card_id):
+        """
+        获取卡牌ID的整数编号，编号在首次获取时分配，之后 (包括重新载入卡牌后) 不变
+        :param card_id: 卡牌ID，可以是尚未载入的卡牌
+        :return: 整数编号
+        """
+
+        number = self._numbers.get(card_id)
+        if number is None:
+            with self._numbers_lock:
+                number = self._numbers.get(card_id)
+                if number is None:
+                    self._numbered.append(self._index.get(card_id))
+                    number = self._numbers[card_id] = len(self._numbered) - 1
+        return number
+
     def clear(self):
+        self._changed()
         self._index.clear()
         return super(Cards, self).clear()
 
@@ -258,9 +520,10 @@ class Cards(list):
         if not self:
             self.load(json_path)
 
+    @timed('cards.load')
     def load(self, json_path=None):
         """
-        载入本地的卡牌数据
+        载入本地的卡牌数据，载入完成后才会替换原有的卡牌
         :param json_path: 文件路径
         """
 
@@ -275,13 +538,16 @@ class Cards(list):
                 logging.warning('未找到卡牌数据，请使用 Cards().update() 获取最新的数据')
             return
 
-        with open(json_path) as f:
-            json_data = json.load(f)
-
-        self.clear()
+        with span('cards.load.parse'):
+            with open(json_path) as f:
+                json_data = json.load(f)
 
         logging.info('载入卡牌数据 {}'.format(json_path))
 
+        cards = list()
+        index = dict()
+        heroes = dict()
+
         for data in json_data:
             card = Card()
 
@@ -293,14 +559,18 @@ class Cards(list):
                 card.collectible = False
 
             if card.type == 'HERO':
-                # 将发现的英雄添加到 Careers.CAREER_HEROES 中
-                if card.playerClass not in Careers.CAREER_HEROES:
-                    Careers.CAREER_HEROES[card.playerClass] = list()
-                if card.name not in Careers.CAREER_HEROES[card.playerClass]:
-                    Careers.CAREER_HEROES[card.playerClass].append(card.name)
+                # 记录各职业的英雄名称，只属于这个卡牌合集 (及其所在的上下文)
+                career_heroes = heroes.setdefault(card.playerClass, list())
+                if card.name not in career_heroes:
+                    career_heroes.append(card.name)
+
+            cards.append(card)
+            index[card.id] = card
 
-            self.append(card)
+        self._heroes = heroes
+        self._publish(cards, index)
 
+    @timed('cards.update')
     def update(self, json_path=None, hs_version_code=None):
         """
         获取卡牌数据，保存为JSON，并返回一个新的 Cards 对象
@@ -323,10 +593,11 @@ class Cards(list):
             logging.info('找到最新的对应炉石版本号: {}'.format(hs_version_code))
 
         json_url = '{}{}/{}/cards.json'.format(
-            CARDS_SOURCE_URL, hs_version_code, MAIN_LANGUAGE)
+            CARDS_SOURCE_URL, hs_version_code, self.language)
 
         logging.info('正在下载卡牌数据')
-        r = s.get(json_url)
+        with span('cards.update.fetch'):
+            r = s.get(json_url)
         r.raise_for_status()
 
         # 校验JSON
@@ -348,8 +619,23 @@ class Cards(list):
         :return: 单张卡牌
         """
         self.load_if_empty()
-        return self._index.get(card_id)
+        return self._get(card_id)
+
+    def get_by_dbf_id(self, dbf_id):
+        """
+        根据 dbfId 获取卡牌
+        :param dbf_id: 卡牌的数字ID
+        :return: 单张卡牌
+        """
+
+        self.load_if_empty()
+        cached = self._dbf_index
+        if not cached or cached[0] != self._version:
+            cached = self._dbf_index = self._version, dict(
+                (card.dbfId, card) for card in self if card.dbfId is not None)
+        return cached[1].get(dbf_id)
 
+    @timed('cards.search')
     def search(
             self,
             in_name=None, in_text=None, career=None,
@@ -402,11 +688,424 @@ class Cards(list):
 
         return found
 
+    @timed('cards.fuzzy_search')
+    def fuzzy_search(self, name, top_k=5, languages=None, collectible=None):
+        """
+        根据名称模糊查找卡牌，可容忍拼写错误，并可使用其他语言的名称或中文名称的拼音
+        :param name: 名称
+        :param top_k: 最多返回的数量
+        :param languages: 同时查找的其他语言，默认为数据目录中已下载卡牌数据的所有语言
+        :param collectible: 是否可收集
+        :return: 卡牌列表，按相似度倒排
+        """
+
+        self.load_if_empty()
+        lookup = self._get_lookup(languages)
+
+        accept = None
+        if collectible is not None:
+            def accept(card_id):
+                card = self._index.get(card_id)
+                return card is not None and card.collectible == collectible
+
+        found = list()
+        for card_id, _ in lookup.search(name, top_k, accept):
+            card = self._index.get(card_id)
+            if card is not None:
+                found.append(card)
+        return found
+
+    def _get_lookup(self, languages=None):
+        """
+        获取模糊查找的索引，索引在首次使用时建立，卡牌更新后重建
+        """
+
+        languages = self._get_languages(languages)
+
+        cached = self._lookup
+        if cached and cached[:2] == (self._version, languages):
+            return cached[2]
+
+        lookup = CardLookup(self, *self._get_other_cards(languages))
+        self._lookup = self._version, languages, lookup
+        return lookup
+
+    def _get_languages(self, languages=None):
+        """
+        :param languages: 其他语言，默认为数据目录中已下载卡牌数据的所有语言
+        :return: 不包括当前语言的 tuple
+        """
+        if languages is None:
+            languages = self._downloaded_languages()
+        return tuple(language for language in languages if language != self.language)
+
+    def _downloaded_languages(self):
+        """
+        数据目录中已下载卡牌数据的语言，数据目录中有文件增删时才重新查找
+        """
+        data_dir = os.path.dirname(self.json_path)
+        try:
+            mtime = os.stat(data_dir or os.curdir).st_mtime_ns
+        except OSError:
+            return list()
+
+        cached = self._languages
+        if cached and cached[0] == mtime:
+            return cached[1]
+
+        languages = [
+            language for language in sorted(CAREER_NAMES_ALL_LANGUAGES)
+            if os.path.isfile(os.path.join(data_dir, 'CARDS_{}.json'.format(language)))]
+        self._languages = mtime, languages
+        return languages
+
+    def _get_other_cards(self, languages):
+        """
+        获取其他语言的卡牌合集，每种语言只载入一次
+
+        这些卡牌合集只用于查找和补全，其英雄名称只保存在各自的合集中，不会出现在当前上下文的职业中
+        """
+        found = list()
+        data_dir = os.path.dirname(self.json_path)
+        for language in languages:
+            cards = self._other_cards.get(language)
+            if cards is None:
+                cards = self._other_cards[language] = Cards(
+                    json_path=os.path.join(data_dir, 'CARDS_{}.json'.format(language)),
+                    update_if_not_found=False, language=language)
+            found.append(cards)
+        return found
+
+    @timed('cards.autocomplete')
+    def autocomplete(self, prefix, limit=10, languages=None):
+        """
+        根据已输入的前缀补全可收集卡牌、职业和英雄的名称
+        :param prefix: 已输入的前缀
+        :param limit: 最多返回的数量
+        :param languages: 同时补全的其他语言，默认为数据目录中已下载卡牌数据的所有语言
+        :return: 卡牌或职业的列表 (英雄名称对应其职业)
+        """
+
+        careers = current_context().careers
+        found = list()
+        for (kind, value), _ in self.prefix_index(languages).complete(prefix, limit):
+            found.append(self._index.get(value) if kind == AUTOCOMPLETE_CARD else careers.get(value))
+        return found
+
+    def set_popularity(self, popularity):
+        """
+        设置自动补全中卡牌的权重，权重高的卡牌排在前面
+        :param popularity: dict，key 为卡牌ID，value 为权重，例如 lookup.decks_popularity(decks) 的结果
+        """
+
+        self._popularity = dict(popularity or ())
+        if self._prefix_index:
+            self._prefix_index[2].set_weights(self._popularity_weights())
+
+    def _popularity_weights(self):
+        return dict(((AUTOCOMPLETE_CARD, card_id), weight) for card_id, weight in self._popularity.items())
+
+    def prefix_index(self, languages=None):
+        """
+        获取自动补全的前缀索引，可通过其 cursor() 方法逐个按键补全
+        索引在首次使用时建立，之后卡牌有更新时 (例如 update 或 load 之后) 只加入或移除有变化的卡牌
+        :param languages: 同时补全的其他语言，默认为数据目录中已下载卡牌数据的所有语言
+        :return: PrefixIndex 对象，其中的值为 ('card', 卡牌ID) 或 ('career', class_name)
+        """
+
+        self.load_if_empty()
+        languages = self._get_languages(languages)
+
+        cached = self._prefix_index
+        if cached and cached[1] == languages:
+            version, _, index, names = cached
+            if version == self._version:
+                return index
+        else:
+            index = PrefixIndex()
+            index.set_weights(self._popularity_weights())
+            names = dict()
+
+        new_names = self._autocomplete_names(languages)
+        for value, keys in names.items():
+            if new_names.get(value) != keys:
+                index.remove(value)
+        for value, keys in new_names.items():
+            if names.get(value) != keys:
+                for key, text in keys:
+                    index.add(text, value, key)
+
+        self._prefix_index = self._version, languages, index, new_names
+        return index
+
+    def _autocomplete_names(self, languages):
+        """
+        :return: dict，key 为自动补全索引中的值，value 为 ((标准化的名称, 原名称), ...)
+        """
+
+        names = dict()
+
+        def add(value, text, keys=None):
+            keys = keys or [normalize_name(text)]
+            names.setdefault(value, list()).extend((key, text) for key in keys)
+
+        for cards in [self] + self._get_other_cards(languages):
+            with_pinyin = cards.language in PINYIN_LANGUAGES
+            for card in cards:
+                if not card.collectible or not card.name:
+                    continue
+                value = AUTOCOMPLETE_CARD, card.id
+                add(value, card.name)
+                if with_pinyin:
+                    add(value, card.name, pinyin_keys(card.name))
+
+        for career in current_context().careers.basic:
+            value = AUTOCOMPLETE_CAREER, career.class_name
+            add(value, career.class_name)
+            for language in (self.language,) + languages:
+                add(value, CAREER_NAMES_ALL_LANGUAGES[language][career.class_name])
+            for cards in [self] + self._get_other_cards(languages):
+                for hero in cards.heroes.get(career.class_name, ()):
+                    add(value, hero)
+
+        return dict((value, tuple(sorted(set(keys)))) for value, keys in names.items())
+
+
+class DeckCards(MutableMapping):
+    """
+    紧凑的卡组卡牌列表，用法与 Counter 相同 (key 为卡牌，value 为数量)
+
+    不保存卡牌对象，而是将卡牌的整数编号 (见 Cards.card_number) 和数量打包在一个 bytes 中，
+    每张卡牌只占 5 个字节；读取时通过所属的 Cards 对象还原为卡牌对象 (卡牌重新载入后将得到新的卡牌对象)。
+    读取和修改单张卡牌时，key 可以是卡牌或卡牌ID；加减、交并等运算的结果为普通的 Counter
+    """
+
+    __slots__ = ('_cards', '_data')
+
+    # 每张卡牌: 编号 (uint32) 和数量 (uint8)
+    _ENTRY = struct.Struct('<IB')
+    _NUMBER = struct.Struct('<I')
+
+    def __init__(self, cards, items=()):
+        """
+        :param cards: 卡牌所属的 Cards 对象
+        :param items: 初始的卡牌，dict(卡牌: 数量) 或 [(卡牌, 数量), ...]
+        """
+        self._cards = cards
+        self._data = b''
+        if isinstance(items, Mapping):
+            items = items.items()
+        self._pack((cards.card_number(card.id), count) for card, count in items if card is not None)
+
+    @classmethod
+    def from_ids(cls, cards, card_counts):
+        """
+        :param cards: 卡牌所属的 Cards 对象
+        :param card_counts: [(卡牌ID, 数量), ...]
+        """
+        deck_cards = cls(cards)
+        deck_cards._pack((cards.card_number(card_id), count) for card_id, count in card_counts)
+        return deck_cards
+
+    @classmethod
+    def from_ids_list(cls, cards, card_counts_list):
+        """
+        批量生成多个卡组的卡牌列表，相同的 (卡牌ID, 数量) 只转换和打包一次
+        :param cards: 卡牌所属的 Cards 对象
+        :param card_counts_list: 每个卡组的 [(卡牌ID, 数量), ...] 或 dict(卡牌ID: 数量)，卡组内的卡牌ID不应重复
+        :return: DeckCards 的列表
+        """
+
+        entries = dict()
+        pack = cls._ENTRY.pack
+        new = cls.__new__
+
+        found = list()
+        for card_counts in card_counts_list:
+            if isinstance(card_counts, Mapping):
+                card_counts = card_counts.items()
+            elif not isinstance(card_counts, (list, tuple)):
+                card_counts = list(card_counts)
+            try:
+                data = b''.join(map(entries.__getitem__, card_counts))
+            except KeyError:
+                # 出现了新的 (卡牌ID, 数量)
+                for key in card_counts:
+                    if key not in entries:
+                        card_id, count = key
+                        if not 0 <= count <= 255:
+                            raise ValueError('卡牌数量应在 0 到 255 之间: {}'.format(count))
+                        entries[key] = pack(cards.card_number(card_id), count)
+                data = b''.join(map(entries.__getitem__, card_counts))
+            deck_cards = new(cls)
+            deck_cards._cards = cards
+            deck_cards._data = data
+            found.append(deck_cards)
+        return found
+
+    def _pack(self, numbered_counts):
+        merged = dict()
+        for number, count in numbered_counts:
+            if not 0 <= count <= 255:
+                raise ValueError('卡牌数量应在 0 到 255 之间: {}'.format(count))
+            merged[number] = count
+        self._data = b''.join(self._ENTRY.pack(number, count) for number, count in merged.items())
+
+    def _entries(self):
+        return self._ENTRY.iter_unpack(self._data)
+
+    def _offset(self, card):
+        """
+        :param card: 卡牌或卡牌ID
+        :return: 卡牌在 _data 中的位置，不存在时返回 -1
+        """
+
+        if card is None:
+            return -1
+        number = self._cards._numbers.get(getattr(card, 'id', card))
+        if number is None:
+            return -1
+
+        # 在 bytes 中直接查找编号，跳过未对齐到条目开头的匹配
+        key = self._NUMBER.pack(number)
+        data = self._data
+        pos = data.find(key)
+        while pos >= 0 and pos % self._ENTRY.size:
+            pos = data.find(key, pos + 1)
+        return pos
+
+    def __getitem__(self, card):
+        # 与 Counter 相同，不存在的卡牌数量为 0
+        pos = self._offset(card)
+        return self._data[pos + 4] if pos >= 0 else 0
+
+    def __contains__(self, card):
+        return self._offset(card) >= 0
+
+    def get(self, card, default=None):
+        pos = self._offset(card)
+        return self._data[pos + 4] if pos >= 0 else default
+
+    def __setitem__(self, card, count):
+        if not 0 <= count <= 255:
+            raise ValueError('卡牌数量应在 0 到 255 之间: {}'.format(count))
+        pos = self._offset(card)
+        data = self._data
+        if pos >= 0:
+            self._data = data[:pos + 4] + bytes((count,)) + data[pos + 5:]
+        else:
+            number = self._cards.card_number(getattr(card, 'id', card))
+            self._data = data + self._ENTRY.pack(number, count)
+
+    def __delitem__(self, card):
+        pos = self._offset(card)
+        if pos < 0:
+            raise KeyError(card)
+        self._data = self._data[:pos] + self._data[pos + 5:]
+
+    def __iter__(self):
+        numbered = self._cards._numbered
+        for number, _ in self._entries():
+            yield numbered[number]
+
+    def __len__(self):
+        return len(self._data) // self._ENTRY.size
+
+    def items(self):
+        numbered = self._cards._numbered
+        return [(numbered[number], count) for number, count in self._entries()]
+
+    def values(self):
+        return [count for _, count in self._entries()]
+
+    def keys(self):
+        return list(self)
+
+    def copy(self):
+        deck_cards = DeckCards(self._cards)
+        deck_cards._data = self._data
+        return deck_cards
+
+    def to_counter(self):
+        return Counter(dict(self.items()))
+
+    def most_common(self, n=None):
+        return self.to_counter().most_common(n)
+
+    def elements(self):
+        return self.to_counter().elements()
+
+    def total(self):
+        return sum(self.values())
+
+    def __eq__(self, other):
+        if isinstance(other, Mapping):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    __hash__ = None
+
+    def __add__(self, other):
+        return self.to_counter() + _to_counter(other)
+
+    def __radd__(self, other):
+        return _to_counter(other) + self.to_counter()
+
+    def __sub__(self, other):
+        return self.to_counter() - _to_counter(other)
+
+    def __rsub__(self, other):
+        return _to_counter(other) - self.to_counter()
+
+    def __and__(self, other):
+        return self.to_counter() & _to_counter(other)
+
+    __rand__ = __and__
+
+    def __or__(self, other):
+        return self.to_counter() | _to_counter(other)
+
+    __ror__ = __or__
+
+    def __reduce__(self):
+        # 序列化时只保存卡牌ID，还原时使用当前上下文的卡牌
+        return _restore_deck_cards, ([(getattr(card, 'id', None), count) for card, count in self.items()],)
+
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, dict(self.items()))
+
+
+def _to_counter(cards):
+    if isinstance(cards, Counter):
+        return cards
+    if isinstance(cards, DeckCards):
+        return cards.to_counter()
+    return Counter(cards)
+
+
+def deck_cards(cards, card_counts):
+    """
+    由卡牌ID和数量生成卡组的卡牌列表
+    :param cards: 用于将卡牌ID转化为卡牌对象，为 Cards 对象时生成紧凑的 DeckCards，否则生成 Counter
+    :param card_counts: [(卡牌ID, 数量), ...]
+    """
+    if isinstance(cards, Cards):
+        return DeckCards.from_ids(cards, card_counts)
+    return Counter(dict((cards.get(card_id), count) for card_id, count in card_counts))
+
+
+def _restore_deck_cards(card_counts):
+    return DeckCards.from_ids(
+        current_context().cards, [(card_id, count) for card_id, count in card_counts if card_id is not None])
+
 
 class Deck:
     source = None
     DECK_URL_TEMPLATE = None
 
+    # 从JSON读取时需要转换的字段，value 为转换函数，例如将字串转换为 datetime
+    field_parsers = dict()
+
     def __init__(self):
         self.name = ''
         self.id = ''
@@ -418,6 +1117,34 @@ class Deck:
         self.wins = 0
         self.draws = 0
 
+    def __setattr__(self, key, value):
+        watchers = self.__dict__.get('_watchers') if key in DECK_STATS_FIELDS else None
+        if watchers:
+            delta = (value or 0) - (self.__dict__.get(key) or 0)
+            super(Deck, self).__setattr__(key, value)
+            for aggregates in list(watchers):
+                aggregates.on_change(self, key, delta)
+        else:
+            super(Deck, self).__setattr__(key, value)
+
+    def __getstate__(self):
+        # 所在合集的引用仅在当前进程中有效
+        state = dict(self.__dict__)
+        state.pop('_watchers', None)
+        return state
+
+    def _watch(self, aggregates):
+        watchers = self.__dict__.get('_watchers')
+        if watchers is None:
+            watchers = WeakSet()
+            super(Deck, self).__setattr__('_watchers', watchers)
+        watchers.add(aggregates)
+
+    def _unwatch(self, aggregates):
+        watchers = self.__dict__.get('_watchers')
+        if watchers is not None:
+            watchers.discard(aggregates)
+
     @property
     def win_rate(self):
         if self.games:
@@ -438,9 +1165,74 @@ class Deck:
 
     @property
     def url(self):
-        if self.id:
+        if self.id and self.DECK_URL_TEMPLATE:
             return self.DECK_URL_TEMPLATE.format(self.id)
 
+    @property
+    def fingerprint(self):
+        """
+        与数据源无关的卡组指纹，职业和卡牌相同的卡组指纹相同，可用于去重
+        :return: 32 位十六进制字符串
+        """
+        return deckstrings.fingerprint(
+            self.career.class_name if self.career else None,
+            [(card.id, count) for card, count in self.cards.items()])
+
+    @property
+    def deckstring(self):
+        """
+        炉石传说官方格式的卡组代码，可在游戏中直接导入
+        """
+
+        if not self.career or self.career.class_name not in HERO_DBF_IDS:
+            raise ValueError('无法为该职业生成卡组代码: {}'.format(self.career))
+
+        card_counts = list()
+        for card, count in self.cards.items():
+            if card.dbfId is None:
+                raise ValueError('卡牌缺少 dbfId: {}'.format(card))
+            card_counts.append((card.dbfId, count))
+
+        format_type = deckstrings.FORMAT_WILD if self.mode == MODE_WILD else deckstrings.FORMAT_STANDARD
+        return deckstrings.encode([HERO_DBF_IDS[self.career.class_name]], card_counts, format_type)
+
+    def from_deckstring(self, deckstring, cards=None):
+        """
+        从卡组代码读取职业和卡牌
+        :param deckstring: 卡组代码
+        :param cards: 用于将 dbfId 转化为卡牌对象
+        """
+
+        heroes, card_counts, _ = deckstrings.decode(deckstring)
+
+        if not cards:
+            cards = current_context().cards
+
+        career = None
+        careers = current_context().careers
+        for hero in heroes:
+            for class_name, dbf_id in HERO_DBF_IDS.items():
+                if dbf_id == hero:
+                    career = careers.get(class_name)
+                    break
+            else:
+                # 其他英雄皮肤
+                hero_card = cards.get_by_dbf_id(hero)
+                if hero_card is not None:
+                    career = careers.get(hero_card.playerClass)
+        if not career:
+            raise ValueError('卡组代码中的英雄未知: {}'.format(heroes))
+
+        counts = Counter()
+        for dbf_id, count in card_counts:
+            card = cards.get_by_dbf_id(dbf_id)
+            if card is None:
+                raise ValueError('未找到卡牌: dbfId {}'.format(dbf_id))
+            counts[card.id] += count
+
+        self.career = career
+        self.cards = deck_cards(cards, counts.items())
+
     @property
     def crafting_cost(self):
         dust = 0
@@ -454,8 +1246,13 @@ class Deck:
         用于保存为JSON
         :return 字典对象
         """
-        dct = deepcopy(self.__dict__)
-        dct['career'] = self.career.class_name
+        # 卡牌单独转换，避免深拷贝其中的 Card 对象；以下划线开头的为内部属性，不保存
+        dct = dict()
+        for k, v in self.__dict__.items():
+            if k not in ('career', 'cards') and not k.startswith('_'):
+                dct[k] = deepcopy(v)
+        # 只读取了部分字段的卡组 (见 Decks.load 的 fields 参数) 可能没有职业
+        dct['career'] = self.career.class_name if self.career else None
 
         cards_dict = dict()
         for card, count in self.cards.items():
@@ -473,16 +1270,84 @@ class Deck:
 
         class_name = dct.pop('career')
         cards_dict = dct.pop('cards', dict())
-        self.career = CAREERS.get(class_name)
+        self.career = current_context().careers.get(class_name)
 
         if not cards:
-            cards = CARDS
+            cards = current_context().cards
 
-        for card_id, count in cards_dict.items():
-            self.cards[cards.get(card_id)] = count
+        self.cards = deck_cards(cards, cards_dict.items())
 
         for k, v in dct.items():
-            setattr(self, k, v)
+            parser = self.field_parsers.get(k)
+            setattr(self, k, parser(v) if parser else v)
+
+    @classmethod
+    def from_dicts(cls, dcts, cards=None, fields=None):
+        """
+        批量从JSON读取卡组，结果与逐个调用 from_dict 相同，但快得多:
+        各卡组的卡牌ID通过同一张编号表批量转换；默认属性复制自一个新建的卡组，
+        其余字段直接写入卡组的 __dict__ (新的卡组尚未加入任何合集，无需通知累计数据)；
+        若子类重写了 from_dict，则仍逐个调用 from_dict
+        :param dcts: 读取到的字典对象列表
+        :param cards: 用于将卡牌ID转化为卡牌对象
+        :param fields: 需要读取的字段，不填写则读取全部字段；卡组ID总会被读取，未读取的字段保持默认值
+        :return: 卡组列表
+        """
+
+        if not cards:
+            cards = current_context().cards
+        careers = current_context().careers
+        parsers = cls.field_parsers
+        if fields is not None:
+            fields = set(fields)
+            fields.add('id')
+
+        if cls.from_dict is not Deck.from_dict:
+            # from_dict 总会读取职业
+            if fields is not None:
+                fields.add('career')
+            decks = list()
+            for dct in dcts:
+                deck = cls()
+                deck.from_dict(dict((k, v) for k, v in dct.items() if fields is None or k in fields), cards)
+                decks.append(deck)
+            return decks
+
+        template = cls().__dict__
+        # 可变的默认值 (例如 cards) 需要为每个卡组单独复制
+        mutable = [k for k, v in template.items() if isinstance(v, (dict, list, set))]
+        new = cls.__new__
+
+        decks = list()
+        cards_dicts = list()
+        for dct in dcts:
+            deck = new(cls)
+            values = dict(template)
+            for k, v in dct.items():
+                if fields is not None and k not in fields:
+                    continue
+                if k == 'cards':
+                    cards_dicts.append((deck, v))
+                elif k == 'career':
+                    values[k] = careers.get(v)
+                else:
+                    parser = parsers.get(k)
+                    values[k] = parser(v) if parser else v
+            for k in mutable:
+                if values[k] is template[k]:
+                    values[k] = template[k].copy()
+            deck.__dict__ = values
+            decks.append(deck)
+
+        if isinstance(cards, Cards):
+            compact_list = DeckCards.from_ids_list(cards, [cards_dict for _, cards_dict in cards_dicts])
+            for (deck, _), compact in zip(cards_dicts, compact_list):
+                deck.__dict__['cards'] = compact
+        else:
+            for deck, cards_dict in cards_dicts:
+                deck.__dict__['cards'] = deck_cards(cards, cards_dict.items())
+
+        return decks
 
     def open(self):
         if self.url:
@@ -494,59 +1359,281 @@ class Deck:
         return '<{}: {}>'.format(self.__class__.__name__, self.name)
 
 
-class Decks(list):
-    deck_class = Deck
+class DeckTotals:
+    """
+    一组卡组的累计数据，包括卡组数、总游戏次数、总获胜次数和总平局次数
+    """
 
-    def __init__(
-            self, deck_list=None, json_path=None, auto_load=False, update_if_not_found=True, cards=None):
-        """
-        :param deck_list: 一个 Deck 列表，用于直接转换为 Decks 对象
-        :param cards: Cards 对象，用于将卡组内的卡牌ID转化为Card对象
-        """
-        super(Decks, self).__init__()
+    __slots__ = ('decks', 'games', 'wins', 'draws')
 
-        self.source = self.deck_class.source
+    def __init__(self):
+        self.decks = 0
+        self.games = 0
+        self.wins = 0
+        self.draws = 0
 
-        self._index = dict()
+    @property
+    def win_rate(self):
+        if self.games:
+            return self.wins / self.games
 
-        if deck_list:
-            self.extend(deck_list)
+    def add(self, deck, sign=1):
+        self.decks += sign
+        self.games += sign * (deck.games or 0)
+        self.wins += sign * (deck.wins or 0)
+        self.draws += sign * (deck.draws or 0)
 
-        if not json_path:
-            json_path = os.path.join(DATA_DIR, 'DECKS_{}.json'.format(self.source))
+    def __repr__(self):
+        return '<{}: {} decks, {} games, {} wins>'.format(
+            self.__class__.__name__, self.decks, self.games, self.wins)
 
-        self.json_path = json_path
-        self.update_if_not_found = update_if_not_found
 
-        if not cards:
-            cards = CARDS
-        self.cards = cards
-        self.cards.load_if_empty()
+class _DeckAggregates:
+    """
+    卡组合集的累计数据，按 (职业, 模式) 分组，职业或模式为 None 表示不区分
 
-        if auto_load:
-            self.load(self.json_path)
+    卡组加入或移出合集，以及修改卡组的 games, wins, draws 时增量更新，读取时无需遍历合集；
+    卡组所属的职业和模式在加入时确定，之后修改卡组中的卡牌不会改变其分组
+    """
 
-    def append(self, deck):
-        if not isinstance(deck, Deck):
-            raise TypeError('{} 只能追加 Deck 对象'.format(self.__class__.__name__))
+    def __init__(self):
+        self.groups = dict()
+        # 卡组: [在合集中出现的次数, 所属的分组列表]
+        self._members = dict()
+
+    def _groups_of(self, deck, mode):
+        groups = list()
+        # 没有职业 (或模式) 的卡组只计入一次，不能重复计入不区分职业的分组
+        for key in dict.fromkeys(((None, None), (deck.career, None), (None, mode), (deck.career, mode))):
+            group = self.groups.get(key)
+            if group is None:
+                group = self.groups[key] = DeckTotals()
+            groups.append(group)
+        return groups
+
+    def add(self, deck, mode=None):
+        """
+        :param deck: 加入合集的卡组
+        :param mode: 已知的卡组模式，不填写则通过 deck.mode 获取
+        """
+        member = self._members.get(deck)
+        if member is None:
+            if mode is None:
+                mode = deck.mode
+            member = self._members[deck] = [0, self._groups_of(deck, mode)]
+            deck._watch(self)
+        member[0] += 1
+        for group in member[1]:
+            group.add(deck)
+
+    def discard(self, deck):
+        member = self._members.get(deck)
+        if member is None:
+            return
+        member[0] -= 1
+        for group in member[1]:
+            group.add(deck, -1)
+        if not member[0]:
+            del self._members[deck]
+            deck._unwatch(self)
+
+    def on_change(self, deck, key, delta):
+        count, groups = self._members[deck]
+        for group in groups:
+            setattr(group, key, getattr(group, key) + delta * count)
+
+    def get(self, career=None, mode=None):
+        return self.groups.get((career, mode)) or DeckTotals()
+
+
+class _CardPostings:
+    """
+    卡牌到卡组的倒排索引，每张卡牌对应一个 dict(卡组ID: 该卡牌在卡组中的数量)
+
+    倒排列表按卡组加入合集的先后排列，与合集中的顺序一致；卡组的卡牌在加入合集时确定，之后修改不会更新索引
+    """
+
+    def __init__(self):
+        self.postings = dict()
+        # 卡组ID: (卡牌总数, 各卡牌数量的平方和)，用于计算相似度
+        self.sizes = dict()
+
+    def add(self, deck):
+        for card, count in deck.cards.items():
+            posting = self.postings.get(card.id)
+            if posting is None:
+                posting = self.postings[card.id] = dict()
+            posting[deck.id] = count
+        counts = deck.cards.values()
+        self.sizes[deck.id] = sum(counts), sum(count * count for count in counts)
+
+    def discard(self, deck):
+        self.sizes.pop(deck.id, None)
+        for card in deck.cards:
+            posting = self.postings.get(card.id)
+            if posting:
+                posting.pop(deck.id, None)
+                if not posting:
+                    del self.postings[card.id]
+
+    def get(self, card_id):
+        return self.postings.get(card_id) or dict()
+
+
+def _check_decks(decks):
+    """
+    :return: 卡组列表，其中有不是 Deck 的对象时抛出 TypeError
+    """
+    decks = list(decks)
+    for deck in decks:
+        if not isinstance(deck, Deck):
+            raise TypeError('应为 Deck 对象，得到了 {}'.format(type(deck).__name__))
+    return decks
+
+
+def _card_count_items(cards):
+    """
+    :param cards: dict(卡牌或卡牌ID: 数量)，或卡牌或卡牌ID的列表 (数量均为 1)
+    :return: [(卡牌ID, 数量), ...]
+    """
+    if isinstance(cards, Mapping):
+        items = cards.items()
+    else:
+        items = ((card, 1) for card in cards)
+    return [(getattr(card, 'id', card), count) for card, count in items]
+
+
+class Decks(_SnapshotList):
+    deck_class = Deck
+
+    def __init__(
+            self, deck_list=None, json_path=None, auto_load=False, update_if_not_found=True, cards=None):
+        """
+        :param deck_list: 一个 Deck 列表，用于直接转换为 Decks 对象
+        :param cards: Cards 对象，用于将卡组内的卡牌ID转化为Card对象
+        """
+        super(Decks, self).__init__()
+
+        self.source = self.deck_class.source
+        # 累计数据和卡牌的倒排索引在首次使用时生成，之后随合集的修改增量更新
+        self._aggregates = None
+        self._postings = None
+
+        if deck_list:
+            self.extend(deck_list)
+
+        context = current_context()
+
+        if not json_path:
+            json_path = os.path.join(context.data_dir, 'DECKS_{}.json'.format(self.source))
+
+        self.json_path = json_path
+        self.update_if_not_found = update_if_not_found
+
+        if not cards:
+            cards = context.cards
+        self.cards = cards
+        self.cards.load_if_empty()
+
+        if auto_load:
+            self.load(self.json_path)
+
+    def append(self, deck):
+        if not isinstance(deck, Deck):
+            raise TypeError('{} 只能追加 Deck 对象'.format(self.__class__.__name__))
+        self._changed()
         self._index[deck.id] = deck
+        self._track(deck)
         return super(Decks, self).append(deck)
 
     def extend(self, decks):
+        decks = _check_decks(decks)
+        self._changed()
         for deck in decks:
-            if not isinstance(deck, Deck):
-                raise TypeError('应为 Deck 对象，得到了 {}'.format(type(deck).__name__))
             self._index[deck.id] = deck
+        for deck in decks:
+            self._track(deck)
         return super(Decks, self).extend(decks)
 
     def remove(self, deck):
+        self._changed()
         del self._index[deck.id]
-        return super(Decks, self).remove(deck)
+        super(Decks, self).remove(deck)
+        self._untrack(deck)
 
     def clear(self):
+        self._changed()
         self._index.clear()
+        self._reset_tracking()
         return super(Decks, self).clear()
 
+    def pop(self, i=-1):
+        deck = super(Decks, self).pop(i)
+        self._replace([deck], ())
+        return deck
+
+    def insert(self, i, deck):
+        _check_decks([deck])
+        super(Decks, self).insert(i, deck)
+        self._replace((), [deck])
+
+    def __setitem__(self, key, value):
+        old = list.__getitem__(self, key)
+        if isinstance(key, slice):
+            value = _check_decks(value)
+            super(Decks, self).__setitem__(key, value)
+            self._replace(old, value)
+        else:
+            _check_decks([value])
+            super(Decks, self).__setitem__(key, value)
+            self._replace([old], [value])
+
+    def __delitem__(self, key):
+        old = list.__getitem__(self, key)
+        super(Decks, self).__delitem__(key)
+        self._replace(old if isinstance(key, slice) else [old], ())
+
+    def __iadd__(self, other):
+        self.extend(other)
+        return self
+
+    def _replace(self, old, new):
+        """
+        在列表中移除或加入卡组后 (已调用 _changed)，同步更新索引、累计数据和倒排索引
+        :param old: 移除的卡组
+        :param new: 加入的卡组
+        """
+        for deck in old:
+            if self._index.get(deck.id) is deck:
+                del self._index[deck.id]
+            self._untrack(deck)
+        for deck in new:
+            self._index[deck.id] = deck
+            self._track(deck)
+
+    def _track(self, deck):
+        if self._aggregates is not None:
+            self._aggregates.add(deck)
+        if self._postings is not None:
+            self._postings.add(deck)
+
+    def _untrack(self, deck):
+        if self._aggregates is not None:
+            self._aggregates.discard(deck)
+        if self._postings is not None:
+            self._postings.discard(deck)
+
+    def _reset_tracking(self, aggregates=None):
+        self._aggregates = aggregates
+        self._postings = None
+
+    def _publish(self, items, index=None, aggregates=None):
+        """
+        :param aggregates: 已按新元素统计好的累计数据，不填写则在首次读取时生成
+        """
+        super(Decks, self)._publish(items, index)
+        self._reset_tracking(aggregates)
+
     def update(self, json_path=None):
         """
         从数据源获取卡组数据
@@ -556,6 +1643,7 @@ class Decks(list):
         # 具体的获取过程由子类实现
         pass
 
+    @timed('decks.save')
     def save(self, json_path=None):
         """
         将卡组合集保存为JSON文件
@@ -565,21 +1653,14 @@ class Decks(list):
         if not json_path:
             json_path = self.json_path
 
-        save_list = list()
-
-        for deck in self:
-            save_list.append(deck.to_dict())
-
-        _prepare_dir(json_path)
-        with open(json_path, 'w') as f:
-            json.dump(save_list, f, ensure_ascii=False)
-
-        logging.info('已保存到 {}'.format(json_path))
+        _save_decks(self, json_path)
 
-    def load(self, json_path=None):
+    @timed('decks.load')
+    def load(self, json_path=None, fields=None):
         """
-        从JSON文件中载入卡组合集
+        从JSON文件中载入卡组合集，载入完成后才会替换原有的卡组
         :param json_path: JSON文件路径
+        :param fields: 需要读取的字段，不填写则读取全部字段，例如只做统计时可使用 ('career', 'cards', 'games', 'wins')
         """
 
         if not json_path:
@@ -593,18 +1674,34 @@ class Decks(list):
 
         logging.info('载入卡组数据 {}'.format(json_path))
 
-        with open(json_path) as f:
-            data_list = json.load(f)
+        with span('decks.load.parse'):
+            with open(json_path) as f:
+                data_list = json.load(f)
+
+        with span('decks.load.build'):
+            decks = self.deck_class.from_dicts(data_list, self.cards, fields)
+            index = dict((deck.id, deck) for deck in decks)
 
-        self.clear()
-        for deck_dict in data_list:
-            deck = self.deck_class()
-            deck.from_dict(deck_dict, self.cards)
-            self.append(deck)
+        self._publish(decks, index)
 
     def get(self, deck_id):
-        return self._index.get(deck_id)
+        return self._get(deck_id)
+
+    def compact(self):
+        """
+        将各卡组的卡牌列表转换为紧凑的 DeckCards (例如由 Counter 手动构造的卡组)，以减少内存占用
+        :return: 转换的卡组数量
+        """
 
+        cards = self.cards or current_context().cards
+        converted = 0
+        for deck in self:
+            if not isinstance(deck.cards, DeckCards):
+                deck.cards = DeckCards(cards, deck.cards)
+                converted += 1
+        return converted
+
+    @timed('decks.search')
     def search(
             self,
             career=None,
@@ -612,6 +1709,8 @@ class Decks(list):
             min_win_rate=0.0,
             min_games=0,
             win_rate_top_n=None,
+            include=None,
+            exclude=None,
     ):
         """
         在当前卡组合集中搜索符合条件的卡组
@@ -620,43 +1719,243 @@ class Decks(list):
         :param min_win_rate: 最低胜率
         :param min_games: 最少游戏次数
         :param win_rate_top_n: 将结果按胜率倒排，并截取其中的前 n 个，若为负数则返回所有卡组
-        :return: 符合条件的卡组列表
+        :param include: 必须包含的卡牌，见 containing()
+        :param exclude: 不能包含的卡牌，见 containing()
+        :return: 符合条件的卡组，为只读的视图 (DecksView)，需要修改时可通过 to_decks() 转换为 Decks
+        """
+
+        if include or exclude:
+            items = tuple(self.containing(include, exclude))
+        elif self._snapshot is not None:
+            items = self._snapshot.items
+        else:
+            # 没有现成的快照时，先一次性复制列表 (替换数据期间也不会读到新旧混合的内容)，
+            # 视图只引用找到的卡组，不为整个合集生成快照
+            items = tuple(self)
+            rows, modes = _search_rows(items, range(len(items)), career, mode, min_win_rate, min_games, win_rate_top_n)
+            items = tuple(items[row] for row in rows)
+            return DecksView(items, None, self.cards, self.source, modes)
+
+        rows, modes = _search_rows(items, range(len(items)), career, mode, min_win_rate, min_games, win_rate_top_n)
+        return DecksView(items, rows, self.cards, self.source, modes)
+
+    def _get_postings(self):
+        postings = self._postings
+        if postings is None:
+            postings = _CardPostings()
+            for deck in self:
+                postings.add(deck)
+            self._postings = postings
+        return postings
+
+    def card_postings(self, card):
+        """
+        包含指定卡牌的卡组
+        :param card: 卡牌或卡牌ID
+        :return: dict(卡组ID: 该卡牌在卡组中的数量)，请勿修改
+        """
+        return self._get_postings().get(getattr(card, 'id', card))
+
+    @timed('decks.containing')
+    def containing(self, include=None, exclude=None):
+        """
+        通过卡牌的倒排索引查找包含或不包含指定卡牌的卡组，
+        若指定了 include，用时只与包含其中最少见卡牌的卡组数量有关，不需要遍历整个合集
+
+        :param include: 必须包含的卡牌，dict(卡牌或卡牌ID: 至少包含的数量)，或卡牌 (ID) 的列表
+        :param exclude: 不能包含的卡牌，dict(卡牌或卡牌ID: 达到该数量即排除)，或卡牌 (ID) 的列表
+        :return: 卡组列表，顺序与合集中相同
         """
 
+        index = self._index
+        postings = self._get_postings()
+        include = [(postings.get(card_id), count) for card_id, count in _card_count_items(include or ())]
+        exclude = [(postings.get(card_id), count) for card_id, count in _card_count_items(exclude or ())]
+
+        def excluded(deck_id):
+            for posting, count in exclude:
+                if posting.get(deck_id, 0) >= count:
+                    return True
+
+        if not include:
+            return [deck for deck in self if not excluded(deck.id)]
+
+        # 从最短的倒排列表开始，逐个检查其余的条件
+        include.sort(key=lambda x: len(x[0]))
+        (first, first_count), others = include[0], include[1:]
+
+        found = list()
+        for deck_id, count in first.items():
+            if count < first_count:
+                continue
+            for posting, min_count in others:
+                if posting.get(deck_id, 0) < min_count:
+                    break
+            else:
+                deck = index.get(deck_id)
+                if deck is not None and not excluded(deck_id):
+                    found.append(deck)
+        return found
+
+    @timed('decks.similar')
+    def similar(
+            self, cards, top_k=10, metric=SIMILARITY_JACCARD,
+            career=None, mode=None, min_win_rate=0.0, min_games=0):
+        """
+        查找与指定卡牌组合最相似的卡组，例如为未完成的卡组寻找参考，并给出需要加入和移除的卡牌
+
+        只计算至少包含一张相同卡牌的卡组 (通过卡牌的倒排索引)，并按 MaxScore 的方式剪枝:
+        先处理最少见的卡牌，当剩余卡牌可贡献的相似度上限已不足以让新的卡组进入前 k 名时，
+        后面的卡牌只更新已有候选的分数，不再遍历其完整的倒排列表
+
+        :param cards: Deck 对象，或 dict(卡牌或卡牌ID: 数量)
+        :param top_k: 返回的数量
+        :param metric: 相似度，可以是 SIMILARITY_JACCARD (按数量加权) 或 SIMILARITY_COSINE
+        :param career: 职业
+        :param mode: 模式，可以是 MODE_STANDARD 或 MODE_WILD，不填写则不限
+        :param min_win_rate: 最低胜率
+        :param min_games: 最少游戏次数
+        :return: [(卡组, 相似度, 需加入的卡牌, 需移除的卡牌), ...]，按相似度倒排，卡牌均为 Counter
+        """
+
+        if metric not in (SIMILARITY_JACCARD, SIMILARITY_COSINE):
+            raise ValueError('metric: should be {} or {}'.format(SIMILARITY_JACCARD, SIMILARITY_COSINE))
+
+        exclude_id = None
+        if isinstance(cards, Deck):
+            exclude_id = cards.id
+            cards = cards.cards
+
+        query = dict()
+        for card_id, count in _card_count_items(cards):
+            if count > 0:
+                query[card_id] = query.get(card_id, 0) + count
+        if not query or top_k < 1:
+            return list()
+
         if career:
             career = get_career(career)
 
-        def match(deck):
-            if (not career or deck.career == career) \
-                    and (not mode or deck.mode == mode) \
-                    and ((deck.win_rate or 0) >= min_win_rate) \
-                    and ((deck.games or 0) >= min_games):
-                return True
+        index = self._index
+        postings = self._get_postings()
+        jaccard = metric == SIMILARITY_JACCARD
+        query_total = sum(query.values())
+        query_norm = math.sqrt(sum(count * count for count in query.values()))
+
+        def score(deck_id, value):
+            total, squares = postings.sizes[deck_id]
+            if jaccard:
+                return value / (query_total + total - value)
+            return value / (query_norm * math.sqrt(squares))
+
+        # 从最少见的卡牌开始；bounds[i] 为只含第 i 张及之后卡牌的卡组可能达到的最高相似度
+        terms = sorted(query.items(), key=lambda x: len(postings.get(x[0])))
+        bounds = list()
+        remaining = 0
+        for _, count in reversed(terms):
+            remaining += count if jaccard else count * count
+            bounds.append(remaining / query_total if jaccard else math.sqrt(remaining) / query_norm)
+        bounds.reverse()
+
+        accepted = dict()
+
+        def accept(deck_id):
+            ok = accepted.get(deck_id)
+            if ok is None:
+                deck = index.get(deck_id)
+                ok = accepted[deck_id] = deck is not None and deck_id != exclude_id \
+                    and (not career or deck.career == career) \
+                    and (deck.win_rate or 0) >= min_win_rate \
+                    and (deck.games or 0) >= min_games \
+                    and (not mode or deck.mode == mode)
+            return ok
+
+        values = dict()
+        essential = True
+        for i, (card_id, count) in enumerate(terms):
+            posting = postings.get(card_id)
+
+            if essential and len(values) >= top_k:
+                # 已有候选的当前分数是其最终分数的下限
+                threshold = heapq.nlargest(top_k, (score(d, v) for d, v in values.items()))[-1]
+                essential = bounds[i] >= threshold
+
+            if essential:
+                for deck_id, deck_count in posting.items():
+                    value = min(count, deck_count) if jaccard else count * deck_count
+                    if deck_id in values:
+                        values[deck_id] += value
+                    elif accept(deck_id):
+                        values[deck_id] = value
+            else:
+                # 遍历倒排列表和候选中较短的一方
+                if len(posting) < len(values):
+                    pairs = ((d, c) for d, c in posting.items() if d in values)
+                else:
+                    pairs = ((d, posting.get(d)) for d in values)
+                for deck_id, deck_count in list(pairs):
+                    if deck_count:
+                        values[deck_id] += min(count, deck_count) if jaccard else count * deck_count
+
+        top = heapq.nlargest(top_k, ((score(d, v), d) for d, v in values.items()), key=lambda x: x[0])
+
+        query_cards = Counter()
+        for card_id, count in query.items():
+            card = self.cards.get(card_id)
+            if card is not None:
+                query_cards[card] = count
+
+        found = list()
+        for similarity, deck_id in top:
+            deck = index[deck_id]
+            found.append((deck, similarity, deck.cards - query_cards, query_cards - deck.cards))
+        return found
 
-        found = list(filter(match, self))
+    def _get_aggregates(self):
+        aggregates = self._aggregates
+        if aggregates is None:
+            aggregates = _DeckAggregates()
+            for deck in self:
+                aggregates.add(deck)
+            self._aggregates = aggregates
+        return aggregates
 
-        if win_rate_top_n:
-            found.sort(key=lambda x: x.win_rate or 0, reverse=True)
-            if win_rate_top_n > 0:
-                found = found[:win_rate_top_n]
+    @property
+    def totals(self):
+        """
+        当前合集的累计数据，随合集和卡组的修改实时更新
+        :return: DeckTotals 对象
+        """
+        return self._get_aggregates().get()
 
-        return Decks(found)
+    def totals_by(self, career=None, mode=None):
+        """
+        按职业和模式分组的累计数据
+        :param career: 职业，不填写则不区分职业
+        :param mode: 模式，不填写则不区分模式
+        :return: DeckTotals 对象
+        """
+        if career:
+            career = get_career(career)
+        return self._get_aggregates().get(career or None, mode or None)
 
     @property
     def total_games(self):
-        return sum(map(lambda x: x.games or 0, self))
+        return self.totals.games
 
     @property
     def total_wins(self):
-        return sum(map(lambda x: x.wins or 0, self))
+        return self.totals.wins
+
+    @property
+    def total_draws(self):
+        return self.totals.draws
 
     @property
     def avg_win_rate(self):
-        try:
-            return self.total_wins / self.total_games
-        except ZeroDivisionError:
-            pass
+        return self.totals.win_rate
 
+    @timed('decks.career_cards_stats')
     def career_cards_stats(
             self, career, mode=MODE_STANDARD,
             min_games=1000, top_win_rate_percentage=0.1
@@ -679,52 +1978,503 @@ class Decks(list):
         :param top_win_rate_percentage: 选取胜率最高的 n% 卡组，0.1 表示 10%
         """
 
-        career = get_career(career)
+        return _career_cards_stats(self, career, mode, min_games, top_win_rate_percentage)
+
+    def __getitem__(self, item):
+        # 切片的结果为只读的视图 (DecksView)，decks[:] 不再是可修改的副本，需要时请使用 decks[:].to_decks()
+        if isinstance(item, slice):
+            snapshot = self._snapshot
+            if snapshot is None:
+                # 没有现成的快照时只复制切片范围内的卡组引用
+                return DecksView(tuple(list.__getitem__(self, item)), None, self.cards, self.source)
+            return DecksView(snapshot.items, range(len(snapshot.items))[item], self.cards, self.source)
+        return super(Decks, self).__getitem__(item)
+
+
+class DecksView:
+    """
+    卡组合集的只读视图，由合集某一时刻的卡组元组和其中的卡组序号组成
+
+    Decks.search() 和切片的结果均为视图: 不复制卡组、不重建索引，也不会再次检查卡牌是否已载入；
+    视图可以继续搜索、切片、统计和遍历，结果仍为视图；累计数据和按ID查找的索引在首次使用时生成
+
+    视图是只读的，没有 append, remove, sort 等修改方法，需要修改时请通过 to_decks() 转换为 Decks；
+    与列表或 Decks 比较时按卡组逐个比较
+    """
+
+    __slots__ = ('_items', '_rows', '_modes', '_aggregates', '_index', '_decks', 'cards', 'source')
+
+    def __init__(self, items, rows=None, cards=None, source=None, modes=None):
+        """
+        :param items: 卡组元组，通常为合集快照的 items
+        :param rows: 视图中的卡组在 items 中的序号，可以是 range 或 list，不填写则为全部卡组
+        :param cards: 卡组所用的 Cards 对象
+        :param source: 卡组来源
+        :param modes: 与 rows 对应的各卡组的模式 (搜索时已算出)，用于生成累计数据
+        """
+        self._items = items
+        self._rows = range(len(items)) if rows is None else rows
+        self._modes = modes
+        self._aggregates = None
+        self._index = None
+        self._decks = None
+        self.cards = cards or current_context().cards
+        self.source = source
+
+    def _view(self, rows, modes=None):
+        return DecksView(self._items, rows, self.cards, self.source, modes)
+
+    @timed('decks.search')
+    def search(
+            self,
+            career=None,
+            mode=MODE_STANDARD,
+            min_win_rate=0.0,
+            min_games=0,
+            win_rate_top_n=None,
+            include=None,
+            exclude=None,
+    ):
+        """
+        在视图中继续搜索，参数与 Decks.search() 相同
+        :return: 符合条件的卡组，为新的视图
+        """
+
+        rows = self._rows
+        if include or exclude:
+            include = _card_count_items(include or ())
+            exclude = _card_count_items(exclude or ())
+            rows = [row for row in rows if _has_cards(self._items[row], include, exclude)]
+
+        return self._view(*_search_rows(self._items, rows, career, mode, min_win_rate, min_games, win_rate_top_n))
+
+    def containing(self, include=None, exclude=None):
+        """
+        查找包含或不包含指定卡牌的卡组，参数与 Decks.containing() 相同
+        :return: 卡组列表，顺序与视图中相同
+        """
+        include = _card_count_items(include or ())
+        exclude = _card_count_items(exclude or ())
+        return [deck for deck in self if _has_cards(deck, include, exclude)]
+
+    def similar(
+            self, cards, top_k=10, metric=SIMILARITY_JACCARD,
+            career=None, mode=None, min_win_rate=0.0, min_games=0):
+        """
+        查找与指定卡牌组合最相似的卡组，参数和结果与 Decks.similar() 相同；首次调用时为视图生成倒排索引
+        """
+        decks = self._decks
+        if decks is None:
+            decks = self._decks = self.to_decks()
+        return decks.similar(cards, top_k, metric, career, mode, min_win_rate, min_games)
+
+    def save(self, json_path):
+        """
+        将视图中的卡组保存为JSON文件，格式与 Decks.save() 相同
+        :param json_path: 保存路径
+        """
+        _save_decks(self, json_path)
 
-        top_decks = self.search(
-            career=career, mode=mode,
-            min_games=min_games, win_rate_top_n=-1)
-        top_decks = top_decks[:round(len(top_decks) * top_win_rate_percentage)]
-
-        "total_count, total_games, total_wins, used_in_decks, avg_count, avg_win_rate"
-
-        cards_stats = dict()
-        for deck in top_decks:
-            for card, count in deck.cards.items():
-                if card not in cards_stats:
-                    cards_stats[card] = dict(
-                        total_count=0,
-                        total_games=0,
-                        total_wins=0,
-                        used_in_decks=0,
-                    )
-                cards_stats[card]['used_in_decks'] += 1
-                cards_stats[card]['total_count'] += count
-                cards_stats[card]['total_games'] += deck.games or 0
-                cards_stats[card]['total_wins'] += deck.wins or 0
-
-        for card, stats in cards_stats.items():
-            stats['avg_count'] = stats['total_count'] / stats['used_in_decks']
-            if stats['total_games']:
-                stats['avg_win_rate'] = stats['total_wins'] / stats['total_games']
+    @timed('decks.career_cards_stats')
+    def career_cards_stats(
+            self, career, mode=MODE_STANDARD,
+            min_games=1000, top_win_rate_percentage=0.1
+    ):
+        """
+        统计指定职业和模式的卡牌数据，参数和结果与 Decks.career_cards_stats() 相同
+        """
+        return _career_cards_stats(self, career, mode, min_games, top_win_rate_percentage)
+
+    def _get_aggregates(self):
+        aggregates = self._aggregates
+        if aggregates is None:
+            aggregates = _DeckAggregates()
+            if self._modes is None:
+                for deck in self:
+                    aggregates.add(deck)
             else:
-                stats['avg_win_rate'] = None
+                for deck, deck_mode in zip(self, self._modes):
+                    aggregates.add(deck, deck_mode)
+            self._aggregates = aggregates
+        return aggregates
+
+    @property
+    def totals(self):
+        """
+        视图的累计数据，随卡组的修改实时更新
+        :return: DeckTotals 对象
+        """
+        return self._get_aggregates().get()
+
+    def totals_by(self, career=None, mode=None):
+        """
+        按职业和模式分组的累计数据
+        :param career: 职业，不填写则不区分职业
+        :param mode: 模式，不填写则不区分模式
+        :return: DeckTotals 对象
+        """
+        if career:
+            career = get_career(career)
+        return self._get_aggregates().get(career or None, mode or None)
+
+    @property
+    def total_games(self):
+        return self.totals.games
+
+    @property
+    def total_wins(self):
+        return self.totals.wins
+
+    @property
+    def total_draws(self):
+        return self.totals.draws
+
+    @property
+    def avg_win_rate(self):
+        return self.totals.win_rate
+
+    def get(self, deck_id):
+        """
+        :return: 视图中指定ID的卡组，索引在首次调用时生成
+        """
+        index = self._index
+        if index is None:
+            index = self._index = dict((deck.id, deck) for deck in self)
+        return index.get(deck_id)
+
+    def to_decks(self):
+        """
+        :return: 包含视图中所有卡组的新的 Decks 对象
+        """
+        decks = Decks(cards=self.cards)
+        decks.source = self.source
+        decks._publish(list(self))
+        return decks
 
-        return cards_stats, top_decks
+    def __len__(self):
+        return len(self._rows)
+
+    def __iter__(self):
+        items = self._items
+        for row in self._rows:
+            yield items[row]
+
+    def __contains__(self, deck):
+        return any(d is deck for d in self)
+
+    def __eq__(self, other):
+        if isinstance(other, (DecksView, list, tuple)):
+            return len(self) == len(other) and all(a is b or a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    __hash__ = None
 
     def __getitem__(self, item):
-        ret = super(Decks, self).__getitem__(item)
         if isinstance(item, slice):
-            decks = Decks()
-            decks.extend(ret)
-            ret = decks
-        return ret
+            return self._view(self._rows[item], None if self._modes is None else self._modes[item])
+        return self._items[self._rows[item]]
+
+    def __repr__(self):
+        return '<{}: {} decks>'.format(self.__class__.__name__, len(self))
+
+
+def _save_decks(decks, json_path):
+    _prepare_dir(json_path)
+    with open(json_path, 'w') as f:
+        json.dump([deck.to_dict() for deck in decks], f, ensure_ascii=False)
+
+    logging.info('已保存到 {}'.format(json_path))
+
+
+def _search_rows(items, rows, career, mode, min_win_rate, min_games, win_rate_top_n):
+    """
+    Decks.search() 和 DecksView.search() 的筛选过程
+    :param items: 卡组元组或列表
+    :param rows: 参与筛选的卡组序号
+    :return: (符合条件的卡组序号列表, 这些卡组的模式列表)
+    """
+
+    if career:
+        career = get_career(career)
+
+    # 筛选时已算出每个卡组的模式，生成累计数据时直接使用，无需再次遍历卡牌
+    found = list()
+    for row in rows:
+        deck = items[row]
+        if (career and deck.career != career) \
+                or ((deck.win_rate or 0) < min_win_rate) \
+                or ((deck.games or 0) < min_games):
+            continue
+        deck_mode = deck.mode
+        if not mode or deck_mode == mode:
+            found.append((row, deck_mode))
+
+    if win_rate_top_n:
+        found.sort(key=lambda x: items[x[0]].win_rate or 0, reverse=True)
+        if win_rate_top_n > 0:
+            found = found[:win_rate_top_n]
+
+    return [row for row, _ in found], [deck_mode for _, deck_mode in found]
+
+
+def _has_cards(deck, include, exclude):
+    """
+    :param include: 必须包含的 [(卡牌ID, 数量), ...]
+    :param exclude: 不能包含的 [(卡牌ID, 数量), ...]
+    """
+    counts = dict((card.id, count) for card, count in deck.cards.items() if card is not None)
+    for card_id, count in include:
+        if counts.get(card_id, 0) < count:
+            return False
+    for card_id, count in exclude:
+        if counts.get(card_id, 0) >= count:
+            return False
+    return True
+
+
+def _career_cards_stats(decks, career, mode, min_games, top_win_rate_percentage):
+    """
+    Decks.career_cards_stats() 和 DecksView.career_cards_stats() 的统计过程
+    """
+
+    career = get_career(career)
+
+    top_decks = decks.search(
+        career=career, mode=mode,
+        min_games=min_games, win_rate_top_n=-1)
+    top_decks = top_decks[:round(len(top_decks) * top_win_rate_percentage)]
+
+    "total_count, total_games, total_wins, used_in_decks, avg_count, avg_win_rate"
+
+    cards_stats = dict()
+    for deck in top_decks:
+        for card, count in deck.cards.items():
+            if card not in cards_stats:
+                cards_stats[card] = dict(
+                    total_count=0,
+                    total_games=0,
+                    total_wins=0,
+                    used_in_decks=0,
+                )
+            cards_stats[card]['used_in_decks'] += 1
+            cards_stats[card]['total_count'] += count
+            cards_stats[card]['total_games'] += deck.games or 0
+            cards_stats[card]['total_wins'] += deck.wins or 0
+
+    for card, stats in cards_stats.items():
+        stats['avg_count'] = stats['total_count'] / stats['used_in_decks']
+        if stats['total_games']:
+            stats['avg_win_rate'] = stats['total_wins'] / stats['total_games']
+        else:
+            stats['avg_win_rate'] = None
+
+    return cards_stats, top_decks
+
+
+class DeckValidator:
+    """
+    卡组校验器，使用预先计算好的各职业可用卡牌集合，批量检查卡组是否合法
+
+    每个卡组只需遍历一次，即可检查:
+    卡牌是否存在、是否可收集、职业是否可用、单卡数量是否有效及其上限(传说卡牌为1)，以及卡牌总数
+    """
+
+    def __init__(self, cards=None):
+        """
+        :param cards: Cards 对象，用于生成各职业的可用卡牌集合
+        """
+
+        if not cards:
+            cards = current_context().cards
+        cards.load_if_empty()
+        self.cards = cards
+
+        # 各职业可用的卡牌ID集合，key 为 class_name
+        self._career_card_ids = dict()
+        # 可收集卡牌的单卡数量上限，key 为卡牌ID
+        self._max_copies = dict()
+
+        for card in cards:
+            if not card.collectible:
+                continue
+            self._max_copies[card.id] = 1 if card.rarity == 'LEGENDARY' else 2
+            for career in card.careers:
+                if career.class_name not in self._career_card_ids:
+                    self._career_card_ids[career.class_name] = set()
+                self._career_card_ids[career.class_name].add(card.id)
+
+    def validate(self, career, card_counts):
+        """
+        校验单个卡组
+        :param career: 卡组的职业
+        :param card_counts: 卡牌ID与数量，可以是 dict 或 (card_id, count) 列表 (同一卡牌出现多次时合计数量)
+        :return: 拒绝原因列表，每项为 (原因, 详情)，若为空列表则表示卡组合法
+        """
+
+        reasons = list()
+
+        if isinstance(card_counts, Mapping):
+            card_counts = card_counts.items()
+
+        # 合计同一卡牌的数量，数量小于 1 的卡牌不合法
+        totals = dict()
+        for card_id, count in card_counts:
+            if count < 1:
+                reasons.append((REJECT_BAD_COUNT, card_id))
+            totals[card_id] = totals.get(card_id, 0) + count
+
+        if career:
+            career_card_ids = self._career_card_ids.get(career.class_name)
+        else:
+            career_card_ids = None
+
+        if career_card_ids is None:
+            reasons.append((REJECT_UNKNOWN_CAREER, career))
+            career_card_ids = ()
+
+        num_of_cards = 0
+
+        for card_id, count in totals.items():
+            num_of_cards += count
+            max_copies = self._max_copies.get(card_id)
+
+            if max_copies is None:
+                if self.cards.get(card_id):
+                    reasons.append((REJECT_NOT_COLLECTIBLE, card_id))
+                else:
+                    reasons.append((REJECT_UNKNOWN_CARD, card_id))
+            elif career and card_id not in career_card_ids:
+                reasons.append((REJECT_WRONG_CAREER, card_id))
+            elif count > max_copies:
+                if max_copies == 1:
+                    reasons.append((REJECT_TOO_MANY_LEGENDARY, card_id))
+                else:
+                    reasons.append((REJECT_TOO_MANY_COPIES, card_id))
+
+        if num_of_cards != DECK_SIZE:
+            reasons.append((REJECT_WRONG_DECK_SIZE, num_of_cards))
+
+        return reasons
+
+    def validate_many(self, entries):
+        """
+        批量校验卡组
+        :param entries: (deck_id, career, card_counts) 列表
+        :return: (通过的卡组ID列表, 拒绝列表)，拒绝列表中每项为 dict(id=卡组ID, reasons=拒绝原因列表)
+        """
+
+        accepted = list()
+        rejected = list()
+
+        for deck_id, career, card_counts in entries:
+            reasons = self.validate(career, card_counts)
+            if reasons:
+                rejected.append(dict(id=deck_id, reasons=reasons))
+            else:
+                accepted.append(deck_id)
+
+        return accepted, rejected
 
 
 with open(os.path.join(PACKAGE_DIR, 'career_names.json')) as fp:
     CAREER_NAMES_ALL_LANGUAGES = json.load(fp)
 
 
+class HSData:
+    """
+    数据上下文，包含主语言、数据目录、职业和卡牌
+
+    模块中的 CARDS, CAREERS 等全局变量构成了默认的上下文
+    若需要在同一进程中同时提供多种语言或数据目录 (例如多线程或异步的服务)，可以为每种语言创建一个上下文，
+    并在各个线程或异步任务中通过 use() 绑定，在其中创建的卡牌和卡组合集都将使用该上下文:
+
+        >>> en = hsdata.HSData('enUS')
+        >>> with en.use():
+        >>>     decks = hsdata.HSBoxDecks()
+        >>>     print(decks[0].career.name)
+
+    """
+
+    def __init__(self, language=None, data_dir=None):
+        """
+        :param language: 主语言，默认与默认上下文相同
+        :param data_dir: 数据目录，默认与默认上下文相同
+        """
+
+        if not language:
+            language = MAIN_LANGUAGE
+        if not data_dir:
+            data_dir = DATA_DIR
+
+        self.career_names = CAREER_NAMES_ALL_LANGUAGES.get(language)
+        if not self.career_names:
+            raise ValueError('language: should in {}'.format(
+                ', '.join(CAREER_NAMES_ALL_LANGUAGES.keys())))
+
+        self.language = language
+        self.data_dir = data_dir
+        self.careers = Careers()
+        self.cards = Cards(
+            json_path=os.path.join(data_dir, 'CARDS_{}.json'.format(language)),
+            lazy_load=True, language=language)
+
+    @contextmanager
+    def use(self):
+        """
+        在当前线程或异步任务中使用该上下文，用于 with 语句
+        """
+        token = _current_context.set(self)
+        try:
+            yield self
+        finally:
+            _current_context.reset(token)
+
+    def __repr__(self):
+        return '<{}: {} ({})>'.format(self.__class__.__name__, self.language, self.data_dir)
+
+
+class _DefaultContext(HSData):
+    """
+    默认的上下文，始终对应模块中的全局变量 (可通过 set_main_language 和 set_data_dir 修改)
+    """
+
+    def __init__(self):
+        pass
+
+    @property
+    def language(self):
+        return MAIN_LANGUAGE
+
+    @property
+    def data_dir(self):
+        return DATA_DIR
+
+    @property
+    def career_names(self):
+        return CAREER_NAMES
+
+    @property
+    def careers(self):
+        return CAREERS
+
+    @property
+    def cards(self):
+        return CARDS
+
+
+DEFAULT_CONTEXT = _DefaultContext()
+
+_current_context = ContextVar('hsdata_context', default=DEFAULT_CONTEXT)
+
+
+def current_context():
+    """
+    获取当前线程或异步任务所使用的上下文，若未绑定则返回默认上下文
+    :return: HSData 对象
+    """
+    return _current_context.get()
+
+
 def set_data_dir(path):
     global DATA_DIR, CARDS
     DATA_DIR = path
@@ -782,7 +2532,7 @@ def get_career(keywords_or_career=None):
     if isinstance(keywords_or_career, Career):
         career = keywords_or_career
     elif isinstance(keywords_or_career, (str, list, type(None))):
-        career = CAREERS.search(keywords_or_career)
+        career = current_context().careers.search(keywords_or_career)
     else:
         raise TypeError('不支持使用 {} 作为参数'.format(
             type(keywords_or_career).__name__))
@@ -805,6 +2555,16 @@ def days_ago(n):
     return datetime.today() - timedelta(days=n)
 
 
+def parse_date_time(text):
+    """
+    解析 DATE_TIME_FORMAT 格式的时间，比 datetime.strptime 快得多
+    """
+    try:
+        return datetime.fromisoformat(text)
+    except ValueError:
+        return datetime.strptime(text, DATE_TIME_FORMAT)
+
+
 MAIN_LANGUAGE = 'zhCN'
 CARDS_JSON_FILE_NAME = 'CARDS_{}.json'.format(MAIN_LANGUAGE)
 CAREER_NAMES = CAREER_NAMES_ALL_LANGUAGES.get(MAIN_LANGUAGE)
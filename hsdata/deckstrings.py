@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+
+"""
+卡组代码和卡组指纹
+~~~~~~~~~~~~~~~
+
+* 卡组代码: 炉石传说官方的卡组代码格式 (deckstring)，即 base64 编码的一串变长整数 (varint)，
+  依次为: 0, 版本, 模式, 英雄数量, 英雄的 dbfId, 1 张的卡牌数量及其 dbfId, 2 张的卡牌数量及其 dbfId,
+  其余数量的卡牌数量及其 (dbfId, 数量)；各部分的 dbfId 按从小到大排列
+* 卡组指纹: 由职业和各卡牌的ID及数量计算，与卡牌的顺序和数据源无关，卡牌相同的卡组指纹相同
+
+本模块只处理 dbfId 和卡牌ID，卡牌对象的转换见 Deck.deckstring 和 Deck.from_deckstring()
+
+"""
+
+import base64
+import hashlib
+from collections.abc import Mapping
+
+DECKSTRING_VERSION = 1
+
+FORMAT_WILD = 1
+FORMAT_STANDARD = 2
+
+
+def _write_varint(buffer, value):
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            buffer.append(byte | 0x80)
+        else:
+            buffer.append(byte)
+            return
+
+
+def _read_varint(data, pos):
+    value = 0
+    shift = 0
+    while True:
+        try:
+            byte = data[pos]
+        except IndexError:
+            raise ValueError('卡组代码不完整')
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+def encode(heroes, card_counts, format_type=FORMAT_STANDARD):
+    """
+    生成卡组代码
+    :param heroes: 英雄的 dbfId 列表
+    :param card_counts: [(dbfId, 数量), ...] 或 dict(dbfId: 数量)
+    :param format_type: FORMAT_STANDARD 或 FORMAT_WILD
+    :return: 卡组代码
+    """
+
+    if isinstance(card_counts, Mapping):
+        card_counts = card_counts.items()
+
+    by_count = {1: list(), 2: list()}
+    others = list()
+    for dbf_id, count in card_counts:
+        if count in by_count:
+            by_count[count].append(dbf_id)
+        elif count > 0:
+            others.append((dbf_id, count))
+
+    buffer = bytearray()
+    for value in (0, DECKSTRING_VERSION, format_type, len(heroes)):
+        _write_varint(buffer, value)
+    for hero in sorted(heroes):
+        _write_varint(buffer, hero)
+
+    for count in 1, 2:
+        dbf_ids = sorted(by_count[count])
+        _write_varint(buffer, len(dbf_ids))
+        for dbf_id in dbf_ids:
+            _write_varint(buffer, dbf_id)
+
+    _write_varint(buffer, len(others))
+    for dbf_id, count in sorted(others):
+        _write_varint(buffer, dbf_id)
+        _write_varint(buffer, count)
+
+    return base64.b64encode(bytes(buffer)).decode('ascii')
+
+
+def decode(deckstring):
+    """
+    解析卡组代码
+    :param deckstring: 卡组代码
+    :return: (英雄的 dbfId 列表, [(dbfId, 数量), ...], 模式)
+    """
+
+    try:
+        data = base64.b64decode(deckstring.strip(), validate=True)
+    except (ValueError, TypeError):
+        raise ValueError('无效的卡组代码: {}'.format(deckstring))
+
+    if not data or data[0] != 0:
+        raise ValueError('无效的卡组代码: {}'.format(deckstring))
+    version, pos = _read_varint(data, 1)
+    if version != DECKSTRING_VERSION:
+        raise ValueError('不支持的卡组代码版本: {}'.format(version))
+    format_type, pos = _read_varint(data, pos)
+
+    num, pos = _read_varint(data, pos)
+    heroes = list()
+    for _ in range(num):
+        hero, pos = _read_varint(data, pos)
+        heroes.append(hero)
+
+    card_counts = list()
+    for count in 1, 2:
+        num, pos = _read_varint(data, pos)
+        for _ in range(num):
+            dbf_id, pos = _read_varint(data, pos)
+            card_counts.append((dbf_id, count))
+
+    num, pos = _read_varint(data, pos)
+    for _ in range(num):
+        dbf_id, pos = _read_varint(data, pos)
+        count, pos = _read_varint(data, pos)
+        card_counts.append((dbf_id, count))
+
+    return heroes, card_counts, format_type
+
+
+def fingerprint(class_name, card_counts):
+    """
+    卡组指纹，与卡牌的顺序无关
+    :param class_name: 职业的 class_name
+    :param card_counts: [(卡牌ID, 数量), ...] 或 dict(卡牌ID: 数量)
+    :return: 32 位十六进制字符串
+    """
+
+    if isinstance(card_counts, Mapping):
+        card_counts = card_counts.items()
+    canonical = '{};{}'.format(class_name or '', ','.join(
+        '{}:{}'.format(card_id, count) for card_id, count in sorted(card_counts) if count > 0))
+    return hashlib.blake2b(canonical.encode('utf-8'), digest_size=16).hexdigest()
@@ -8,20 +8,24 @@ HearthStats 的卡组和卡组合集类
 import json
 import logging
 import multiprocessing
+import os
 import re
-from collections import Counter
+import time
 from datetime import datetime
+from html.parser import HTMLParser
 from urllib.parse import urlencode
 
 import requests
 import scrapy
 from scrapy.crawler import CrawlerProcess
 
+from . import core
 from .core import (
     DATE_TIME_FORMAT,
-    Deck, Decks, CAREERS, CARDS,
-    get_career, days_ago
+    Deck, Decks,
+    get_career, days_ago, _prepare_dir
 )
+from .metrics import span, observe
 
 # 该来源的标识
 SOURCE_NAME = 'HEARTHSTATS'
@@ -29,6 +33,15 @@ SOURCE_NAME = 'HEARTHSTATS'
 # 默认的载入和保存文件名，将与 DATA_DIR 拼接
 JSON_FILE_NAME = 'Decks_{}.json'.format(SOURCE_NAME)
 
+# 保存登录状态的文件名，将与 DATA_DIR 拼接
+SESSION_FILE_NAME = 'SESSION_{}.json'.format(SOURCE_NAME)
+
+# 检查点的有效期 (秒)，过期后将重新搜索
+CHECKPOINT_MAX_AGE = 24 * 60 * 60
+
+# 从检查点继续爬取的最多次数，超过后放弃仍未获取到的卡组
+CHECKPOINT_MAX_ATTEMPTS = 3
+
 ORDER_BY_DESC = 'desc'
 ORDER_BY_ASC = 'asc'
 
@@ -61,30 +74,28 @@ class HearthStatsDeck(Deck):
     # 该类卡组的 source 属性
     source = SOURCE_NAME
     DECK_URL_TEMPLATE = 'http://hearthstats.net/decks/{}/public_show'
+    # JSON 中的等级为字串
+    field_parsers = dict(win_rate_by_rank=lambda win_rate_by_rank: dict(
+        (int(rank), win_rate) for rank, win_rate in win_rate_by_rank.items()))
 
     def __init__(self):
         super(HearthStatsDeck, self).__init__()
         self.creator_id = None
         self.win_rate_by_rank = dict()
 
-    def from_dict(self, dct, cards=None):
-        win_rate_by_rank = dct.pop('win_rate_by_rank')
-        for rank, win_rate in win_rate_by_rank.items():
-            self.win_rate_by_rank[int(rank)] = win_rate
-        super(HearthStatsDeck, self).from_dict(dct, cards)
-
 
 class HearthStatsDecks(Decks):
     # 当从本地JSON载入卡组时，将把每个卡组转化为该类
     deck_class = HearthStatsDeck
 
-    def __init__(self, email=None, password=None, json_path=None, auto_load=True):
+    def __init__(self, email=None, password=None, json_path=None, auto_load=True, session_path=None):
         """
         使用 HearthStats 数据源，必须先注册其网站账号后，并在登录后使用
         该数据源没有无需使用 update 方法，请通过 search_online 方法获取卡组数据
         注册页面: http://hearthstats.net/users/sign_up
         :param email: 登录邮箱
         :param password: 登录密码
+        :param session_path: 登录状态的保存路径，在 cookies 过期前将重复使用，无需再次登录
         """
         logging.info('初始化卡组合集 (HearthStats)')
         super(HearthStatsDecks, self).__init__(
@@ -96,7 +107,15 @@ class HearthStatsDecks(Decks):
         self._logged_in = False
         self.search_url = None
 
-        self.login(email, password)
+        if not session_path:
+            session_path = os.path.join(core.current_context().data_dir, SESSION_FILE_NAME)
+        self.session_path = session_path
+
+        # 爬取过程中的检查点，记录已完成的卡组，以便中断后继续
+        self.checkpoint_path = '{}.partial'.format(self.json_path)
+
+        if not self._load_session():
+            self.login(email, password)
 
     @property
     def logged_in(self):
@@ -105,7 +124,15 @@ class HearthStatsDecks(Decks):
     def update(self, json_path=None):
         logging.warning('该数据来源不支持 update 方法，请直接使用 search_online 方法')
 
-    def login(self, email, password):
+    def login(self, email, password, force=False):
+        """
+        登录 HearthStats，若已有未过期的登录状态，则直接使用
+        :param email: 登录邮箱
+        :param password: 登录密码
+        :param force: 选项，忽略已有的登录状态，重新登录
+        """
+        if self._logged_in and not force:
+            return
         if not email or not password:
             self._logged_in = False
             return
@@ -117,10 +144,53 @@ class HearthStatsDecks(Decks):
         r.raise_for_status()
         if r.json().get('success'):
             self._logged_in = True
+            self._save_session()
             logging.info('登录成功')
         else:
             raise Exception('登陆失败: {}'.format(r.json().get('message')))
 
+    def _save_session(self):
+        cookies = list()
+        for cookie in self.session.cookies:
+            cookies.append(dict(
+                name=cookie.name, value=cookie.value,
+                domain=cookie.domain, path=cookie.path, expires=cookie.expires))
+
+        _prepare_dir(self.session_path)
+        with open(self.session_path, 'w') as f:
+            json.dump(cookies, f)
+
+    def _load_session(self):
+        """
+        载入保存的登录状态
+        :return: 若登录状态有效则返回 True
+        """
+
+        if not os.path.isfile(self.session_path):
+            return False
+
+        with open(self.session_path) as f:
+            cookies = json.load(f)
+
+        now = time.time()
+        if not cookies or any(c['expires'] and c['expires'] <= now for c in cookies):
+            logging.info('保存的登录状态已过期')
+            return False
+
+        for c in cookies:
+            self.session.cookies.set(
+                c['name'], c['value'], domain=c['domain'], path=c['path'], expires=c['expires'])
+
+        self._logged_in = True
+        logging.info('使用保存的登录状态')
+        return True
+
+    def _clear_session(self):
+        self.session.cookies.clear()
+        self._logged_in = False
+        if os.path.isfile(self.session_path):
+            os.remove(self.session_path)
+
     def search_online(
             self,
             career=None,
@@ -132,6 +202,7 @@ class HearthStatsDecks(Decks):
     ):
         """
         在 hearthstats 网站中搜索卡组
+        若之前相同条件的搜索中途失败，将从检查点继续，只获取尚未完成的卡组
         :param career: 职业
         :param created_after: 在 XXXX-XX-XX 后创建
         :param min_games: 最少游戏次数
@@ -169,31 +240,68 @@ class HearthStatsDecks(Decks):
 
         self.search_url = 'http://hearthstats.net/decks/search?{}'.format(qs)
 
-        logging.info('正在搜索卡组')
+        header, crawled = self._load_checkpoint(self.search_url)
 
-        r = self.session.get(self.search_url)
-        r.raise_for_status()
+        if header:
+            deck_ids = header['deck_ids']
+            logging.info('从检查点继续，已完成 {}/{} 个卡组'.format(len(crawled), len(deck_ids)))
+        else:
+            logging.info('正在搜索卡组')
 
-        deck_ids = re.findall(r'(?<=href="/decks/)[^/]+(?=/public_show)', r.text)
+            with span('hearthstats.search_online.search'):
+                r = self.session.get(self.search_url)
+            r.raise_for_status()
 
-        if not deck_ids:
-            logging.info('未找到符合条件的卡组，试试放宽条件吧')
-            return
+            if 'sign_in' in r.url:
+                logging.warning('登录状态已失效，请重新登录')
+                self._clear_session()
+                return
+
+            # 同一卡组可能在结果页中出现多次，去重并保持原有顺序
+            deck_ids = list(dict.fromkeys(re.findall(r'(?<=href="/decks/)[^/]+(?=/public_show)', r.text)))
+
+            if not deck_ids:
+                logging.info('未找到符合条件的卡组，试试放宽条件吧')
+                return
+
+            logging.info('找到 {} 个符合条件的卡组'.format(len(deck_ids)))
 
-        logging.info('找到 {} 个符合条件的卡组'.format(len(deck_ids)))
+            header = dict(search_url=self.search_url, deck_ids=deck_ids, created_at=time.time(), attempts=0)
 
-        # 清除原有的数据
-        self.clear()
+        remaining = [deck_id for deck_id in deck_ids if deck_id not in crawled]
 
-        # 使用单独进程来运行爬虫，绕过 twisted reactor 无法重用的问题
-        with multiprocessing.Pool() as p:
-            decks = p.apply(self._crawl, (deck_ids,))
+        if remaining and header['attempts'] >= CHECKPOINT_MAX_ATTEMPTS:
+            logging.warning('已重试 {} 次，放弃仍未获取到的 {} 个卡组'.format(header['attempts'], len(remaining)))
+            remaining = list()
 
-        if decks:
-            # 爬完后的内容是乱序的，需恢复为原结果列表的顺序
-            decks.sort(key=lambda x: deck_ids.index(x.id))
-            # 加入到卡组合集中
-            self.extend(decks)
+        if remaining:
+            header['attempts'] += 1
+            self._write_checkpoint(header, crawled.values())
+
+            # 使用单独进程来运行爬虫，绕过 twisted reactor 无法重用的问题
+            # 爬到的卡组会被逐个写入检查点文件
+            with span('hearthstats.search_online.crawl'):
+                with multiprocessing.Pool() as p:
+                    p.apply(self._crawl, (remaining, self.checkpoint_path))
+
+            # 爬取期间检查点可能已超过有效期，此时不再检查
+            _, crawled = self._load_checkpoint(self.search_url, max_age=None)
+
+        remaining = set(remaining)
+        decks = list()
+        for deck_id, deck_dict in crawled.items():
+            latency = deck_dict.pop('latency', None)
+            if deck_id in remaining:
+                observe('hearthstats.crawl.request', latency)
+            deck = self.deck_class()
+            deck.from_dict(deck_dict, self.cards)
+            decks.append(deck)
+
+        # 爬完后的内容是乱序的，需恢复为原结果列表的顺序
+        decks = _restore_order(decks, deck_ids)
+
+        # 全部获取完成后，再一次性替换原有的数据
+        self._publish(decks)
 
         logging.info('卡组数据获取完成 ({}/{})'.format(
             len(self), len(deck_ids)
@@ -201,14 +309,241 @@ class HearthStatsDecks(Decks):
 
         self.save()
 
+        if len(self) == len(deck_ids) or header['attempts'] >= CHECKPOINT_MAX_ATTEMPTS:
+            if os.path.isfile(self.checkpoint_path):
+                os.remove(self.checkpoint_path)
+        else:
+            logging.warning('部分卡组获取失败，再次运行相同的搜索将重试这些卡组')
+
+    def _load_checkpoint(self, search_url, max_age=CHECKPOINT_MAX_AGE):
+        """
+        读取检查点文件
+        :param search_url: 搜索地址，仅当与检查点中的一致时才会读取
+        :param max_age: 检查点的有效期 (秒)，为 None 时不检查
+        :return: (检查点信息 dict，无可用的检查点时为 None, 已完成的卡组 dict)
+        """
+
+        crawled = dict()
+
+        if not os.path.isfile(self.checkpoint_path):
+            return None, crawled
+
+        with open(self.checkpoint_path) as f:
+            header = f.readline()
+            try:
+                header = json.loads(header)
+            except ValueError:
+                return None, crawled
+            if header.get('search_url') != search_url:
+                return None, crawled
+            if max_age is not None and time.time() - header.get('created_at', 0) > max_age:
+                logging.info('检查点已过期，将重新搜索')
+                return None, crawled
+
+            header.setdefault('attempts', 0)
+
+            for line in f:
+                try:
+                    deck_dict = json.loads(line)
+                except ValueError:
+                    # 进程中断时最后一行可能不完整
+                    continue
+                crawled[deck_dict['id']] = deck_dict
+
+        return header, crawled
+
+    def _write_checkpoint(self, header, crawled):
+        """
+        写入检查点文件，之后爬到的卡组将被逐个追加到文件末尾
+        :param header: 检查点信息
+        :param crawled: 已完成的卡组 dict 列表
+        """
+
+        _prepare_dir(self.checkpoint_path)
+        with open(self.checkpoint_path, 'w') as f:
+            f.write(json.dumps(header))
+            f.write('\n')
+            for deck_dict in crawled:
+                f.write(json.dumps(deck_dict, ensure_ascii=False))
+                f.write('\n')
+
     @staticmethod
-    def _crawl(deck_ids):
+    def _crawl(deck_ids, checkpoint_path):
         logging.info('正在获取卡组数据')
-        decks = list()
         cp = CrawlerProcess({'ITEM_PIPELINES': {'hsdata.hearthstats.HearthStatsScrapyPipeline': 1}})
-        cp.crawl(HearthStatsScrapySpider, deck_ids=deck_ids, decks=decks)
+        cp.crawl(HearthStatsScrapySpider, deck_ids=deck_ids, checkpoint_path=checkpoint_path)
         cp.start()
-        return decks
+
+
+def _restore_order(decks, deck_ids):
+    """
+    按卡组ID列表的顺序重新排列卡组，不在列表中的卡组将被丢弃
+    :param decks: 乱序的卡组列表
+    :param deck_ids: 卡组ID列表
+    :return: 排序后的卡组列表
+    """
+
+    positions = dict((deck_id, i) for i, deck_id in enumerate(deck_ids))
+    slots = [None] * len(deck_ids)
+
+    for deck in decks:
+        i = positions.get(deck.id)
+        if i is not None:
+            slots[i] = deck
+
+    return [deck for deck in slots if deck is not None]
+
+
+# 不会有结束标签的 HTML 元素
+_VOID_TAGS = frozenset((
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+    'link', 'meta', 'param', 'source', 'track', 'wbr'))
+
+_CREATOR_BLOCK_CLASSES = frozenset(('col-md-4', 'col-sm-4', 'col-xs-4'))
+_RESULT_BLOCK_CLASSES = frozenset(('col-md-2', 'col-sm-2', 'col-xs-4'))
+_CARD_CLASSES = frozenset(('card', 'cardWrapper'))
+
+_rp_rank_wr = re.compile(r'(?<=gon\.rank_wr=)[\[\],.\d\s]+?(?=;)')
+
+
+class _DeckPageParser(HTMLParser):
+    """
+    单次遍历 HearthStats 卡组页面，提取卡组数据
+    """
+
+    def __init__(self):
+        super(_DeckPageParser, self).__init__()
+
+        self.name = None
+        self.creator_id = None
+        self.career = None
+        self.results = list()
+        self.cards = list()
+        self.rank_wr = None
+
+        # 当前所在的元素，每项为 (标签, class 集合)
+        self._stack = list()
+        # 当前所在区块的类型和该类型区块中 win-count 的序号
+        self._block = None
+        self._block_depth = None
+        self._win_counts = dict()
+        self._win_count_depth = None
+        self._card = None
+        self._card_depth = None
+        self._in_qty = False
+        self._in_span = False
+        self._in_script = False
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        classes = frozenset((attrs.get('class') or '').split())
+
+        if tag == 'meta':
+            if attrs.get('name') == 'description' and self.name is None:
+                self.name = attrs.get('content')
+        elif tag == 'img':
+            if self._card is not None and attrs.get('class') == 'image':
+                self._card[0] = attrs.get('src')
+            elif self._block == 'creator' and self._win_counts.get('creator') == 2 \
+                    and self._win_count_depth is not None and self.career is None:
+                self.career = attrs.get('alt')
+        elif tag == 'a':
+            if self._block == 'creator' and self._win_counts.get('creator') == 1 \
+                    and self._win_count_depth is not None and self.creator_id is None:
+                self.creator_id = (attrs.get('href') or '').rsplit('/', 1)[-1]
+        elif tag == 'span':
+            self._in_span = self._block == 'result' and self._win_count_depth is not None
+        elif tag == 'script':
+            self._in_script = True
+        elif tag == 'div':
+            depth = len(self._stack)
+            if self._block is None:
+                if _CREATOR_BLOCK_CLASSES <= classes:
+                    self._block, self._block_depth = 'creator', depth
+                elif _RESULT_BLOCK_CLASSES <= classes:
+                    self._block, self._block_depth = 'result', depth
+            elif 'win-count' in classes and self._win_count_depth is None:
+                self._win_count_depth = depth
+                self._win_counts[self._block] = self._win_counts.get(self._block, 0) + 1
+            if _CARD_CLASSES <= classes:
+                self._card, self._card_depth = [None, None], depth
+            elif self._card is not None and attrs.get('class') == 'qty':
+                self._in_qty = True
+
+        if tag not in _VOID_TAGS:
+            self._stack.append(tag)
+
+    def handle_endtag(self, tag):
+        if tag in _VOID_TAGS or tag not in self._stack:
+            return
+
+        while self._stack:
+            if self._stack.pop() == tag:
+                break
+
+        depth = len(self._stack)
+
+        if tag == 'div':
+            self._in_qty = False
+            if self._card_depth == depth:
+                self.cards.append(tuple(self._card))
+                self._card = self._card_depth = None
+            if self._win_count_depth == depth:
+                self._win_count_depth = None
+            if self._block_depth == depth:
+                self._block = self._block_depth = None
+        elif tag == 'span':
+            self._in_span = False
+        elif tag == 'script':
+            self._in_script = False
+
+    def handle_data(self, data):
+        if self._in_qty:
+            self._card[1] = data.strip()
+        elif self._in_span:
+            self.results.append(data.strip())
+        elif self._in_script and self.rank_wr is None and 'gon.rank_wr' in data:
+            m = _rp_rank_wr.search(data)
+            if m:
+                self.rank_wr = m.group()
+
+
+def parse_deck_page(html):
+    """
+    解析 HearthStats 的卡组页面
+    :param html: 页面内容
+    :return: dict，包括 name, creator_id, career (class_name), wins, draws, games,
+        cards (卡牌ID与数量), win_rate_by_rank
+    """
+
+    parser = _DeckPageParser()
+    parser.feed(html)
+    parser.close()
+
+    wins, losses, draws = (int(x) for x in parser.results[:3])
+
+    cards = dict()
+    for img_src, count in parser.cards:
+        card_id = img_src.rsplit('/', 1)[1].split('.', 1)[0]
+        cards[card_id] = int(count)
+
+    try:
+        win_rate_by_rank = dict(json.loads(parser.rank_wr))
+        for rank in win_rate_by_rank:
+            win_rate_by_rank[rank] /= 100
+    except (ValueError, TypeError):
+        win_rate_by_rank = dict()
+
+    return dict(
+        name=parser.name,
+        creator_id=parser.creator_id,
+        career=(parser.career or '').upper(),
+        wins=wins,
+        draws=draws,
+        games=wins + losses + draws,
+        cards=cards,
+        win_rate_by_rank=win_rate_by_rank,
+    )
 
 
 class HearthStatsScrapyItem(scrapy.Item):
@@ -221,15 +556,16 @@ class HearthStatsScrapyItem(scrapy.Item):
     draws = scrapy.Field()
     creator_id = scrapy.Field()
     win_rate_by_rank = scrapy.Field()
+    latency = scrapy.Field()
 
 
 class HearthStatsScrapySpider(scrapy.Spider):
     name = 'hearthstats_decks'
 
-    def __init__(self, deck_ids, decks):
+    def __init__(self, deck_ids, checkpoint_path):
         super(HearthStatsScrapySpider, self).__init__()
         self.deck_ids = deck_ids
-        self.decks = decks
+        self.checkpoint_path = checkpoint_path
 
     def start_requests(self):
         request_list = list()
@@ -243,42 +579,20 @@ class HearthStatsScrapySpider(scrapy.Spider):
 
     def parse(self, response):
 
+        data = parse_deck_page(response.text)
+
         item = HearthStatsScrapyItem()
 
-        item['name'] = response.xpath('//meta[@name="description"]/@content').extract()[0]
+        item['name'] = data['name']
         item['id'] = response.meta['deck_id']
-
-        block_1 = response.css('div.col-md-4.col-sm-4.col-xs-4 div.win-count')
-
-        item['creator_id'] = block_1[0].xpath('.//a/@href').extract()[0].rsplit('/', 1)[1]
-        item['career'] = CAREERS.get(block_1[1].xpath('.//img/@alt').extract()[0].upper())
-
-        block_2 = response.css('div.col-md-2.col-sm-2.col-xs-4 div.win-count span')
-        item['wins'] = int(block_2[0].xpath('text()')[0].extract())
-        losses = int(block_2[1].xpath('text()')[0].extract())
-        item['draws'] = int(block_2[2].xpath('text()')[0].extract())
-        item['games'] = item['wins'] + losses + item['draws']
-
-        cards = Counter()
-
-        for card_div in response.css('div.card.cardWrapper'):
-            img_src = card_div.xpath('img[@class="image"]/@src').extract()[0]
-            card_id = img_src.rsplit('/', 1)[1].split('.', 1)[0]
-            card = CARDS.get(card_id)
-            count = int(card_div.xpath('div[@class="qty"]/text()')[0].extract())
-            cards[card] = count
-
-        item['cards'] = cards
-
-        try:
-            m = re.search(r'(?<=gon\.rank_wr=)[\[\],.\d\s]+?(?=;)', response.text)
-            win_rate_by_rank = dict(json.loads(m.group()))
-            if win_rate_by_rank:
-                for rank in win_rate_by_rank:
-                    win_rate_by_rank[rank] /= 100
-            item['win_rate_by_rank'] = win_rate_by_rank
-        except (ValueError, TypeError, json.JSONDecodeError):
-            item['win_rate_by_rank'] = dict()
+        item['creator_id'] = data['creator_id']
+        item['career'] = data['career']
+        item['wins'] = data['wins']
+        item['draws'] = data['draws']
+        item['games'] = data['games']
+        item['cards'] = data['cards']
+        item['win_rate_by_rank'] = data['win_rate_by_rank']
+        item['latency'] = response.meta.get('download_latency')
 
         yield item
 
@@ -286,16 +600,7 @@ class HearthStatsScrapySpider(scrapy.Spider):
 class HearthStatsScrapyPipeline:
     @staticmethod
     def process_item(item, spider):
-        deck = HearthStatsDeck()
-
-        deck.name = item['name']
-        deck.id = item['id']
-        deck.career = item['career']
-        deck.cards = item['cards']
-        deck.games = item['games']
-        deck.wins = item['wins']
-        deck.draws = item['draws']
-        deck.creator_id = item['creator_id']
-        deck.win_rate_by_rank = item['win_rate_by_rank']
-
-        spider.decks.append(deck)
+        # 逐个写入检查点文件，即使爬虫中断，已获取的卡组也不会丢失
+        with open(spider.checkpoint_path, 'a') as f:
+            f.write(json.dumps(dict(item), ensure_ascii=False))
+            f.write('\n')
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+
+"""
+卡组游戏数据的历史记录
+~~~~~~~~~~~~~~~~~~
+
+每次更新卡组数据时，将各卡组的游戏次数等数据追加保存为一条快照，用于查询卡组、职业或卡牌的趋势
+
+快照文件为 JSON Lines 格式，每行为一次更新，各列数据均经过差分编码:
+
+* 卡组编号按从小到大排列，只保存与前一个编号的差值
+* 游戏次数等数据只保存与该卡组上一次快照的差值
+* 卡组的职业、模式和卡牌只在首次出现时保存一次
+
+"""
+
+import json
+import logging
+import os
+from array import array
+from bisect import bisect_left
+from datetime import datetime
+
+from . import core
+from .core import DATE_TIME_FORMAT, get_career
+
+# 每个快照中记录的数据列
+COLUMNS = ('games', 'wins', 'draws', 'ranked_games', 'ranked_wins', 'users')
+
+GRANULARITY_HOUR = 'hour'
+GRANULARITY_DAY = 'day'
+
+
+def _bucket_start(time, granularity):
+    if granularity == GRANULARITY_HOUR:
+        return time.replace(minute=0, second=0, microsecond=0)
+    elif granularity == GRANULARITY_DAY:
+        return time.replace(hour=0, minute=0, second=0, microsecond=0)
+    else:
+        raise ValueError('granularity: should be {} or {}'.format(GRANULARITY_HOUR, GRANULARITY_DAY))
+
+
+def _delta_encode(values):
+    encoded = list()
+    last = 0
+    for value in values:
+        encoded.append(value - last)
+        last = value
+    return encoded
+
+
+def _delta_decode(values):
+    decoded = list()
+    last = 0
+    for value in values:
+        last += value
+        decoded.append(last)
+    return decoded
+
+
+class _Snapshot:
+    """单次更新的快照，各列为该次更新时各卡组的绝对值"""
+
+    def __init__(self, time, deck_numbers, columns):
+        self.time = time
+        self.deck_numbers = array('l', deck_numbers)
+        self.columns = [array('q', column) for column in columns]
+        # 按职业和卡牌汇总的数据，key 为 (类型, 名称, 模式)，value 为各列的合计
+        self.totals = dict()
+
+
+class DeckStatsHistory:
+    """
+    卡组游戏数据的历史快照，只会追加，不会覆盖
+    """
+
+    def __init__(self, source, json_path=None, auto_load=True):
+        """
+        :param source: 卡组来源，例如 'HSBOX'
+        :param json_path: 快照文件的路径
+        :param auto_load: 选项，在初始化时载入已有的快照
+        """
+
+        self.source = source
+
+        if not json_path:
+            json_path = os.path.join(core.current_context().data_dir, 'HISTORY_{}.jsonl'.format(source))
+        self.json_path = json_path
+
+        self._reset()
+
+        if auto_load:
+            self.load()
+
+    def _reset(self):
+        self.snapshots = list()
+
+        # 卡组ID与卡组编号的对应关系，以及每个卡组的 (职业, 模式, 卡牌) 信息
+        self._deck_numbers = dict()
+        self._deck_ids = list()
+        self._deck_meta = list()
+
+        # 每个卡组最近一次记录的数据，用于差分编码
+        self._last_values = dict()
+
+        # 每小时和每天的最后一个快照，key 为时间段的开始时间，value 为快照的位置
+        self._rollups = {GRANULARITY_HOUR: dict(), GRANULARITY_DAY: dict()}
+
+    def __len__(self):
+        return len(self.snapshots)
+
+    def load(self, json_path=None):
+        """
+        载入快照文件
+        :param json_path: 快照文件的路径
+        """
+
+        if not json_path:
+            json_path = self.json_path
+
+        self._reset()
+
+        if not os.path.isfile(json_path):
+            return
+
+        logging.info('载入历史快照 {}'.format(json_path))
+
+        with open(json_path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+
+                for deck_id, class_name, mode, cards in record['new']:
+                    self._add_deck(deck_id, class_name, mode, cards)
+
+                deck_numbers = _delta_decode(record['decks'])
+                columns = list()
+                for i, column in enumerate(COLUMNS):
+                    columns.append([
+                        self._last_values.get(number, (0,) * len(COLUMNS))[i] + delta
+                        for number, delta in zip(deck_numbers, record[column])
+                    ])
+
+                self._add_snapshot(
+                    datetime.strptime(record['time'], DATE_TIME_FORMAT), deck_numbers, columns)
+
+    def record(self, decks, time=None):
+        """
+        将卡组合集中当前的游戏数据追加为一个新的快照
+        :param decks: 卡组合集
+        :param time: 快照时间，默认为当前时间
+        """
+
+        if not time:
+            time = datetime.now()
+        time = time.replace(microsecond=0)
+
+        if self.snapshots and time < self.snapshots[-1].time:
+            raise ValueError('快照时间不能早于上一个快照: {}'.format(time))
+
+        new = list()
+        rows = dict()
+
+        for deck in decks:
+            number = self._deck_numbers.get(deck.id)
+            if number is None:
+                class_name = deck.career.class_name if deck.career else None
+                cards = dict((card.id, count) for card, count in deck.cards.items())
+                number = self._add_deck(deck.id, class_name, deck.mode, cards)
+                new.append([deck.id, class_name, deck.mode, cards])
+            rows[number] = [getattr(deck, column, 0) or 0 for column in COLUMNS]
+
+        deck_numbers = sorted(rows)
+        columns = [[rows[number][i] for number in deck_numbers] for i in range(len(COLUMNS))]
+
+        record = dict(time=time.strftime(DATE_TIME_FORMAT), new=new, decks=_delta_encode(deck_numbers))
+        for i, column in enumerate(COLUMNS):
+            record[column] = [
+                value - self._last_values.get(number, (0,) * len(COLUMNS))[i]
+                for number, value in zip(deck_numbers, columns[i])
+            ]
+
+        core._prepare_dir(self.json_path)
+        with open(self.json_path, 'a') as f:
+            f.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')))
+            f.write('\n')
+
+        self._add_snapshot(time, deck_numbers, columns)
+
+        logging.info('已记录 {} 个卡组的历史快照'.format(len(deck_numbers)))
+
+    def trend(self, deck=None, career=None, card=None, mode=None, start=None, end=None, granularity=None):
+        """
+        查询卡组、职业或卡牌的游戏数据趋势 (三者选其一)
+        :param deck: 卡组或卡组ID
+        :param career: 职业
+        :param card: 卡牌或卡牌ID，将统计所有用到该卡牌的卡组
+        :param mode: 模式，仅对 career 和 card 有效，不填写则包括所有模式
+        :param start: 开始时间
+        :param end: 结束时间
+        :param granularity: 按 GRANULARITY_HOUR 或 GRANULARITY_DAY 汇总，不填写则返回每个快照
+        :return: 列表，每项为 dict，包括 time, win_rate, games_delta 以及 COLUMNS 中的各列
+        """
+
+        if len([x for x in (deck, career, card) if x is not None]) != 1:
+            raise ValueError('deck, career, card 三者须选其一')
+
+        if granularity:
+            points = [(bucket, self.snapshots[i]) for bucket, i in sorted(self._rollups[granularity].items())]
+        else:
+            points = [(snapshot.time, snapshot) for snapshot in self.snapshots]
+
+        if deck is not None:
+            number = self._deck_numbers.get(getattr(deck, 'id', deck))
+            if number is None:
+                return list()
+
+            def get_values(snapshot):
+                return self._deck_values(snapshot, number)
+        else:
+            if career is not None:
+                key = ('career', get_career(career).class_name, mode)
+            else:
+                key = ('card', getattr(card, 'id', card), mode)
+
+            def get_values(snapshot):
+                return snapshot.totals.get(key)
+
+        trend = list()
+        last_games = None
+
+        for time, snapshot in points:
+            if (start and time < start) or (end and time > end):
+                continue
+            values = get_values(snapshot) or (0,) * len(COLUMNS)
+            point = dict(zip(COLUMNS, values))
+            point['time'] = time
+            point['win_rate'] = point['wins'] / point['games'] if point['games'] else None
+            point['games_delta'] = None if last_games is None else point['games'] - last_games
+            last_games = point['games']
+            trend.append(point)
+
+        return trend
+
+    def _add_deck(self, deck_id, class_name, mode, cards):
+        number = len(self._deck_ids)
+        self._deck_numbers[deck_id] = number
+        self._deck_ids.append(deck_id)
+        self._deck_meta.append((class_name, mode, list(cards)))
+        return number
+
+    def _add_snapshot(self, time, deck_numbers, columns):
+        snapshot = _Snapshot(time, deck_numbers, columns)
+
+        totals = snapshot.totals
+        for i, number in enumerate(deck_numbers):
+            values = tuple(column[i] for column in columns)
+            self._last_values[number] = values
+
+            class_name, mode, card_ids = self._deck_meta[number]
+            keys = [('career', class_name, None), ('career', class_name, mode)]
+            for card_id in card_ids:
+                keys.append(('card', card_id, None))
+                keys.append(('card', card_id, mode))
+
+            for key in keys:
+                total = totals.get(key)
+                if total is None:
+                    totals[key] = list(values)
+                else:
+                    for j, value in enumerate(values):
+                        total[j] += value
+
+        position = len(self.snapshots)
+        self.snapshots.append(snapshot)
+
+        for granularity, rollup in self._rollups.items():
+            rollup[_bucket_start(time, granularity)] = position
+
+    @staticmethod
+    def _deck_values(snapshot, number):
+        # 卡组编号在快照中是有序的，使用二分查找
+        numbers = snapshot.deck_numbers
+        i = bisect_left(numbers, number)
+        if i < len(numbers) and numbers[i] == number:
+            return tuple(column[i] for column in snapshot.columns)
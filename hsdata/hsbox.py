@@ -10,16 +10,17 @@ import json
 import logging
 import multiprocessing
 import re
-from datetime import datetime
 
 import requests
 import scrapy
 from scrapy.crawler import CrawlerProcess
 
 from .core import (
-    DATE_TIME_FORMAT,
-    Deck, Decks, CAREERS
+    DATE_TIME_FORMAT, REJECT_BAD_FORMAT,
+    Deck, Decks, DeckValidator, CAREERS, deck_cards, parse_date_time
 )
+from .history import DeckStatsHistory
+from .metrics import span, timed, observe
 
 # 该来源的标识
 SOURCE_NAME = 'HSBOX'
@@ -45,6 +46,7 @@ class HSBoxDeck(Deck):
     # 该类卡组的 source 属性
     source = SOURCE_NAME
     DECK_URL_TEMPLATE = 'http://hs.gameyw.netease.com/box_group_details.html?code={}'
+    field_parsers = dict(created_at=lambda created_at: parse_date_time(created_at) if created_at else None)
 
     def __init__(self):
         super(HSBoxDeck, self).__init__()
@@ -66,15 +68,9 @@ class HSBoxDeck(Deck):
 
     def to_dict(self):
         dct = super(HSBoxDeck, self).to_dict()
-        dct['created_at'] = self.created_at.strftime(DATE_TIME_FORMAT)
+        dct['created_at'] = self.created_at.strftime(DATE_TIME_FORMAT) if self.created_at else None
         return dct
 
-    def from_dict(self, dct, cards=None):
-        created_at = dct.pop('created_at')
-        if created_at:
-            self.created_at = datetime.strptime(created_at, DATE_TIME_FORMAT)
-        super(HSBoxDeck, self).from_dict(dct, cards)
-
 
 class HSBoxDecks(Decks):
     # 当从本地JSON载入卡组时，将把每个卡组转化为该类
@@ -82,12 +78,26 @@ class HSBoxDecks(Decks):
 
     def __init__(self, json_path=None, auto_load=True):
         logging.info('初始化卡组合集 (网易炉石盒子)')
+        # 最近一次更新时被拒绝的卡组，每项为 dict(id=卡组ID, name=卡组名称, reasons=拒绝原因列表)
+        self.rejected = list()
+        self._history = None
         super(HSBoxDecks, self).__init__(json_path=json_path, auto_load=auto_load)
 
-    def update(self, json_path=None):
+    @property
+    def history(self):
+        """
+        卡组游戏数据的历史快照，每次 update 后会追加一个快照
+        """
+        if self._history is None:
+            self._history = DeckStatsHistory(self.source)
+        return self._history
+
+    @timed('hsbox.update')
+    def update(self, json_path=None, record_history=True):
         """
         从"炉石传说盒子"获取最新的卡组数据，并保存为JSON
         :param json_path: JSON的保存路径
+        :param record_history: 选项，将本次获取到的游戏数据追加到历史快照中
         """
 
         if not json_path:
@@ -102,6 +112,56 @@ class HSBoxDecks(Decks):
         rp_json_in_js = re.compile(r'var\s+(\w+)\s*=\s*(.+);')
         session = requests.Session()
 
+        def get_json(url):
+            resp = session.get(url)
+            resp.raise_for_status()
+            m = rp_json_in_js.search(resp.text)
+            return json.loads(m.group(2))
+
+        with span('hsbox.update.fetch'):
+            decks_data = get_json(url_data)
+            decks_duration = get_json(url_duration)
+
+        # 在旁边构建新的卡组，全部完成后再替换原有的数据，更新期间仍可正常读取
+        decks = self._parse(decks_data, decks_duration)
+        index = dict((deck.id, deck) for deck in decks)
+
+        logging.info('获取到 {} 个卡组'.format(len(decks)))
+        deck_ids = list(index.keys())
+
+        # 使用单独进程来运行爬虫，绕过 twisted reactor 无法重用的问题
+        with span('hsbox.update.crawl'):
+            with multiprocessing.Pool() as p:
+                results = p.apply(self._crawl, (deck_ids,))
+
+        for result in results:
+            observe('hsbox.crawl.request', result.get('latency'))
+            deck = index[result['deck_id']]
+            deck.games = result['games']
+            deck.wins = result['wins']
+            deck.ranked_games = result['ranked_games']
+            deck.ranked_wins = result['ranked_wins']
+            deck.users = result['users']
+
+        self._publish(decks, index)
+
+        # 保存卡组合集
+        self.save(json_path)
+
+        if record_history:
+            self.history.record(self)
+
+        logging.info('炉石盒子卡组数据更新完成')
+
+    @timed('hsbox.update.parse')
+    def _parse(self, decks_data, decks_duration):
+        """
+        将获取到的卡组数据转化为卡组，不会修改当前的卡组合集
+        :param decks_data: 卡组数据列表
+        :param decks_duration: 卡组的平均对局时长数据
+        :return: 卡组列表
+        """
+
         def get_num(parent, key_name, to_float=False):
             num = parent.get(key_name)
             if num == '':
@@ -113,17 +173,11 @@ class HSBoxDecks(Decks):
                     num = int(num)
             return num
 
-        def get_json(url):
-            resp = session.get(url)
-            resp.raise_for_status()
-            m = rp_json_in_js.search(resp.text)
-            return json.loads(m.group(2))
-
-        decks_data = get_json(url_data)
-        decks_duration = get_json(url_duration)
+        decks = list()
+        rejected = list()
 
-        # 清除原有的数据
-        self.clear()
+        # 炉石盒子的BUG，一些卡组会引用不存在，不可收集，或职业错误的卡牌，这些卡组将被记录并跳过
+        validator = DeckValidator(self.cards)
 
         for data in decks_data:
             deck = HSBoxDeck()
@@ -133,59 +187,33 @@ class HSBoxDecks(Decks):
 
             deck.career = CAREER_MAP.get(get_num(data, 'job'))
 
-            skip_this_deck = False
-
-            for card_count in data['deckString']['toPage'].split(','):
-                card_id, count = card_count.split(':')
-                card = self.cards.get(card_id)
-
-                # 炉石盒子的BUG，一些卡组会引用不存在，不可收集，或职业错误的卡牌
-                if not card or not card.collectible or deck.career not in card.careers:
-                    skip_this_deck = True
-                    break
-
-                if not card:
-                    raise ValueError('缺少卡牌: {}'.format(card_id))
-                count = int(count)
-                deck.cards[card] = count
+            try:
+                card_counts = _parse_card_counts(data['deckString']['toPage'])
+            except (KeyError, TypeError, AttributeError, ValueError):
+                reasons = [(REJECT_BAD_FORMAT, None)]
             else:
-                num_of_cards = sum(deck.cards.values())
-                if num_of_cards != 30:
-                    raise ValueError('{} 的卡牌数量为 {}，应为 30'.format(
-                        deck, num_of_cards))
+                reasons = validator.validate(deck.career, card_counts)
 
-            if skip_this_deck:
-                logging.debug('跳过错误卡组: {}'.format(deck.name))
+            if reasons:
+                logging.debug('跳过错误卡组: {} {}'.format(deck.name, reasons))
+                rejected.append(dict(id=deck.id, name=deck.name, reasons=reasons))
                 continue
 
-            deck.created_at = datetime.strptime(data.get('time'), '%Y-%m-%d %H:%M:%S')
+            deck.cards = deck_cards(self.cards, card_counts)
+
+            deck.created_at = parse_date_time(data.get('time'))
 
             duration = decks_duration.get(deck.id)
             if duration:
                 deck.duration = duration.get('ctime')
 
-            # 加入到卡组合集
-            self.append(deck)
+            decks.append(deck)
 
-        logging.info('获取到 {} 个卡组'.format(len(self)))
-        deck_ids = list(self._index.keys())
+        self.rejected = rejected
+        if rejected:
+            logging.info('跳过 {} 个错误卡组'.format(len(rejected)))
 
-        # 使用单独进程来运行爬虫，绕过 twisted reactor 无法重用的问题
-        with multiprocessing.Pool() as p:
-            results = p.apply(self._crawl, (deck_ids,))
-
-        for result in results:
-            deck = self.get(result['deck_id'])
-            deck.games = result['games']
-            deck.wins = result['wins']
-            deck.ranked_games = result['ranked_games']
-            deck.ranked_wins = result['ranked_wins']
-            deck.users = result['users']
-
-        # 保存卡组合集
-        self.save(json_path)
-
-        logging.info('炉石盒子卡组数据更新完成')
+        return decks
 
     @staticmethod
     def _crawl(deck_ids):
@@ -198,6 +226,19 @@ class HSBoxDecks(Decks):
         return results
 
 
+def _parse_card_counts(text):
+    """
+    解析炉石盒子 "卡牌ID:数量,卡牌ID:数量" 格式的卡牌列表
+    :param text: 卡牌列表字串
+    :return: (card_id, count) 列表
+    """
+    card_counts = list()
+    for card_count in text.split(','):
+        card_id, count = card_count.split(':')
+        card_counts.append((card_id, int(count)))
+    return card_counts
+
+
 class HSBoxScrapyItem(scrapy.Item):
     games = scrapy.Field()
     wins = scrapy.Field()
@@ -205,6 +246,7 @@ class HSBoxScrapyItem(scrapy.Item):
     ranked_wins = scrapy.Field()
     users = scrapy.Field()
     deck_id = scrapy.Field()
+    latency = scrapy.Field()
 
 
 class HSBoxScrapySpider(scrapy.Spider):
@@ -239,6 +281,7 @@ class HSBoxScrapySpider(scrapy.Spider):
             item['users'] = r['users']
 
             item['deck_id'] = response.meta['deck_id']
+            item['latency'] = response.meta.get('download_latency')
 
             yield item
 
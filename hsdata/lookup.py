@@ -0,0 +1,453 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+
+"""
+卡牌名称的模糊查找和自动补全
+~~~~~~~~~~~~~~~~~~~~~~~~
+
+* CardLookup: 为多种语言的卡牌名称建立三元组 (trigram) 索引，先通过索引选出候选名称，再按编辑距离排序，
+  可容忍拼写错误和不完整的名称；若安装了 pypinyin，还可以使用拼音或拼音首字母查找中文名称
+* PrefixIndex: 名称的前缀树，用于输入时的自动补全
+
+    >>> import hsdata
+    >>> hsdata.CARDS.fuzzy_search('firebal')
+    >>> hsdata.CARDS.fuzzy_search('huoqiushu')
+    >>> hsdata.CARDS.autocomplete('火球')
+
+"""
+
+import bisect
+import heapq
+import itertools
+import re
+import unicodedata
+from collections import Counter
+
+try:
+    from pypinyin import lazy_pinyin
+except ImportError:
+    lazy_pinyin = None
+
+# 可以生成拼音索引的语言
+PINYIN_LANGUAGES = ('zhCN', 'zhTW')
+
+# 每个结果至少计算编辑距离的候选名称数量
+MIN_CANDIDATES = 50
+
+_PUNCTUATION = re.compile(r"[\s\-_'\".,:;!?()\[\]「」『』《》·・，。：！？]+")
+
+
+def normalize_name(name):
+    """
+    标准化名称: 转为小写，去除重音符号、空白和标点
+    :param name: 名称
+    :return: 标准化后的名称
+    """
+
+    if not name:
+        return ''
+    name = unicodedata.normalize('NFKD', name.lower())
+    name = ''.join(c for c in name if not unicodedata.combining(c))
+    return _PUNCTUATION.sub('', name)
+
+
+def pinyin_keys(name):
+    """
+    获取中文名称的拼音和拼音首字母，需要安装 pypinyin
+    :param name: 中文名称
+    :return: 拼音和拼音首字母的列表，未安装 pypinyin 时为空列表
+    """
+
+    if lazy_pinyin is None or not name:
+        return list()
+    syllables = [normalize_name(s) for s in lazy_pinyin(name)]
+    syllables = [s for s in syllables if s]
+    if not syllables:
+        return list()
+    return [''.join(syllables), ''.join(s[0] for s in syllables)]
+
+
+def trigrams(key):
+    """
+    :param key: 标准化后的名称
+    :return: 三元组集合，首尾补齐空格，使短名称和名称的开头也能生成三元组
+    """
+    padded = '  {} '.format(key)
+    return set(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def levenshtein(a, b):
+    """
+    计算编辑距离
+    """
+
+    if len(a) < len(b):
+        a, b = b, a
+
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+def similarity(query, key):
+    """
+    查询与名称的相似度，介于 0 和 1 之间
+    以编辑距离为主，名称包含完整的查询时 (例如输入了名称的前一部分) 给予较高的分数
+    """
+
+    if query == key:
+        return 1.0
+    longest = max(len(query), len(key))
+    score = 1 - levenshtein(query, key) / longest
+    if key.startswith(query):
+        score = max(score, 0.8 + 0.2 * len(query) / len(key))
+    elif query in key:
+        score = max(score, 0.7 + 0.2 * len(query) / len(key))
+    return score
+
+
+class CardLookup:
+    """
+    卡牌名称的模糊查找索引，可包含多种语言的卡牌合集
+    """
+
+    def __init__(self, *cards_list, pinyin=True):
+        """
+        :param cards_list: 若干个 Cards 对象，通常为同一版本不同语言的卡牌
+        :param pinyin: 选项，为中文名称添加拼音索引 (需要安装 pypinyin)
+        """
+
+        self.pinyin = pinyin
+        # 索引中的名称，每个元素为 (标准化的名称, 卡牌ID)
+        self.keys = list()
+        self._key_ids = dict()
+        self._trigrams = dict()
+
+        for cards in cards_list:
+            self.add_cards(cards)
+
+    def add_cards(self, cards):
+        """
+        将卡牌合集中的名称加入索引
+        :param cards: Cards 对象
+        """
+
+        language = getattr(cards, 'language', None)
+        with_pinyin = self.pinyin and language in PINYIN_LANGUAGES
+
+        for card in cards:
+            key = normalize_name(card.name)
+            self.add(key, card.id)
+            if with_pinyin:
+                for pinyin_key in pinyin_keys(card.name):
+                    self.add(pinyin_key, card.id)
+
+    def add(self, key, card_id):
+        """
+        加入单个名称，重复的名称将被忽略
+        :param key: 标准化的名称
+        :param card_id: 卡牌ID
+        """
+
+        if not key or (key, card_id) in self._key_ids:
+            return
+        number = self._key_ids[key, card_id] = len(self.keys)
+        self.keys.append((key, card_id))
+        for trigram in trigrams(key):
+            self._trigrams.setdefault(trigram, list()).append(number)
+
+    def search(self, query, top_k=5, accept=None):
+        """
+        查找与名称最接近的卡牌
+        :param query: 名称，可包含拼写错误，或为中文名称的拼音
+        :param top_k: 最多返回的数量
+        :param accept: 用于筛选卡牌ID的函数，返回 False 的卡牌将被忽略
+        :return: [(卡牌ID, 相似度), ...]，按相似度倒排
+        """
+
+        query = normalize_name(query)
+        if not query:
+            return list()
+
+        query_trigrams = trigrams(query)
+        shared = Counter()
+        for trigram in query_trigrams:
+            shared.update(self._trigrams.get(trigram, ()))
+
+        if accept is not None:
+            shared = [(number, count) for number, count in shared.items() if accept(self.keys[number][1])]
+        else:
+            shared = shared.items()
+
+        # 按共有三元组的比例 (Dice 系数) 选出候选名称，只对候选计算编辑距离
+        def dice(item):
+            number, count = item
+            return 2 * count / (len(query_trigrams) + len(self.keys[number][0]) + 1)
+
+        candidates = heapq.nlargest(max(MIN_CANDIDATES, top_k * 10), shared, key=dice)
+
+        best = dict()
+        for number, _ in candidates:
+            key, card_id = self.keys[number]
+            score = similarity(query, key)
+            if score > best.get(card_id, -1):
+                best[card_id] = score
+
+        found = sorted(best.items(), key=lambda x: x[1], reverse=True)
+        return found[:top_k]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __repr__(self):
+        return '<{}: {} keys>'.format(self.__class__.__name__, len(self.keys))
+
+
+class _TrieNode:
+    __slots__ = ('children', 'entries', 'top')
+
+    def __init__(self):
+        self.children = dict()
+        # 在该节点结束的名称
+        self.entries = list()
+        # 以该节点为前缀的排名最高的名称，已排好序，每个值只保留其排名最高的名称
+        self.top = list()
+
+
+class PrefixIndex:
+    """
+    名称前缀索引 (前缀树)，用于输入时的自动补全
+
+    每个节点保存以其为前缀的排名最高的 top_k 个名称，补全时只需找到前缀对应的节点，与名称的总数无关；
+    按字符 (而非单词) 建立节点，中日韩文字同样适用
+
+    排名依次按照: 权重 (例如卡牌在卡组中的使用次数) 从高到低，名称从短到长，名称的字母顺序
+    """
+
+    def __init__(self, top_k=10):
+        """
+        :param top_k: 每个前缀最多可返回的结果数量
+        """
+
+        self.top_k = top_k
+        self._root = _TrieNode()
+        # 值: 权重
+        self._weights = dict()
+        # 值: [(标准化的名称, 原名称), ...]
+        self._keys = dict()
+
+    def _entry(self, key, text, value):
+        return -self._weights.get(value, 0), len(key), key, text, value
+
+    def _path(self, key):
+        nodes = [self._root]
+        for char in key:
+            nodes.append(nodes[-1].children[char])
+        return nodes
+
+    def _push(self, node, entry):
+        top = node.top
+        value = entry[-1]
+        for i, other in enumerate(top):
+            if other[-1] == value:
+                if other <= entry:
+                    return
+                del top[i]
+                break
+        if len(top) < self.top_k or entry < top[-1]:
+            bisect.insort(top, entry)
+            del top[self.top_k:]
+
+    def _recompute(self, node):
+        # 子节点的候选已按值去重，某个值若不在子节点的候选中，则子节点已有 top_k 个排名更高的其他值
+        top = list()
+        seen = set()
+        for entry in sorted(itertools.chain(node.entries, *(child.top for child in node.children.values()))):
+            if entry[-1] not in seen:
+                seen.add(entry[-1])
+                top.append(entry)
+                if len(top) >= self.top_k:
+                    break
+        node.top = top
+
+    def add(self, text, value, key=None):
+        """
+        加入名称
+        :param text: 名称
+        :param value: 名称对应的值，例如卡牌ID，需可比较大小
+        :param key: 标准化的名称，不填写则由 text 生成
+        """
+
+        if key is None:
+            key = normalize_name(text)
+        if not key:
+            return
+        keys = self._keys.setdefault(value, list())
+        if (key, text) in keys:
+            return
+        keys.append((key, text))
+
+        entry = self._entry(key, text, value)
+        node = self._root
+        self._push(node, entry)
+        for char in key:
+            child = node.children.get(char)
+            if child is None:
+                child = node.children[char] = _TrieNode()
+            node = child
+            self._push(node, entry)
+        node.entries.append(entry)
+
+    def remove(self, value):
+        """
+        移除值对应的所有名称，只重新计算受影响的节点
+        :param value: 名称对应的值
+        """
+
+        for key, text in self._keys.pop(value, ()):
+            entry = self._entry(key, text, value)
+            path = self._path(key)
+            path[-1].entries.remove(entry)
+
+            # 自下而上删除空节点，并重新计算包含该名称的节点 (祖先节点的候选更多，若某节点不包含则祖先也不包含)
+            for depth in range(len(path) - 1, -1, -1):
+                node = path[depth]
+                if depth and not node.entries and not node.children:
+                    del path[depth - 1].children[key[depth - 1]]
+                elif entry in node.top:
+                    self._recompute(node)
+                else:
+                    break
+
+    def set_weight(self, value, weight):
+        """
+        修改值的权重
+        :param value: 名称对应的值
+        :param weight: 新的权重
+        """
+
+        if self._weights.get(value, 0) == weight:
+            return
+        names = self._keys.get(value, ())
+        self.remove(value)
+        if weight:
+            self._weights[value] = weight
+        else:
+            self._weights.pop(value, None)
+        for key, text in names:
+            self.add(text, value, key)
+
+    def set_weights(self, weights):
+        """
+        使用新的权重替换全部权重，只更新有变化的值
+        :param weights: dict，key 为值，value 为权重
+        """
+
+        for value in set(self._weights) | set(weights):
+            self.set_weight(value, weights.get(value, 0))
+
+    def complete(self, prefix, limit=None):
+        """
+        获取以 prefix 开头的名称
+        :param prefix: 已输入的前缀
+        :param limit: 最多返回的数量，不超过 top_k
+        :return: [(值, 名称), ...]，每个值只出现一次
+        """
+
+        node = self._root
+        for char in normalize_name(prefix):
+            node = node.children.get(char)
+            if node is None:
+                return list()
+        return _values(node.top, limit)
+
+    def cursor(self):
+        """
+        :return: 用于逐个按键补全的 PrefixCursor 对象
+        """
+        return PrefixCursor(self)
+
+    def __contains__(self, value):
+        return value in self._keys
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __repr__(self):
+        return '<{}: {} values>'.format(self.__class__.__name__, len(self._keys))
+
+
+class PrefixCursor:
+    """
+    逐个按键的补全，每次输入或删除一个字符只需移动到相邻的节点
+    """
+
+    def __init__(self, index):
+        self.index = index
+        # 已经过的节点，None 表示前缀不存在
+        self._nodes = [index._root]
+        # 每次输入的字符对应的节点数量 (标点等字符不对应节点，部分字符标准化后对应多个节点)
+        self._steps = list()
+
+    def type(self, text):
+        """
+        输入字符
+        :param text: 一个或多个字符
+        :return: 当前的补全结果
+        """
+
+        for char in text:
+            normalized = normalize_name(char)
+            for c in normalized:
+                node = self._nodes[-1]
+                self._nodes.append(node.children.get(c) if node is not None else None)
+            self._steps.append(len(normalized))
+        return self.results()
+
+    def backspace(self, count=1):
+        """
+        删除最后输入的字符
+        :param count: 删除的字符数
+        :return: 当前的补全结果
+        """
+
+        for _ in range(min(count, len(self._steps))):
+            del self._nodes[len(self._nodes) - self._steps.pop():]
+        return self.results()
+
+    def results(self, limit=None):
+        """
+        :return: [(值, 名称), ...]
+        """
+
+        node = self._nodes[-1]
+        if node is None:
+            return list()
+        return _values(node.top, limit)
+
+
+def _values(entries, limit=None):
+    return [(value, text) for _, _, _, text, value in entries[:limit or None]]
+
+
+def decks_popularity(decks):
+    """
+    统计卡牌在卡组中的使用情况，可作为自动补全的权重
+    :param decks: 卡组合集
+    :return: Counter，key 为卡牌ID，value 为所在卡组的游戏次数之和 (没有游戏次数的卡组计为 1)
+    """
+
+    popularity = Counter()
+    for deck in decks:
+        weight = deck.games or 1
+        for card in deck.cards:
+            popularity[card.id] += weight
+    return popularity
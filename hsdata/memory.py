@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+
+"""
+内存统计
+~~~~~~~
+
+统计卡牌、职业和卡组合集及其索引所占用的内存，被多处引用的对象只计算一次
+
+    >>> import hsdata
+    >>> from hsdata import memory
+    >>>
+    >>> decks = hsdata.HSBoxDecks()
+    >>> for name, size in memory.memory_report(decks_list=[decks]).items():
+    >>>     print(name, size)
+
+"""
+
+import sys
+import tracemalloc
+import types
+from collections import OrderedDict
+
+from . import core
+
+# 这些类型的对象属于共享的基础设施，不计入统计
+_IGNORED_TYPES = (
+    type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType,
+    types.MethodType, types.CodeType, types.FrameType,
+)
+
+
+def deep_sizeof(obj, seen=None):
+    """
+    统计对象及其引用的所有对象占用的内存
+    :param obj: 要统计的对象
+    :param seen: 已统计过的对象 id 集合，在多次调用间共用，可避免重复计算共享的对象
+    :return: 字节数
+    """
+
+    if seen is None:
+        seen = set()
+
+    size = 0
+    stack = [obj]
+
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, _IGNORED_TYPES):
+            continue
+        seen.add(id(obj))
+
+        size += sys.getsizeof(obj)
+
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+
+        # 自定义类的对象 (包括 list 和 dict 的子类)
+        obj_dict = getattr(obj, '__dict__', None)
+        if isinstance(obj_dict, dict):
+            stack.append(obj_dict)
+        for slot in getattr(type(obj), '__slots__', ()):
+            if hasattr(obj, slot):
+                stack.append(getattr(obj, slot))
+
+    return size
+
+
+def _collection_report(name, collection, seen, report):
+    """
+    统计一个合集 (Cards 或 Decks)，其中下划线开头的属性 (索引、缓存等) 将单独列出
+    """
+
+    private = OrderedDict()
+    public = list()
+    for attr, value in vars(collection).items():
+        if attr.startswith('_') and not isinstance(value, (type(None), bool, int, float, str)):
+            private[attr] = value
+        else:
+            public.append(value)
+
+    # 先标记，以免在统计合集本身时被计入
+    seen.add(id(vars(collection)))
+    for value in private.values():
+        seen.add(id(value))
+
+    size = sys.getsizeof(collection) + sys.getsizeof(vars(collection))
+    for item in collection:
+        size += deep_sizeof(item, seen)
+    for value in public:
+        size += deep_sizeof(value, seen)
+    report[name] = size
+
+    for attr, value in private.items():
+        seen.discard(id(value))
+        report['{}.{}'.format(name, attr)] = deep_sizeof(value, seen)
+
+
+def memory_report(cards=None, decks_list=(), seen=None):
+    """
+    统计各个数据结构占用的内存
+    按 卡牌、职业英雄名称、各卡组合集 的顺序统计，已在前面统计过的共享对象 (例如卡组中引用的卡牌) 不会重复计算
+    :param cards: Cards 对象，默认为当前上下文的卡牌
+    :param decks_list: Decks 对象列表，名称将使用其 source 属性
+    :param seen: 已统计过的对象 id 集合
+    :return: OrderedDict，key 为名称，value 为字节数
+    """
+
+    context = core.current_context()
+
+    if cards is None:
+        cards = context.cards
+    if seen is None:
+        seen = set()
+
+    report = OrderedDict()
+
+    _collection_report('cards', cards, seen, report)
+    report['careers'] = deep_sizeof(context.careers, seen)
+
+    for i, decks in enumerate(decks_list):
+        name = 'decks[{}]'.format(decks.source or i)
+        if name in report:
+            name = 'decks[{}:{}]'.format(decks.source, i)
+        _collection_report(name, decks, seen, report)
+
+    return report
+
+
+class trace_memory:
+    """
+    使用 tracemalloc 记录一段代码中分配的内存
+
+        >>> with trace_memory() as t:
+        >>>     decks.load()
+        >>> print(t.allocated, t.peak)
+
+    """
+
+    def __init__(self, top=0):
+        """
+        :param top: 记录分配内存最多的 n 个代码位置
+        """
+        self.top = top
+        self.allocated = None
+        self.peak = None
+        self.top_stats = list()
+        self._started = False
+        self._before = None
+        self._snapshot = None
+
+    def __enter__(self):
+        self._started = not tracemalloc.is_tracing()
+        if self._started:
+            tracemalloc.start()
+        elif hasattr(tracemalloc, 'reset_peak'):
+            # Python 3.9 之前没有 reset_peak，此时的峰值可能包括进入之前的分配
+            tracemalloc.reset_peak()
+        self._before = tracemalloc.get_traced_memory()[0]
+        if self.top:
+            self._snapshot = tracemalloc.take_snapshot()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        current, peak = tracemalloc.get_traced_memory()
+        self.allocated = current - self._before
+        self.peak = peak - self._before
+        if self.top:
+            stats = tracemalloc.take_snapshot().compare_to(self._snapshot, 'lineno')
+            self.top_stats = stats[:self.top]
+        if self._started:
+            tracemalloc.stop()
+        return False
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+
+"""
+耗时统计
+~~~~~~~
+
+在载入、更新、搜索和统计等操作中记录命名的耗时区间 (span)，并交给可替换的接收器 (sink) 处理
+
+默认没有接收器，此时 span() 只会返回一个共享的空对象，几乎没有额外开销
+
+    >>> import hsdata
+    >>> from hsdata import metrics
+    >>>
+    >>> sink = metrics.HistogramSink()
+    >>> metrics.set_sink(sink)
+    >>> decks = hsdata.HSBoxDecks()
+    >>> print(sink.to_prometheus())
+
+"""
+
+import functools
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+# 当前的接收器，为 None 时不做任何统计
+_sink = None
+
+# 默认的直方图区间上限 (秒)
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0, float('inf'))
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    def __init__(self, name, sink):
+        self.name = name
+        self.sink = sink
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.sink.observe(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def set_sink(sink):
+    """
+    设置接收器，设为 None 则关闭统计
+    :param sink: 具有 observe(name, seconds) 方法的对象
+    :return: 之前的接收器
+    """
+    global _sink
+    previous = _sink
+    _sink = sink
+    return previous
+
+
+def get_sink():
+    return _sink
+
+
+def span(name):
+    """
+    记录一个命名的耗时区间，用于 with 语句
+    :param name: 区间名称，例如 'decks.load'
+    """
+    sink = _sink
+    if sink is None:
+        return _NULL_SPAN
+    return _Span(name, sink)
+
+
+def observe(name, seconds):
+    """
+    直接记录一个耗时，例如爬虫请求的下载耗时
+    :param name: 区间名称
+    :param seconds: 耗时秒数
+    """
+    sink = _sink
+    if sink is not None and seconds is not None:
+        sink.observe(name, seconds)
+
+
+def timed(name):
+    """
+    装饰器，记录函数或方法的耗时
+    :param name: 区间名称
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            sink = _sink
+            if sink is None:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                sink.observe(name, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+class CallbackSink:
+    """将每个耗时交给回调函数处理"""
+
+    def __init__(self, callback):
+        """
+        :param callback: 回调函数，参数为 (name, seconds)
+        """
+        self.callback = callback
+
+    def observe(self, name, seconds):
+        self.callback(name, seconds)
+
+
+class HistogramSink:
+    """在内存中按区间名称统计耗时直方图"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        :param buckets: 直方图区间上限 (秒)，须从小到大排列
+        """
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._stats = dict()
+
+    def observe(self, name, seconds):
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = dict(
+                    count=0, sum=0.0, min=seconds, max=seconds,
+                    buckets=[0] * len(self.buckets))
+            stats['count'] += 1
+            stats['sum'] += seconds
+            stats['min'] = min(stats['min'], seconds)
+            stats['max'] = max(stats['max'], seconds)
+            for i, upper in enumerate(self.buckets):
+                if seconds <= upper:
+                    stats['buckets'][i] += 1
+                    break
+
+    def clear(self):
+        with self._lock:
+            self._stats.clear()
+
+    def summary(self):
+        """
+        :return: dict，key 为区间名称，value 包括 count, sum, min, max, avg
+        """
+        with self._lock:
+            summary = dict()
+            for name, stats in self._stats.items():
+                summary[name] = dict(
+                    count=stats['count'], sum=stats['sum'],
+                    min=stats['min'], max=stats['max'],
+                    avg=stats['sum'] / stats['count'])
+            return summary
+
+    def to_prometheus(self, metric_name='hsdata_span_seconds'):
+        """
+        转化为 Prometheus 文本格式
+        :param metric_name: 指标名称
+        :return: 文本
+        """
+
+        lines = [
+            '# HELP {} Time spent in hsdata operations.'.format(metric_name),
+            '# TYPE {} histogram'.format(metric_name),
+        ]
+
+        with self._lock:
+            for name in sorted(self._stats):
+                stats = self._stats[name]
+                cumulative = 0
+                for upper, count in zip(self.buckets, stats['buckets']):
+                    cumulative += count
+                    le = '+Inf' if upper == float('inf') else repr(upper)
+                    lines.append('{}_bucket{{span="{}",le="{}"}} {}'.format(metric_name, name, le, cumulative))
+                if self.buckets[-1] != float('inf'):
+                    lines.append('{}_bucket{{span="{}",le="+Inf"}} {}'.format(metric_name, name, stats['count']))
+                lines.append('{}_sum{{span="{}"}} {}'.format(metric_name, name, stats['sum']))
+                lines.append('{}_count{{span="{}"}} {}'.format(metric_name, name, stats['count']))
+
+        return '\n'.join(lines) + '\n'
+
+
+class PrometheusSink(HistogramSink):
+    """统计耗时直方图，并可写入 Prometheus 文本文件，或在本地提供 /metrics 接口"""
+
+    def __init__(self, path=None, buckets=DEFAULT_BUCKETS):
+        """
+        :param path: 文本文件路径，可用于 node_exporter 的 textfile collector
+        """
+        super(PrometheusSink, self).__init__(buckets)
+        self.path = path
+        self._server = None
+
+    def write(self, path=None):
+        """
+        将当前的统计写入文本文件
+        :param path: 文件路径，默认为初始化时的 path
+        """
+        path = path or self.path
+        if not path:
+            raise ValueError('未指定文件路径')
+        tmp_path = '{}.tmp'.format(path)
+        with open(tmp_path, 'w') as f:
+            f.write(self.to_prometheus())
+        # 先写入临时文件再替换，避免被读取到不完整的内容
+        os.replace(tmp_path, path)
+
+    def serve(self, port=9108, host='127.0.0.1'):
+        """
+        在后台线程中提供 /metrics 接口
+        :param port: 端口
+        :param host: 地址
+        :return: HTTPServer 对象，可使用 .shutdown() 停止
+        """
+
+        sink = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = sink.to_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, fmt, *args):
+                logging.debug(fmt, *args)
+
+        self._server = HTTPServer((host, port), Handler)
+        thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        thread.start()
+        logging.info('耗时统计接口: http://{}:{}/metrics'.format(host, self._server.server_port))
+        return self._server
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+
+"""
+多进程并行统计
+~~~~~~~~~~~~
+
+按职业和模式将 cards_value、career_cards_stats 和 DeckGenerator 的计算分配到进程池中，再合并各部分的结果
+
+各进程映射同一个共享数据文件 (见 shared 模块)，任务中只传递文件路径，不会为每个任务序列化全部卡组；
+若传入的是普通的卡组合集，将先导出到临时文件
+
+    >>> import hsdata
+    >>> from hsdata import parallel
+    >>>
+    >>> decks = hsdata.HSBoxDecks()
+    >>> # 所有职业 × 两种模式的卡牌统计
+    >>> report = parallel.parallel_career_cards_stats(decks)
+    >>> cards_stats, top_decks = report['MAGE', hsdata.MODE_STANDARD]
+
+"""
+
+import os
+import shutil
+import tempfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+from . import core
+from .core import MODE_STANDARD, MODE_WILD, Careers, HSData
+from .metrics import timed
+from .shared import SharedDataset, SharedDecks, export_shared
+from .utils import DeckGenerator, CARDS_VALUE_TOTAL, _add_card_value, _rank_cards_value
+
+# 各工作进程中已映射的共享数据文件，key 为 (路径, 修改时间)
+_datasets = dict()
+
+
+def _attach(path):
+    """
+    在工作进程中映射共享数据文件，同一文件只映射一次
+    """
+    key = path, os.path.getmtime(path)
+    entry = _datasets.get(key)
+    if entry is None:
+        dataset = SharedDataset(path)
+        # 工作进程中的卡组和卡牌均来自共享数据，不需要载入 (或下载) 本地的卡牌数据
+        context = HSData(dataset.meta.get('language'))
+        context.cards = dataset.cards
+        entry = _datasets[key] = dataset, context
+    return entry
+
+
+def _task_card_totals(path, class_name, mode, min_games, top_win_rate_percentage):
+    """
+    统计单个职业和模式中各卡牌的数据
+    :return: (dict(卡牌ID: [总数量, 总游戏次数, 总获胜次数, 所在卡组数]), 所选卡组的ID列表)
+    """
+    dataset, context = _attach(path)
+    with context.use():
+        decks = dataset.decks
+        rows = decks.top_rows(class_name, mode, min_games, top_win_rate_percentage)
+        totals = dict(
+            (dataset.cards._card(number).id, total) for number, total in decks.card_totals(rows).items())
+        if top_win_rate_percentage is None:
+            return totals, None
+        return totals, [decks.deck_id(i) for i in rows]
+
+
+def _task_generate(path, class_name, mode):
+    """
+    为单个职业生成卡组
+    :return: dict(卡牌ID: 数量)
+    """
+    dataset, context = _attach(path)
+    with context.use():
+        decks = dataset.decks.search(career=class_name, mode=mode)
+        generator = DeckGenerator(class_name, decks, mode=mode)
+        if not generator.top_decks_total_games:
+            return dict()
+        return dict((card.id, count) for card, count in generator.cards.items())
+
+
+@contextmanager
+def _shared_path(decks):
+    """
+    获取卡组合集对应的共享数据文件，若为普通的卡组合集则导出到临时文件
+    """
+
+    if isinstance(decks, SharedDataset):
+        yield decks.path
+    elif isinstance(decks, SharedDecks):
+        yield decks._dataset.path
+    else:
+        tmp_dir = tempfile.mkdtemp(prefix='hsdata_parallel_')
+        try:
+            path = os.path.join(tmp_dir, 'decks.hsd')
+            export_shared(path, decks)
+            yield path
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _views(decks):
+    """
+    :return: (用于还原卡组的对象, 用于还原卡牌的对象)
+    """
+    if isinstance(decks, SharedDataset):
+        decks = decks.decks
+    return decks, decks.cards
+
+
+def _class_names(careers):
+    if careers is None:
+        return [career.class_name for career in core.current_context().careers.basic]
+    return [core.get_career(career).class_name for career in careers]
+
+
+@timed('parallel.cards_value')
+def parallel_cards_value(decks, mode=MODE_STANDARD, processes=None):
+    """
+    cards_value 的并行版本，按职业分配到多个进程中统计，结果与 cards_value 相同
+    :param decks: Decks, SharedDecks 或 SharedDataset 对象
+    :param mode: 模式
+    :param processes: 进程数，默认为 CPU 核数
+    :return: 单卡价值排名数据
+    """
+
+    decks, cards = _views(decks)
+    careers = core.current_context().careers
+    class_names = list(Careers.CLASS_NAMES)
+
+    with _shared_path(decks) as path, ProcessPoolExecutor(processes) as executor:
+        futures = [
+            (class_name, executor.submit(_task_card_totals, path, class_name, mode, 0, None))
+            for class_name in class_names]
+        partials = [(class_name, future.result()[0]) for class_name, future in futures]
+
+    stats = dict()
+    stats[CARDS_VALUE_TOTAL] = dict()
+
+    for class_name, totals in partials:
+        if not totals:
+            continue
+        career = careers.get(class_name)
+        stats[career] = dict()
+        for card_id, (count, games, wins, used_in_decks) in totals.items():
+            card = cards.get(card_id)
+            for k in CARDS_VALUE_TOTAL, career:
+                _add_card_value(stats[k], card, used_in_decks, games, wins, count)
+
+    _rank_cards_value(stats)
+    return stats
+
+
+@timed('parallel.career_cards_stats')
+def parallel_career_cards_stats(
+        decks, careers=None, modes=(MODE_STANDARD, MODE_WILD),
+        min_games=1000, top_win_rate_percentage=0.1, processes=None):
+    """
+    为多个职业和模式并行运行 career_cards_stats
+    :param decks: Decks, SharedDecks 或 SharedDataset 对象
+    :param careers: 职业列表，默认为所有基本职业
+    :param modes: 模式列表
+    :param min_games: 最少游戏次数
+    :param top_win_rate_percentage: 选取胜率最高的 n% 卡组
+    :param processes: 进程数，默认为 CPU 核数
+    :return: dict，key 为 (class_name, mode)，value 与 career_cards_stats 的结果相同
+    """
+
+    decks, cards = _views(decks)
+    class_names = _class_names(careers)
+
+    with _shared_path(decks) as path, ProcessPoolExecutor(processes) as executor:
+        futures = [
+            ((class_name, mode), executor.submit(
+                _task_card_totals, path, class_name, mode, min_games, top_win_rate_percentage))
+            for class_name in class_names for mode in modes]
+        results = [(key, future.result()) for key, future in futures]
+
+    report = dict()
+    for key, (totals, deck_ids) in results:
+        cards_stats = dict()
+        for card_id, (total_count, total_games, total_wins, used_in_decks) in totals.items():
+            cards_stats[cards.get(card_id)] = dict(
+                total_count=total_count,
+                total_games=total_games,
+                total_wins=total_wins,
+                used_in_decks=used_in_decks,
+                avg_count=total_count / used_in_decks,
+                avg_win_rate=total_wins / total_games if total_games else None,
+            )
+        top_decks = core.Decks([decks.get(deck_id) for deck_id in deck_ids], cards=cards)
+        report[key] = cards_stats, top_decks
+
+    return report
+
+
+@timed('parallel.generate_decks')
+def parallel_generate_decks(decks, careers=None, mode=MODE_STANDARD, processes=None):
+    """
+    为多个职业并行运行 DeckGenerator
+    :param decks: Decks, SharedDecks 或 SharedDataset 对象
+    :param careers: 职业列表，默认为所有基本职业
+    :param mode: 模式
+    :param processes: 进程数，默认为 CPU 核数
+    :return: dict，key 为 class_name，value 为生成的卡组 (Counter，key 为卡牌，value 为数量)
+    """
+
+    decks, cards = _views(decks)
+    class_names = _class_names(careers)
+
+    with _shared_path(decks) as path, ProcessPoolExecutor(processes) as executor:
+        futures = [
+            (class_name, executor.submit(_task_generate, path, class_name, mode))
+            for class_name in class_names]
+        results = [(class_name, future.result()) for class_name, future in futures]
+
+    return dict(
+        (class_name, Counter(dict((cards.get(card_id), count) for card_id, count in card_counts.items())))
+        for class_name, card_counts in results)
@@ -0,0 +1,557 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+
+"""
+本地 HTTP 查询服务
+~~~~~~~~~~~~~~~~
+
+只需载入一次卡牌和卡组数据，即可通过 HTTP 查询卡牌、卡组、统计数据和生成卡组，返回 JSON
+
+* 响应会被缓存，缓存的 key 包括卡牌和卡组合集的版本号，数据刷新后旧的缓存自然失效
+* 搜索和统计在线程池中运行，不会阻塞其他请求
+* 较大的结果使用分块传输 (chunked)，边编码边发送
+* /health 返回服务状态，/metrics 返回 Prometheus 格式的耗时统计
+
+    $ hsdata serve --port 8000
+    $ curl 'http://127.0.0.1:8000/decks/search?career=MAGE&top=5'
+
+接口:
+
+* GET /health
+* GET /metrics
+* GET /cards/search?in_name=&in_text=&career=&cost=&collectible=
+* GET /cards/<card_id>
+* GET /decks/search?career=&mode=&min_win_rate=&min_games=&top=&include=&exclude=
+* GET /decks/<deck_id>
+* GET /stats/career_cards?career=&mode=&min_games=&top_percentage=
+* GET /stats/cards_value?mode=
+* GET /generate?career=&mode=&include=&exclude=
+
+"""
+
+import asyncio
+import contextvars
+import itertools
+import json
+import logging
+import time
+from collections import Counter, OrderedDict
+from http import HTTPStatus
+from urllib.parse import urlsplit, parse_qsl, unquote
+
+from . import core, metrics
+from .core import MODE_STANDARD
+from .metrics import span
+from .utils import DeckGenerator, cards_value
+
+# 单个分块的大小，超过该大小的响应将使用分块传输
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+# 默认缓存的响应数量
+DEFAULT_CACHE_SIZE = 256
+
+JSON_CONTENT_TYPE = 'application/json; charset=utf-8'
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super(HTTPError, self).__init__(message)
+        self.status = status
+        self.message = message
+
+
+def _get_int(query, name, default=None):
+    value = query.get(name)
+    if value in (None, ''):
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise HTTPError(400, '{} 应为整数'.format(name))
+
+
+def _get_float(query, name, default=None):
+    value = query.get(name)
+    if value in (None, ''):
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        raise HTTPError(400, '{} 应为数字'.format(name))
+
+
+def _get_bool(query, name, default=None):
+    value = query.get(name)
+    if value in (None, ''):
+        return default
+    if value.lower() in ('1', 'true', 'yes'):
+        return True
+    if value.lower() in ('0', 'false', 'no'):
+        return False
+    raise HTTPError(400, '{} 应为 true 或 false'.format(name))
+
+
+def _get_career(query, name='career', required=False):
+    value = query.get(name)
+    if not value:
+        if required:
+            raise HTTPError(400, '缺少参数 {}'.format(name))
+        return None
+    career = core.get_career(value)
+    if not career:
+        raise HTTPError(400, '未找到该职业: {}'.format(value))
+    return career
+
+
+def card_to_dict(card):
+    return dict(vars(card))
+
+
+def deck_to_dict(deck):
+    dct = deck.to_dict()
+    dct['win_rate'] = deck.win_rate
+    dct['mode'] = deck.mode
+    dct['url'] = deck.url
+    return dct
+
+
+def _encode_chunks(obj, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    将对象编码为 JSON，边编码边按 chunk_size 切分，逐段生成 (至少生成一段)
+    """
+
+    buffer = list()
+    size = 0
+    empty = True
+
+    for part in json.JSONEncoder(ensure_ascii=False).iterencode(obj):
+        part = part.encode('utf-8')
+        buffer.append(part)
+        size += len(part)
+        if size >= chunk_size:
+            yield b''.join(buffer)
+            buffer = list()
+            size = 0
+            empty = False
+
+    if buffer or empty:
+        yield b''.join(buffer)
+
+
+class HSDataServer:
+    """
+    基于 asyncio 的 HTTP 查询服务
+    """
+
+    def __init__(
+            self, decks, cards=None, host='127.0.0.1', port=8000,
+            cache_size=DEFAULT_CACHE_SIZE, chunk_size=DEFAULT_CHUNK_SIZE, executor=None):
+        """
+        :param decks: Decks 对象
+        :param cards: Cards 对象，默认为卡组合集所用的卡牌
+        :param host: 地址
+        :param port: 端口，为 0 时自动选择
+        :param cache_size: 缓存的响应数量，为 0 时不缓存
+        :param chunk_size: 分块传输时单个分块的大小
+        :param executor: 运行搜索和统计的线程池，默认为 asyncio 的默认线程池
+        """
+
+        self.decks = decks
+        self.cards = cards or decks.cards
+        self.host = host
+        self.port = port
+        self.cache_size = cache_size
+        self.chunk_size = chunk_size
+        self.executor = executor
+
+        # 统计数据
+        self.requests = 0
+        self.errors = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.started_at = None
+
+        self._cache = OrderedDict()
+        # 正在计算中的响应，相同的请求将等待同一个结果
+        self._pending = dict()
+        self._server = None
+        # 当前打开的连接，关闭服务时一并关闭
+        self._connections = dict()
+
+        self._routes = OrderedDict([
+            ('/cards/search', self.search_cards),
+            ('/decks/search', self.search_decks),
+            ('/stats/career_cards', self.stats_career_cards),
+            ('/stats/cards_value', self.stats_cards_value),
+            ('/generate', self.generate),
+        ])
+        self._item_routes = OrderedDict([
+            ('/cards/', self.get_card),
+            ('/decks/', self.get_deck),
+        ])
+
+        # 若未设置耗时统计的接收器，则使用直方图，供 /metrics 接口使用
+        if metrics.get_sink() is None:
+            metrics.set_sink(metrics.HistogramSink())
+
+    @property
+    def data_version(self):
+        """
+        卡牌和卡组合集的版本号，每次刷新或修改后都会改变
+        """
+        return self.cards.snapshot.version, self.decks.snapshot.version
+
+    def warm_up(self):
+        """
+        载入卡牌，并预先生成卡牌和卡组合集的快照
+        """
+        self.cards.load_if_empty()
+        return self.data_version
+
+    async def start(self):
+        """
+        开始监听，实际使用的端口将更新到 port 属性中
+        """
+        self.warm_up()
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self.started_at = time.time()
+        logging.info('查询服务已启动: http://{}:{}/'.format(self.host, self.port))
+        return self._server
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def stop(self):
+        """
+        停止监听，关闭所有连接，并等待正在处理的请求完成
+        """
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for writer in list(self._connections.values()):
+            writer.close()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+
+    def run(self):
+        """
+        在当前线程中运行服务，直到被中断
+        """
+        try:
+            asyncio.run(self.serve_forever())
+        except KeyboardInterrupt:
+            logging.info('查询服务已停止')
+
+    async def _handle_connection(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections[task] = writer
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    await self._write_response(writer, *self._error_response(400, '无效的请求'))
+                    break
+
+                headers = dict()
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                connection = headers.get('connection', '').lower()
+                if version == 'HTTP/1.0':
+                    keep_alive = connection == 'keep-alive'
+                else:
+                    keep_alive = connection != 'close'
+
+                if method != 'GET':
+                    response = self._error_response(405, '只支持 GET 请求')
+                else:
+                    response = await self.handle(target)
+
+                await self._write_response(writer, *response, keep_alive=keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass
+        finally:
+            del self._connections[task]
+            writer.close()
+
+    async def handle(self, target):
+        """
+        处理单个请求
+        :param target: 请求路径，包括查询参数
+        :return: (状态码, Content-Type, 分块的列表或生成器)
+        """
+
+        self.requests += 1
+        parts = urlsplit(target)
+        path = parts.path.rstrip('/') or '/'
+        query = dict(parse_qsl(parts.query))
+
+        try:
+            if path == '/health':
+                return 200, JSON_CONTENT_TYPE, _encode_chunks(self.health())
+            if path == '/metrics':
+                return 200, METRICS_CONTENT_TYPE, [self.metrics_text().encode('utf-8')]
+
+            handler = self._routes.get(path)
+            args = (query,)
+            if handler is None:
+                for prefix, item_handler in self._item_routes.items():
+                    if path.startswith(prefix):
+                        handler = item_handler
+                        args = (unquote(path[len(prefix):]),)
+                        break
+                else:
+                    raise HTTPError(404, '未找到该接口: {}'.format(path))
+
+            return 200, JSON_CONTENT_TYPE, await self._cached(path, query, handler, args)
+
+        except HTTPError as e:
+            self.errors += 1
+            return self._error_response(e.status, e.message)
+        except Exception:
+            self.errors += 1
+            logging.exception('处理请求失败: {}'.format(target))
+            return self._error_response(500, '服务器内部错误')
+
+    async def _cached(self, path, query, handler, args):
+        """
+        从缓存中获取响应，若未命中则在线程池中计算，再在发送时逐段编码
+        """
+
+        key = (path, tuple(sorted(query.items())), self.data_version)
+
+        chunks = self._cache.get(key)
+        if chunks is not None:
+            self.cache_hits += 1
+            self._cache.move_to_end(key)
+            return chunks
+
+        future = self._pending.get(key)
+        if future is not None:
+            self.cache_hits += 1
+            return _encode_chunks(await future, self.chunk_size)
+
+        self.cache_misses += 1
+        loop = asyncio.get_running_loop()
+
+        def compute():
+            with span('server.{}'.format(handler.__name__)):
+                return handler(*args)
+
+        # 在线程池中沿用当前的上下文 (HSData)
+        future = loop.run_in_executor(self.executor, contextvars.copy_context().run, compute)
+        self._pending[key] = future
+        try:
+            result = await future
+        finally:
+            del self._pending[key]
+
+        chunks = _encode_chunks(result, self.chunk_size)
+        if self.cache_size:
+            chunks = self._cache_chunks(key, chunks)
+        return chunks
+
+    def _cache_chunks(self, key, chunks):
+        """
+        逐段生成响应，全部发送后再将各段存入缓存
+        """
+
+        saved = list()
+        for chunk in chunks:
+            saved.append(chunk)
+            yield chunk
+
+        self._cache[key] = saved
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    @staticmethod
+    def _error_response(status, message):
+        return status, JSON_CONTENT_TYPE, _encode_chunks(dict(error=message, status=status))
+
+    async def _write_response(self, writer, status, content_type, chunks, keep_alive=False):
+        head = [
+            'HTTP/1.1 {} {}'.format(status, HTTPStatus(status).phrase),
+            'Content-Type: {}'.format(content_type),
+            'Connection: {}'.format('keep-alive' if keep_alive else 'close'),
+        ]
+
+        # 预先取出前两段，只有一段时直接使用 Content-Length
+        chunks = iter(chunks)
+        try:
+            first = next(chunks, b'')
+            second = next(chunks, None)
+        except Exception:
+            self.errors += 1
+            logging.exception('编码响应失败')
+            return await self._write_response(
+                writer, *self._error_response(500, '服务器内部错误'), keep_alive=keep_alive)
+
+        if second is not None:
+            head.append('Transfer-Encoding: chunked')
+            writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1'))
+            # 边编码边发送，大结果不会一次性堆积在内存中
+            for chunk in itertools.chain((first, second), chunks):
+                if chunk:
+                    writer.write('{:x}\r\n'.format(len(chunk)).encode('latin-1') + chunk + b'\r\n')
+                    # 等待发送缓冲区排空后再编码下一段
+                    await writer.drain()
+            writer.write(b'0\r\n\r\n')
+        else:
+            head.append('Content-Length: {}'.format(len(first)))
+            writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + first)
+
+        await writer.drain()
+
+    def health(self):
+        return dict(
+            status='ok',
+            cards=len(self.cards.snapshot),
+            decks=len(self.decks.snapshot),
+            data_version=list(self.data_version),
+            uptime=time.time() - self.started_at if self.started_at else None,
+            requests=self.requests,
+            errors=self.errors,
+            cache_hits=self.cache_hits,
+            cache_misses=self.cache_misses,
+            cache_size=len(self._cache),
+        )
+
+    def metrics_text(self):
+        lines = list()
+        for name in ('requests', 'errors', 'cache_hits', 'cache_misses'):
+            metric_name = 'hsdata_server_{}_total'.format(name)
+            lines.append('# TYPE {} counter'.format(metric_name))
+            lines.append('{} {}'.format(metric_name, getattr(self, name)))
+        text = '\n'.join(lines) + '\n'
+
+        sink = metrics.get_sink()
+        if hasattr(sink, 'to_prometheus'):
+            text += sink.to_prometheus()
+        return text
+
+    def search_cards(self, query):
+        cards = self.cards.search(
+            in_name=query.get('in_name'),
+            in_text=query.get('in_text'),
+            career=_get_career(query),
+            cost=_get_int(query, 'cost'),
+            collectible=_get_bool(query, 'collectible'),
+            return_first=False,
+        )
+        return [card_to_dict(card) for card in cards]
+
+    def get_card(self, card_id):
+        card = self.cards.snapshot.get(card_id)
+        if card is None:
+            raise HTTPError(404, '未找到该卡牌: {}'.format(card_id))
+        return card_to_dict(card)
+
+    def search_decks(self, query):
+        decks = self.decks.search(
+            career=_get_career(query),
+            mode=query.get('mode', MODE_STANDARD) or None,
+            min_win_rate=_get_float(query, 'min_win_rate', 0.0),
+            min_games=_get_int(query, 'min_games', 0),
+            win_rate_top_n=_get_int(query, 'top'),
+            include=self._parse_card_counts(query.get('include')),
+            exclude=self._parse_card_counts(query.get('exclude')),
+        )
+        return [deck_to_dict(deck) for deck in decks]
+
+    def get_deck(self, deck_id):
+        deck = self.decks.snapshot.get(deck_id)
+        if deck is None:
+            raise HTTPError(404, '未找到该卡组: {}'.format(deck_id))
+        return deck_to_dict(deck)
+
+    def stats_career_cards(self, query):
+        cards_stats, top_decks = self.decks.career_cards_stats(
+            career=_get_career(query, required=True),
+            mode=query.get('mode', MODE_STANDARD),
+            min_games=_get_int(query, 'min_games', 1000),
+            top_win_rate_percentage=_get_float(query, 'top_percentage', 0.1),
+        )
+
+        cards = list()
+        for card, stats in cards_stats.items():
+            stats = dict(stats)
+            stats['id'] = card.id
+            stats['name'] = card.name
+            cards.append(stats)
+        cards.sort(key=lambda x: x['avg_win_rate'] or 0, reverse=True)
+
+        return dict(top_decks=len(top_decks), cards=cards)
+
+    def stats_cards_value(self, query):
+        stats = cards_value(self.decks, mode=query.get('mode', MODE_STANDARD))
+
+        result = OrderedDict()
+        for key, cards_stats in stats.items():
+            name = key.class_name if isinstance(key, core.Career) else key
+            result[name] = dict((card.id, card_stats) for card, card_stats in cards_stats.items())
+        return result
+
+    def _parse_card_counts(self, text):
+        card_counts = Counter()
+        if not text:
+            return card_counts
+        for card_count in text.split(','):
+            card_id, _, count = card_count.partition(':')
+            card = self.cards.snapshot.get(card_id)
+            if card is None:
+                raise HTTPError(400, '未找到该卡牌: {}'.format(card_id))
+            try:
+                card_counts[card] += int(count or 1)
+            except ValueError:
+                raise HTTPError(400, '无效的卡牌数量: {}'.format(card_count))
+        return card_counts
+
+    def generate(self, query):
+        career = _get_career(query, required=True)
+        try:
+            generator = DeckGenerator(
+                career, self.decks,
+                include=self._parse_card_counts(query.get('include')),
+                exclude=self._parse_card_counts(query.get('exclude')),
+                mode=query.get('mode', MODE_STANDARD))
+        except ValueError as e:
+            raise HTTPError(400, str(e))
+
+        if not generator.top_decks_total_games:
+            raise HTTPError(404, '没有足够的卡组数据用于生成卡组')
+
+        cards = generator.cards
+        return dict(
+            career=career.class_name,
+            total_count=sum(cards.values()),
+            cards=[dict(id=card.id, name=card.name, cost=card.cost, count=count)
+                   for card, count in sorted(cards.items(), key=lambda x: (x[0].cost or 0, x[0].name))],
+        )
+
+
+def serve(decks, host='127.0.0.1', port=8000, **kwargs):
+    """
+    启动查询服务，直到被中断
+    :param decks: Decks 对象
+    :param host: 地址
+    :param port: 端口
+    :param kwargs: 传递给 HSDataServer 的其他参数
+    """
+    HSDataServer(decks, host=host, port=port, **kwargs).run()
@@ -0,0 +1,527 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+
+"""
+共享的只读数据集
+~~~~~~~~~~~~~~
+
+将卡牌表和卡组/卡牌矩阵导出为可内存映射 (mmap) 的只读二进制文件，
+多个工作进程映射同一个文件时，操作系统的页缓存中只有一份数据，新进程无需解析 JSON 即可在数毫秒内开始使用
+
+卡组的游戏数据、职业、模式和卡牌均按列保存，搜索和 career_cards_stats 直接在列上完成，
+只有被返回的卡组才会被还原为 Deck 对象
+
+    >>> import hsdata
+    >>> from hsdata import shared
+    >>>
+    >>> # 在主进程中导出
+    >>> shared.export_shared('data/HSBOX.hsd', hsdata.HSBoxDecks())
+    >>>
+    >>> # 在各工作进程中映射
+    >>> dataset = shared.SharedDataset('data/HSBOX.hsd')
+    >>> found = dataset.decks.search(career='法师', win_rate_top_n=10)
+
+"""
+
+import json
+import mmap
+import os
+import struct
+from array import array
+
+from . import core
+from .core import (
+    MODE_STANDARD, MODE_WILD,
+    Card, Cards, Deck, Decks, DecksView, get_career, _prepare_dir
+)
+from .metrics import timed
+from .storage import DECK_CLASSES
+
+MAGIC = b'HSDSHM01'
+FORMAT_VERSION = 1
+
+# 文件头: 魔数, 格式版本, 卡牌数量, 卡组数量, 卡组中的卡牌条目数量
+_HEADER = struct.Struct('<8sIIII')
+
+# 各数据段的名称和数组类型，文件头之后依次为各数据段的 (偏移, 长度)
+_SECTIONS = (
+    ('meta', 'B'),
+    ('card_id_offsets', 'Q'),
+    ('card_id_blob', 'B'),
+    ('card_json_offsets', 'Q'),
+    ('card_json_blob', 'B'),
+    ('deck_games', 'q'),
+    ('deck_wins', 'q'),
+    ('deck_draws', 'q'),
+    ('deck_career', 'B'),
+    ('deck_mode', 'B'),
+    ('deck_card_offsets', 'Q'),
+    ('deck_card_index', 'I'),
+    ('deck_card_count', 'B'),
+    ('deck_id_offsets', 'Q'),
+    ('deck_id_blob', 'B'),
+    ('deck_id_order', 'I'),
+    ('deck_extra_offsets', 'Q'),
+    ('deck_extra_blob', 'B'),
+)
+_SECTION_TABLE = struct.Struct('<' + 'QQ' * len(_SECTIONS))
+
+# 职业为空时使用的编号
+_NO_CAREER = 255
+
+# 单独保存为数据列的卡组属性，其余属性保存为 JSON
+_DECK_COLUMNS = ('id', 'career', 'cards', 'games', 'wins', 'draws')
+
+_MODES = (MODE_STANDARD, MODE_WILD)
+
+
+def _pack_strings(strings):
+    offsets = array('Q', [0])
+    blob = bytearray()
+    for s in strings:
+        blob += s.encode('utf-8')
+        offsets.append(len(blob))
+    return offsets, blob
+
+
+@timed('shared.export')
+def export_shared(path, decks, cards=None):
+    """
+    将卡牌和卡组导出为共享数据文件，先写入临时文件再替换，正在使用旧文件的进程不受影响
+    :param path: 文件路径
+    :param decks: Decks 对象
+    :param cards: Cards 对象，默认为卡组合集所用的卡牌
+    """
+
+    if cards is None:
+        cards = getattr(decks, 'cards', None) or core.current_context().cards
+    cards.load_if_empty()
+
+    card_list = list(cards)
+    card_numbers = dict((card.id, i) for i, card in enumerate(card_list))
+    careers = [career.class_name for career in core.current_context().careers]
+    career_numbers = dict((class_name, i) for i, class_name in enumerate(careers))
+
+    sections = dict()
+    sections['card_id_offsets'], sections['card_id_blob'] = _pack_strings(card.id for card in card_list)
+    sections['card_json_offsets'], sections['card_json_blob'] = _pack_strings(
+        json.dumps(vars(card), ensure_ascii=False) for card in card_list)
+
+    games = array('q')
+    wins = array('q')
+    draws = array('q')
+    deck_career = array('B')
+    deck_mode = array('B')
+    deck_card_offsets = array('Q', [0])
+    deck_card_index = array('I')
+    deck_card_count = array('B')
+    deck_ids = list()
+    extras = list()
+
+    for deck in decks:
+        games.append(deck.games or 0)
+        wins.append(deck.wins or 0)
+        draws.append(deck.draws or 0)
+        deck_career.append(career_numbers[deck.career.class_name] if deck.career else _NO_CAREER)
+        deck_mode.append(_MODES.index(deck.mode))
+        for card, count in deck.cards.items():
+            deck_card_index.append(card_numbers[card.id])
+            deck_card_count.append(count)
+        deck_card_offsets.append(len(deck_card_index))
+        deck_ids.append(deck.id)
+
+        extra = deck.to_dict()
+        for key in _DECK_COLUMNS:
+            extra.pop(key, None)
+        extras.append(json.dumps(extra, ensure_ascii=False))
+
+    sections.update(
+        deck_games=games, deck_wins=wins, deck_draws=draws,
+        deck_career=deck_career, deck_mode=deck_mode,
+        deck_card_offsets=deck_card_offsets, deck_card_index=deck_card_index,
+        deck_card_count=deck_card_count,
+        deck_id_order=array('I', sorted(range(len(deck_ids)), key=deck_ids.__getitem__)),
+    )
+    sections['deck_id_offsets'], sections['deck_id_blob'] = _pack_strings(deck_ids)
+    sections['deck_extra_offsets'], sections['deck_extra_blob'] = _pack_strings(extras)
+    sections['meta'] = json.dumps(dict(
+        source=decks.source if isinstance(decks, (Decks, DecksView)) else None,
+        language=getattr(cards, 'language', None),
+        careers=careers, modes=_MODES,
+    )).encode('utf-8')
+
+    # 计算各数据段的位置，每段按 8 字节对齐
+    position = _HEADER.size + _SECTION_TABLE.size
+    table = list()
+    data = list()
+    for name, typecode in _SECTIONS:
+        section = sections[name]
+        raw = section.tobytes() if isinstance(section, array) else bytes(section)
+        padding = -position % 8
+        position += padding
+        table.extend((position, len(raw)))
+        data.append(b'\0' * padding + raw)
+        position += len(raw)
+
+    _prepare_dir(path)
+    tmp_path = '{}.tmp'.format(path)
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(card_list), len(deck_ids), len(deck_card_index)))
+        f.write(_SECTION_TABLE.pack(*table))
+        for raw in data:
+            f.write(raw)
+    os.replace(tmp_path, path)
+
+
+class SharedDataset:
+    """
+    映射共享数据文件，提供只读的卡牌和卡组视图
+    """
+
+    def __init__(self, path):
+        """
+        :param path: export_shared 导出的文件路径
+        """
+
+        self.path = path
+
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.num_of_cards, self.num_of_decks, _ = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self._mmap.close()
+            raise ValueError('不是有效的共享数据文件: {}'.format(path))
+
+        table = _SECTION_TABLE.unpack_from(self._mmap, _HEADER.size)
+        buffer = memoryview(self._mmap)
+        self._views = [buffer]
+        self._sections = dict()
+        for i, (name, typecode) in enumerate(_SECTIONS):
+            offset, length = table[i * 2], table[i * 2 + 1]
+            view = buffer[offset:offset + length].cast(typecode)
+            self._views.append(view)
+            self._sections[name] = view
+
+        self.meta = json.loads(bytes(self._sections['meta']).decode('utf-8'))
+        self.source = self.meta['source']
+
+        self.cards = SharedCards(self)
+        self.decks = SharedDecks(self)
+
+    def close(self):
+        """
+        释放映射，之后不可再使用该数据集及其视图
+        """
+        for view in reversed(self._views):
+            view.release()
+        self._views = list()
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    def __reduce__(self):
+        # 传递给其他进程时只传递路径，由对方重新映射
+        return self.__class__, (self.path,)
+
+    def __repr__(self):
+        return '<{}: {} ({} cards, {} decks)>'.format(
+            self.__class__.__name__, self.path, self.num_of_cards, self.num_of_decks)
+
+    def _string(self, name, i):
+        offsets = self._sections[name + '_offsets']
+        return bytes(self._sections[name + '_blob'][offsets[i]:offsets[i + 1]]).decode('utf-8')
+
+
+class SharedCards:
+    """
+    共享数据文件中的卡牌视图，卡牌在首次访问时才会被还原为 Card 对象
+    """
+
+    def __init__(self, dataset):
+        self._dataset = dataset
+        self.language = dataset.meta.get('language')
+        self._cards = [None] * dataset.num_of_cards
+        self._numbers = None
+
+    def _card(self, i):
+        card = self._cards[i]
+        if card is None:
+            card = Card()
+            for k, v in json.loads(self._dataset._string('card_json', i)).items():
+                setattr(card, k, v)
+            self._cards[i] = card
+        return card
+
+    def number_of(self, card_id):
+        """
+        :return: 卡牌在数据文件中的编号
+        """
+        if self._numbers is None:
+            self._numbers = dict(
+                (self._dataset._string('card_id', i), i) for i in range(self._dataset.num_of_cards))
+        return self._numbers.get(card_id)
+
+    def get(self, card_id):
+        i = self.number_of(card_id)
+        if i is not None:
+            return self._card(i)
+
+    def load_if_empty(self, json_path=None):
+        pass
+
+    # 与 Cards 使用相同的搜索逻辑
+    search = Cards.search
+
+    def __len__(self):
+        return self._dataset.num_of_cards
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._card(i)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self._card(i) for i in range(*item.indices(len(self)))]
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError('card index out of range')
+        return self._card(item)
+
+    def __repr__(self):
+        return '<{}: {} cards>'.format(self.__class__.__name__, len(self))
+
+
+class SharedDecks:
+    """
+    共享数据文件中的卡组视图
+
+    搜索和统计直接读取映射的数据列，只有返回的卡组才会被还原为 Deck 对象 (结果为普通的 Decks 对象)
+    """
+
+    def __init__(self, dataset):
+        self._dataset = dataset
+        self.source = dataset.source
+        self.cards = dataset.cards
+        self.deck_class = DECK_CLASSES.get(self.source, Deck)
+
+        sections = dataset._sections
+        self._games = sections['deck_games']
+        self._wins = sections['deck_wins']
+        self._draws = sections['deck_draws']
+        self._career = sections['deck_career']
+        self._mode = sections['deck_mode']
+        self._card_offsets = sections['deck_card_offsets']
+        self._card_index = sections['deck_card_index']
+        self._card_count = sections['deck_card_count']
+        self._id_order = sections['deck_id_order']
+
+        self._career_numbers = dict((class_name, i) for i, class_name in enumerate(dataset.meta['careers']))
+        self._mode_numbers = dict((mode, i) for i, mode in enumerate(dataset.meta['modes']))
+
+    def deck_id(self, i):
+        return self._dataset._string('deck_id', i)
+
+    def _deck(self, i):
+        """
+        将第 i 个卡组还原为 Deck 对象
+        """
+
+        dct = json.loads(self._dataset._string('deck_extra', i))
+        career = self._career[i]
+        cards = dict()
+        for j in range(self._card_offsets[i], self._card_offsets[i + 1]):
+            cards[self.cards._card(self._card_index[j]).id] = self._card_count[j]
+        dct.update(
+            id=self.deck_id(i),
+            career=None if career == _NO_CAREER else self._dataset.meta['careers'][career],
+            cards=cards, games=self._games[i], wins=self._wins[i], draws=self._draws[i])
+
+        deck = self.deck_class()
+        deck.from_dict(dct, self.cards)
+        return deck
+
+    def _to_decks(self, rows):
+        return Decks([self._deck(i) for i in rows], cards=self.cards)
+
+    def index_of(self, deck_id):
+        """
+        :return: 卡组在数据文件中的位置，使用按ID排序的索引二分查找
+        """
+        order = self._id_order
+        lo, hi = 0, len(order)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.deck_id(order[mid]) < deck_id:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(order) and self.deck_id(order[lo]) == deck_id:
+            return order[lo]
+
+    def get(self, deck_id):
+        i = self.index_of(deck_id)
+        if i is not None:
+            return self._deck(i)
+
+    def _rows(self, career=None, mode=None, min_win_rate=0.0, min_games=0):
+        """
+        :return: 符合条件的卡组位置列表
+        """
+
+        career_number = None
+        if career:
+            career_number = self._career_numbers.get(get_career(career).class_name)
+        mode_number = None
+        if mode:
+            mode_number = self._mode_numbers.get(mode)
+
+        games, wins = self._games, self._wins
+        rows = list()
+
+        for i in range(len(games)):
+            if career is not None and self._career[i] != career_number:
+                continue
+            if mode and self._mode[i] != mode_number:
+                continue
+            if games[i] < min_games:
+                continue
+            if min_win_rate and (wins[i] / games[i] if games[i] else 0) < min_win_rate:
+                continue
+            rows.append(i)
+
+        return rows
+
+    def _win_rate(self, i):
+        return self._wins[i] / self._games[i] if self._games[i] else 0
+
+    @timed('shared.decks.search')
+    def search(
+            self,
+            career=None,
+            mode=MODE_STANDARD,
+            min_win_rate=0.0,
+            min_games=0,
+            win_rate_top_n=None,
+    ):
+        """
+        搜索符合条件的卡组，参数和结果与 Decks.search 相同
+        """
+
+        if career:
+            career = get_career(career)
+
+        rows = self._rows(career, mode, min_win_rate, min_games)
+
+        if win_rate_top_n:
+            rows.sort(key=self._win_rate, reverse=True)
+            if win_rate_top_n > 0:
+                rows = rows[:win_rate_top_n]
+
+        return self._to_decks(rows)
+
+    @timed('shared.decks.career_cards_stats')
+    def career_cards_stats(
+            self, career, mode=MODE_STANDARD,
+            min_games=1000, top_win_rate_percentage=0.1
+    ):
+        """
+        统计指定职业和模式的卡牌数据，参数和结果与 Decks.career_cards_stats 相同
+        """
+
+        rows = self.top_rows(career, mode, min_games, top_win_rate_percentage)
+
+        cards_stats = dict()
+        for number, (total_count, total_games, total_wins, used_in_decks) in self.card_totals(rows).items():
+            cards_stats[self.cards._card(number)] = dict(
+                total_count=total_count,
+                total_games=total_games,
+                total_wins=total_wins,
+                used_in_decks=used_in_decks,
+                avg_count=total_count / used_in_decks,
+                avg_win_rate=total_wins / total_games if total_games else None,
+            )
+
+        return cards_stats, self._to_decks(rows)
+
+    def top_rows(self, career, mode=MODE_STANDARD, min_games=1000, top_win_rate_percentage=0.1):
+        """
+        选取指定职业和模式中胜率最高的卡组，规则与 career_cards_stats 相同
+        :param top_win_rate_percentage: 选取胜率最高的 n% 卡组，为 None 时选取全部卡组 (不排序)
+        :return: 卡组位置列表
+        """
+
+        rows = self._rows(get_career(career), mode, min_games=min_games)
+        if top_win_rate_percentage is not None:
+            rows.sort(key=self._win_rate, reverse=True)
+            rows = rows[:round(len(rows) * top_win_rate_percentage)]
+        return rows
+
+    def card_totals(self, rows):
+        """
+        累加指定卡组中各卡牌的数据
+        :param rows: 卡组位置列表
+        :return: dict，key 为卡牌编号，value 为 [总数量, 总游戏次数, 总获胜次数, 所在卡组数]
+        """
+
+        totals = dict()
+        for i in rows:
+            games = self._games[i]
+            wins = self._wins[i]
+            for j in range(self._card_offsets[i], self._card_offsets[i + 1]):
+                number = self._card_index[j]
+                total = totals.get(number)
+                if total is None:
+                    total = totals[number] = [0, 0, 0, 0]
+                total[0] += self._card_count[j]
+                total[1] += games
+                total[2] += wins
+                total[3] += 1
+        return totals
+
+    def to_decks(self):
+        """
+        将所有卡组还原为普通的卡组合集
+        """
+        return self._to_decks(range(len(self)))
+
+    @property
+    def total_games(self):
+        return sum(self._games)
+
+    @property
+    def total_wins(self):
+        return sum(self._wins)
+
+    @property
+    def avg_win_rate(self):
+        try:
+            return self.total_wins / self.total_games
+        except ZeroDivisionError:
+            pass
+
+    def __len__(self):
+        return len(self._games)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._deck(i)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return self._to_decks(range(*item.indices(len(self))))
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError('deck index out of range')
+        return self._deck(item)
+
+    def __repr__(self):
+        return '<{}: {} decks ({})>'.format(self.__class__.__name__, len(self), self.source)
@@ -0,0 +1,524 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+
+"""
+SQLite 存储
+~~~~~~~~~~
+
+将卡牌、卡组、卡组中的卡牌以及卡组游戏数据的快照保存在 SQLite 数据库中，
+卡组搜索、卡牌搜索和 career_cards_stats 的统计均在数据库中完成，无需将全部卡组载入内存
+
+每个线程使用各自的数据库连接，多个线程或进程可同时查询同一个数据库
+
+    >>> import hsdata
+    >>> from hsdata.storage import SQLiteStorage
+    >>>
+    >>> storage = SQLiteStorage()
+    >>> storage.import_cards()
+    >>> storage.import_decks(hsdata.HSBoxDecks())
+    >>> found = storage.search_decks(career='法师', min_games=1000, win_rate_top_n=10)
+
+原有的 JSON 文件仍可作为导入和导出的格式:
+
+    >>> storage.import_json('data/DECKS_HSBOX.json', hsdata.HSBoxDeck)
+    >>> storage.export_json('HSBOX', 'backup.json')
+
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+from . import core
+from .core import (
+    DATE_TIME_FORMAT, MODE_STANDARD,
+    Card, Deck, Decks, get_career, _prepare_dir, _split_keywords
+)
+from .hearthstats import HearthStatsDeck
+from .hsbox import HSBoxDeck
+from .metrics import timed
+
+# 默认的数据库文件名，将与 DATA_DIR 拼接
+DB_FILE_NAME = 'hsdata.sqlite3'
+
+# 各来源对应的卡组类，用于从数据库中还原卡组
+DECK_CLASSES = dict((deck_class.source, deck_class) for deck_class in (HSBoxDeck, HearthStatsDeck))
+
+# 单独保存为数据列的卡组属性，其余属性保存在 data 列的 JSON 中
+_DECK_COLUMNS = ('id', 'name', 'career', 'cards', 'games', 'wins', 'draws')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS cards (
+    id TEXT PRIMARY KEY,
+    name TEXT,
+    text TEXT,
+    player_class TEXT,
+    cost INTEGER,
+    rarity TEXT,
+    card_set TEXT,
+    collectible INTEGER NOT NULL DEFAULT 0,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS cards_player_class ON cards (player_class, cost);
+
+CREATE TABLE IF NOT EXISTS decks (
+    source TEXT NOT NULL,
+    id TEXT NOT NULL,
+    name TEXT,
+    career TEXT,
+    mode TEXT,
+    games INTEGER NOT NULL DEFAULT 0,
+    wins INTEGER NOT NULL DEFAULT 0,
+    draws INTEGER NOT NULL DEFAULT 0,
+    win_rate REAL NOT NULL DEFAULT 0,
+    data TEXT NOT NULL,
+    PRIMARY KEY (source, id)
+);
+CREATE INDEX IF NOT EXISTS decks_search ON decks (career, mode, win_rate);
+CREATE INDEX IF NOT EXISTS decks_games ON decks (career, mode, games);
+
+CREATE TABLE IF NOT EXISTS deck_cards (
+    source TEXT NOT NULL,
+    deck_id TEXT NOT NULL,
+    card_id TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (source, deck_id, card_id)
+);
+CREATE INDEX IF NOT EXISTS deck_cards_card ON deck_cards (card_id);
+
+CREATE TABLE IF NOT EXISTS snapshots (
+    source TEXT NOT NULL,
+    deck_id TEXT NOT NULL,
+    time TEXT NOT NULL,
+    games INTEGER NOT NULL DEFAULT 0,
+    wins INTEGER NOT NULL DEFAULT 0,
+    draws INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (source, deck_id, time)
+);
+'''
+
+
+class SQLiteStorage:
+    """
+    卡牌和卡组的 SQLite 存储
+    """
+
+    def __init__(self, db_path=None, cards=None):
+        """
+        :param db_path: 数据库文件路径，默认为数据目录中的 hsdata.sqlite3
+        :param cards: Cards 对象，用于将卡组中的卡牌ID转化为卡牌，默认为当前上下文的卡牌
+        """
+
+        if not db_path:
+            db_path = os.path.join(core.current_context().data_dir, DB_FILE_NAME)
+        self.db_path = db_path
+
+        if not cards:
+            cards = core.current_context().cards
+        self.cards = cards
+
+        self._local = threading.local()
+
+        if db_path != ':memory:':
+            _prepare_dir(db_path)
+        with self.connection as conn:
+            conn.executescript(SCHEMA)
+
+    @property
+    def connection(self):
+        """
+        当前线程的数据库连接
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path)
+            if self.db_path != ':memory:':
+                # WAL 模式下写入时不会阻塞其他连接的读取
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    def __repr__(self):
+        return '<{}: {}>'.format(self.__class__.__name__, self.db_path)
+
+    # 卡牌
+
+    @timed('storage.import_cards')
+    def import_cards(self, cards=None):
+        """
+        导入卡牌，已存在的卡牌将被替换
+        :param cards: Cards 对象，默认为 self.cards
+        """
+
+        if cards is None:
+            cards = self.cards
+        cards.load_if_empty()
+
+        rows = [(
+            card.id, card.name, card.text, card.playerClass, card.cost, card.rarity, card.set,
+            int(bool(card.collectible)), json.dumps(vars(card), ensure_ascii=False),
+        ) for card in cards]
+
+        with self.connection as conn:
+            conn.executemany('INSERT OR REPLACE INTO cards VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+        logging.info('已导入 {} 张卡牌'.format(len(rows)))
+
+    @staticmethod
+    def _card_from_row(row):
+        card = Card()
+        for k, v in json.loads(row[0]).items():
+            setattr(card, k, v)
+        return card
+
+    def get_card(self, card_id):
+        """
+        根据 ID 获取卡牌
+        :param card_id: 卡牌 ID
+        :return: 单张卡牌
+        """
+        row = self.connection.execute('SELECT data FROM cards WHERE id = ?', (card_id,)).fetchone()
+        if row:
+            return self._card_from_row(row)
+
+    @timed('storage.search_cards')
+    def search_cards(
+            self,
+            in_name=None, in_text=None, career=None,
+            cost=None, collectible=None, return_first=True
+    ):
+        """
+        根据指定条件搜索卡牌，参数与 Cards.search 相同
+        :return: 根据 return_first 参数返回 单张卡牌/None 或 列表
+        """
+
+        where = list()
+        params = list()
+
+        for column, keywords in ('name', in_name), ('text', in_text):
+            if keywords:
+                for keyword in _split_keywords(keywords):
+                    where.append("{} LIKE ? ESCAPE '\\'".format(column))
+                    params.append('%{}%'.format(_escape_like(keyword)))
+        if career:
+            where.append('player_class = ?')
+            params.append(get_career(career).class_name)
+        if cost is not None:
+            where.append('cost = ?')
+            params.append(cost)
+        if collectible is not None:
+            where.append('collectible = ?')
+            params.append(int(bool(collectible)))
+
+        sql = 'SELECT data FROM cards'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY rowid'
+        if return_first:
+            sql += ' LIMIT 1'
+
+        found = [self._card_from_row(row) for row in self.connection.execute(sql, params)]
+
+        if return_first:
+            return found[0] if found else None
+        return found
+
+    def export_cards(self, json_path):
+        """
+        将卡牌导出为 HearthstoneJSON 格式的 JSON 文件，可供 Cards.load 载入
+        :param json_path: 文件路径
+        """
+        rows = self.connection.execute('SELECT data FROM cards ORDER BY rowid')
+        _write_json_list(json_path, (json.loads(row[0]) for row in rows))
+
+    # 卡组
+
+    @timed('storage.import_decks')
+    def import_decks(self, decks, record_snapshot=True, time=None):
+        """
+        导入卡组，已存在的卡组 (来源和ID相同) 将被替换
+        :param decks: Decks 对象或卡组列表
+        :param record_snapshot: 选项，同时将各卡组当前的游戏数据保存为快照
+        :param time: 快照时间，默认为当前时间
+        """
+
+        if not time:
+            time = datetime.now()
+        time = time.strftime(DATE_TIME_FORMAT)
+
+        deck_rows = list()
+        card_rows = list()
+        snapshot_rows = list()
+
+        # 同一卡组 (来源和ID相同) 出现多次时只导入最后一个，否则写入 deck_cards 时将违反主键约束
+        latest = dict(((deck.source or '', deck.id), deck) for deck in decks)
+
+        for (source, _), deck in latest.items():
+            dct = deck.to_dict()
+            for key in _DECK_COLUMNS:
+                dct.pop(key, None)
+
+            deck_rows.append((
+                source, deck.id, deck.name, deck.career.class_name if deck.career else None, deck.mode,
+                deck.games or 0, deck.wins or 0, deck.draws or 0, deck.win_rate or 0,
+                json.dumps(dct, ensure_ascii=False),
+            ))
+            card_rows.extend((source, deck.id, card.id, count) for card, count in deck.cards.items())
+            if record_snapshot:
+                snapshot_rows.append((source, deck.id, time, deck.games or 0, deck.wins or 0, deck.draws or 0))
+
+        with self.connection as conn:
+            conn.executemany(
+                'DELETE FROM deck_cards WHERE source = ? AND deck_id = ?', [row[:2] for row in deck_rows])
+            conn.executemany('INSERT OR REPLACE INTO decks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', deck_rows)
+            conn.executemany('INSERT INTO deck_cards VALUES (?, ?, ?, ?)', card_rows)
+            conn.executemany('INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?, ?, ?)', snapshot_rows)
+
+        logging.info('已导入 {} 个卡组'.format(len(deck_rows)))
+
+    def import_json(self, json_path, deck_class=Deck, record_snapshot=False):
+        """
+        从 Decks.save 保存的 JSON 文件导入卡组
+        :param json_path: JSON 文件路径
+        :param deck_class: 对应的卡组类，例如 HSBoxDeck
+        :param record_snapshot: 选项，同时保存游戏数据的快照
+        """
+
+        with open(json_path) as f:
+            data_list = json.load(f)
+
+        decks = deck_class.from_dicts(data_list, self.cards)
+
+        self.import_decks(decks, record_snapshot=record_snapshot)
+
+    def export_json(self, source, json_path):
+        """
+        将指定来源的卡组导出为与 Decks.save 相同格式的 JSON 文件
+        :param source: 卡组来源，例如 'HSBOX'
+        :param json_path: 文件路径
+        """
+        _write_json_list(json_path, (deck.to_dict() for deck in self.iter_decks(source)))
+
+    def _decks_from_rows(self, rows):
+        """
+        将 decks 表中的行还原为卡组，每行为 (source, id, name, career, games, wins, draws, data)
+        """
+
+        rows = list(rows)
+        if not rows:
+            return list()
+
+        # 批量读取这些卡组的卡牌
+        cards_of_decks = dict()
+        keys = [(row[0], row[1]) for row in rows]
+        for i in range(0, len(keys), 400):
+            batch = keys[i:i + 400]
+            sql = 'SELECT source, deck_id, card_id, count FROM deck_cards WHERE {}'.format(
+                ' OR '.join(['(source = ? AND deck_id = ?)'] * len(batch)))
+            params = [value for key in batch for value in key]
+            for source, deck_id, card_id, count in self.connection.execute(sql, params):
+                cards_of_decks.setdefault((source, deck_id), dict())[card_id] = count
+
+        decks = list()
+        for source, deck_id, name, career, games, wins, draws, data in rows:
+            dct = json.loads(data)
+            dct.update(
+                id=deck_id, name=name, career=career, games=games, wins=wins, draws=draws,
+                cards=cards_of_decks.get((source, deck_id), dict()))
+            deck = DECK_CLASSES.get(source, Deck)()
+            deck.from_dict(dct, self.cards)
+            decks.append(deck)
+
+        return decks
+
+    def get_deck(self, deck_id, source=None):
+        """
+        根据 ID 获取卡组
+        :param deck_id: 卡组ID
+        :param source: 卡组来源，不填写则返回任一来源中找到的卡组
+        :return: 单个卡组
+        """
+        sql = 'SELECT source, id, name, career, games, wins, draws, data FROM decks WHERE id = ?'
+        params = [deck_id]
+        if source is not None:
+            sql += ' AND source = ?'
+            params.append(source)
+        decks = self._decks_from_rows(self.connection.execute(sql + ' LIMIT 1', params))
+        if decks:
+            return decks[0]
+
+    def iter_decks(self, source=None, batch_size=1000):
+        """
+        逐批读取卡组，不会将全部卡组载入内存
+        :param source: 卡组来源，不填写则包括所有来源
+        :param batch_size: 每批读取的卡组数量
+        """
+        sql = 'SELECT source, id, name, career, games, wins, draws, data FROM decks'
+        params = list()
+        if source is not None:
+            sql += ' WHERE source = ?'
+            params.append(source)
+        cursor = self.connection.execute(sql + ' ORDER BY rowid', params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from self._decks_from_rows(rows)
+
+    def count_decks(self, source=None):
+        sql = 'SELECT COUNT(*) FROM decks'
+        params = list()
+        if source is not None:
+            sql += ' WHERE source = ?'
+            params.append(source)
+        return self.connection.execute(sql, params).fetchone()[0]
+
+    @staticmethod
+    def _deck_filters(source, career, mode, min_win_rate, min_games):
+        where = list()
+        params = list()
+        if source is not None:
+            where.append('source = ?')
+            params.append(source)
+        if career:
+            where.append('career = ?')
+            params.append(get_career(career).class_name)
+        if mode:
+            where.append('mode = ?')
+            params.append(mode)
+        if min_win_rate:
+            where.append('win_rate >= ?')
+            params.append(min_win_rate)
+        if min_games:
+            where.append('games >= ?')
+            params.append(min_games)
+        return ' AND '.join(where) or '1', params
+
+    @timed('storage.search_decks')
+    def search_decks(
+            self,
+            career=None,
+            mode=MODE_STANDARD,
+            min_win_rate=0.0,
+            min_games=0,
+            win_rate_top_n=None,
+            source=None,
+    ):
+        """
+        搜索符合条件的卡组，参数与 Decks.search 相同
+        :param source: 卡组来源，不填写则包括所有来源
+        :return: 符合条件的卡组合集
+        """
+
+        where, params = self._deck_filters(source, career, mode, min_win_rate, min_games)
+        sql = 'SELECT source, id, name, career, games, wins, draws, data FROM decks WHERE ' + where
+
+        if win_rate_top_n:
+            sql += ' ORDER BY win_rate DESC, rowid'
+            if win_rate_top_n > 0:
+                sql += ' LIMIT ?'
+                params.append(win_rate_top_n)
+        else:
+            sql += ' ORDER BY rowid'
+
+        return Decks(self._decks_from_rows(self.connection.execute(sql, params)), cards=self.cards)
+
+    @timed('storage.career_cards_stats')
+    def career_cards_stats(
+            self, career, mode=MODE_STANDARD,
+            min_games=1000, top_win_rate_percentage=0.1, source=None
+    ):
+        """
+        统计指定职业和模式的卡牌数据，参数和结果与 Decks.career_cards_stats 相同，统计在数据库中完成
+        :param source: 卡组来源，不填写则包括所有来源
+        :return: (cards_stats, top_decks)
+        """
+
+        where, params = self._deck_filters(source, career, mode, None, min_games)
+
+        num_of_decks = self.connection.execute(
+            'SELECT COUNT(*) FROM decks WHERE ' + where, params).fetchone()[0]
+        limit = round(num_of_decks * top_win_rate_percentage)
+
+        top_sql = 'SELECT rowid FROM decks WHERE {} ORDER BY win_rate DESC, rowid LIMIT ?'.format(where)
+        top_params = params + [limit]
+
+        sql = '''
+            SELECT dc.card_id, COUNT(*), SUM(dc.count), SUM(d.games), SUM(d.wins)
+            FROM decks d JOIN deck_cards dc ON dc.source = d.source AND dc.deck_id = d.id
+            WHERE d.rowid IN ({})
+            GROUP BY dc.card_id
+        '''.format(top_sql)
+
+        cards_stats = dict()
+        for card_id, used_in_decks, total_count, total_games, total_wins in \
+                self.connection.execute(sql, top_params):
+            card = self.cards.get(card_id)
+            cards_stats[card] = dict(
+                total_count=total_count,
+                total_games=total_games,
+                total_wins=total_wins,
+                used_in_decks=used_in_decks,
+                avg_count=total_count / used_in_decks,
+                avg_win_rate=total_wins / total_games if total_games else None,
+            )
+
+        rows = self.connection.execute(
+            'SELECT source, id, name, career, games, wins, draws, data FROM decks '
+            'WHERE rowid IN ({}) ORDER BY win_rate DESC, rowid'.format(top_sql), top_params)
+        top_decks = Decks(self._decks_from_rows(rows), cards=self.cards)
+
+        return cards_stats, top_decks
+
+    # 快照
+
+    def deck_history(self, deck_id, source=None):
+        """
+        获取卡组游戏数据的所有快照
+        :param deck_id: 卡组ID
+        :param source: 卡组来源
+        :return: 列表，每项为 dict(time, games, wins, draws)
+        """
+        sql = 'SELECT time, games, wins, draws FROM snapshots WHERE deck_id = ?'
+        params = [deck_id]
+        if source is not None:
+            sql += ' AND source = ?'
+            params.append(source)
+        return [
+            dict(time=datetime.strptime(time, DATE_TIME_FORMAT), games=games, wins=wins, draws=draws)
+            for time, games, wins, draws in self.connection.execute(sql + ' ORDER BY time', params)
+        ]
+
+
+def _escape_like(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _write_json_list(json_path, items):
+    """逐项写入 JSON 列表，避免在内存中生成完整的字串"""
+    _prepare_dir(json_path)
+    with open(json_path, 'w') as f:
+        f.write('[')
+        for i, item in enumerate(items):
+            if i:
+                f.write(',')
+            json.dump(item, f, ensure_ascii=False)
+        f.write(']')
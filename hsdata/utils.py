@@ -5,19 +5,26 @@
 """
 一些实用的小功能
 """
+import contextvars
 import csv
 import logging
 import os
-from collections import Counter
+import threading
+import time
+from collections import Counter, OrderedDict
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
+from . import core
 from .core import (
     MODE_STANDARD,
-    Decks,
+    Decks, DecksView,
     days_ago,
-    Career, CAREERS, Cards)
+    Career, Cards, get_career)
 from .hearthstats import HearthStatsDecks
 from .hsbox import HSBoxDecks
+from .metrics import timed, observe
 
 
 def diff_decks(*decks):
@@ -55,6 +62,11 @@ def decks_expired(decks, expired=timedelta(days=1)):
     return True
 
 
+# cards_value() 结果中所有职业合计的 key
+CARDS_VALUE_TOTAL = 'total'
+
+
+@timed('stats.cards_value')
 def cards_value(decks, mode=MODE_STANDARD):
     """
     区分职业的单卡价值排名，可在纠结是否合成或拆解时作为参考
@@ -71,30 +83,46 @@ def cards_value(decks, mode=MODE_STANDARD):
     :return: 单卡价值排名数据
     """
 
-    if not isinstance(decks, Decks):
-        raise TypeError('from_decks 须为 Decks 对象')
-
-    total = 'total'
-    ranked_keys = 'decks', 'games', 'wins', 'win_rate'
-    rpf = '_rank'
-    ppf = '%'
+    if not isinstance(decks, (Decks, DecksView)):
+        raise TypeError('from_decks 须为 Decks 或 DecksView 对象')
 
     stats = dict()
-    stats[total] = dict()
+    stats[CARDS_VALUE_TOTAL] = dict()
 
     for deck in decks.search(mode=mode):
         career = deck.career
         if career not in stats:
             stats[career] = dict()
         for card, count in deck.cards.items():
-            for k in total, career:
-                if card not in stats[k]:
-                    stats[k][card] = dict(
-                        decks=0, games=0, wins=0, count=0)
-                stats[k][card]['decks'] += 1
-                stats[k][card]['games'] += deck.games or 0
-                stats[k][card]['wins'] += deck.wins or 0
-                stats[k][card]['count'] += count
+            for k in CARDS_VALUE_TOTAL, career:
+                _add_card_value(stats[k], card, 1, deck.games or 0, deck.wins or 0, count)
+
+    _rank_cards_value(stats)
+    return stats
+
+
+def _add_card_value(stats, card, decks, games, wins, count):
+    """
+    累加单卡数据，cards_value 的串行和并行版本共用
+    """
+    card_stats = stats.get(card)
+    if card_stats is None:
+        card_stats = stats[card] = dict(decks=0, games=0, wins=0, count=0)
+    card_stats['decks'] += decks
+    card_stats['games'] += games
+    card_stats['wins'] += wins
+    card_stats['count'] += count
+
+
+def _rank_cards_value(stats):
+    """
+    根据累加好的单卡数据，计算胜率、平均数量及各项排名
+    :param stats: dict，key 为职业或 CARDS_VALUE_TOTAL，value 为 dict(卡牌: 单卡数据)
+    """
+
+    ranked_keys = 'decks', 'games', 'wins', 'win_rate'
+    rpf = '_rank'
+    ppf = '%'
 
     for k in stats:
         for c in stats[k]:
@@ -104,63 +132,223 @@ def cards_value(decks, mode=MODE_STANDARD):
                 stats[k][c]['win_rate'] = None
             stats[k][c]['avg_count'] = stats[k][c]['count'] / stats[k][c]['decks']
 
-    rkvl = dict()
-
     for k in stats:
-        if k not in rkvl:
-            rkvl[k] = dict()
         for rk in ranked_keys:
             vl = [s[rk] for c, s in stats[k].items()]
             vl = list(filter(lambda x: x, vl))
             vl.sort(reverse=True)
-            rkvl[k][rk] = vl
 
-    for k in stats:
-        for c in stats[k]:
-            for rk in ranked_keys:
+            # 相同数值的排名相同，为该数值首次出现的位置
+            ranks = dict()
+            for i, v in enumerate(vl):
+                if v not in ranks:
+                    ranks[v] = i + 1
+
+            for c in stats[k]:
                 if stats[k][c][rk]:
-                    rank = rkvl[k][rk].index(stats[k][c][rk]) + 1
+                    rank = ranks[stats[k][c][rk]]
                     stats[k][c][rk + rpf] = rank
                     stats[k][c][rk + rpf + ppf] = rank / len(stats[k])
                 else:
                     stats[k][c][rk + rpf] = None
                     stats[k][c][rk + ppf] = None
 
-    return stats
+
+# 已注册的卡组数据源，key 为来源标识，value 为刷新该数据源的函数
+DECK_SOURCES = OrderedDict()
+
+
+def register_deck_source(source, refresh_func):
+    """
+    注册卡组数据源，供 refresh_decks 使用
+    :param source: 来源标识
+    :param refresh_func: 刷新函数，参数为 (expired, **options)，返回 Decks 对象，若返回 None 则表示跳过该来源
+    """
+    DECK_SOURCES[source] = refresh_func
+
+
+def _refresh_hsbox(expired, **options):
+    decks = HSBoxDecks()
+    if decks_expired(decks, expired):
+        decks.update()
+    return decks
+
+
+def _refresh_hearthstats(
+        expired, hsn_email=None, hsn_password=None,
+        hsn_min_games=300, hsn_created_after=None, **options):
+    if not hsn_email or not hsn_password:
+        return
+    decks = HearthStatsDecks()
+    if decks_expired(decks, expired):
+        decks.login(hsn_email, hsn_password)
+        decks.search_online(min_games=hsn_min_games, created_after=hsn_created_after)
+    return decks
+
+
+register_deck_source(HSBoxDecks.deck_class.source, _refresh_hsbox)
+register_deck_source(HearthStatsDecks.deck_class.source, _refresh_hearthstats)
+
+
+def merge_decks(*decks_list):
+    """
+    合并多个卡组合集，指纹 (职业和卡牌) 相同的卡组只保留一个 (保留游戏次数较多的)
+    :param decks_list: 若干卡组合集
+    :return: 合并后的 Decks 对象
+    """
+
+    merged = OrderedDict()
+
+    for decks in decks_list:
+        for deck in decks:
+            fingerprint = deck.fingerprint
+            existing = merged.get(fingerprint)
+            if existing is None or (deck.games or 0) > (existing.games or 0):
+                merged[fingerprint] = deck
+
+    return Decks(list(merged.values()))
+
+
+def refresh_decks(sources=None, expired=timedelta(days=1), **options):
+    """
+    并发刷新多个卡组数据源，并合并为一个 Decks 对象 (按卡牌列表去重)
+    :param sources: 数据源标识列表，默认为所有已注册的数据源
+    :param expired: 过期时间，若载入的数据是此时间前获得的，则重新获取新数据
+    :param options: 传递给各数据源刷新函数的其他参数
+    :return: (Decks 对象, 各数据源的耗时秒数)
+    """
+
+    if sources is None:
+        sources = list(DECK_SOURCES.keys())
+
+    # 先在当前线程中载入卡牌数据，避免各线程同时载入
+    core.current_context().cards.load_if_empty()
+
+    def timed_refresh(source):
+        start = time.perf_counter()
+        decks = DECK_SOURCES[source](expired, **options)
+        seconds = time.perf_counter() - start
+        observe('sources.{}'.format(source.lower()), seconds)
+        return decks, seconds
+
+    with ThreadPoolExecutor(max_workers=max(len(sources), 1)) as executor:
+        # 各线程沿用当前的上下文 (HSData)
+        futures = [
+            (source, executor.submit(contextvars.copy_context().run, timed_refresh, source))
+            for source in sources]
+
+    decks_list = list()
+    timings = OrderedDict()
+
+    for source, future in futures:
+        decks, seconds = future.result()
+        timings[source] = seconds
+        if decks is None:
+            logging.info('跳过数据源 {}'.format(source))
+        else:
+            logging.info('数据源 {} 获取到 {} 个卡组，用时 {:.2f} 秒'.format(source, len(decks), seconds))
+            decks_list.append(decks)
+
+    return merge_decks(*decks_list), timings
 
 
 def get_all_decks(
         hsn_email=None, hsn_password=None,
         hsn_min_games=300, hsn_created_after=days_ago(30),
-        expired=timedelta(days=1)
+        expired=timedelta(days=1), return_timings=False
 ):
     """
-    获得获取所有卡组数据
+    获得获取所有卡组数据，各数据源将被并发刷新
     :param hsn_email: Hearthstats 的登陆邮箱
     :param hsn_password: Hearthstats 的登陆密码
     :param hsn_min_games: Hearthstats 的搜索参数 最少游戏次数
     :param hsn_created_after: Hearthstats 最早更新时间
     :param expired: 过期时间，若载入的数据是次时间前获得的，则重新获取新数据
-    :return: 返回 Decks 对象，包含所有数据源的卡组
+    :param return_timings: 选项，同时返回各数据源的耗时秒数
+    :return: 返回 Decks 对象，包含所有数据源的卡组；若 return_timings 为 True，则返回 (Decks 对象, 各数据源的耗时秒数)
     """
 
-    decks = Decks()
-
-    hsb = HSBoxDecks()
-    if decks_expired(hsb, expired):
-        hsb.update()
-    decks.extend(hsb)
+    decks, timings = refresh_decks(
+        expired=expired,
+        hsn_email=hsn_email, hsn_password=hsn_password,
+        hsn_min_games=hsn_min_games, hsn_created_after=hsn_created_after)
 
-    if hsn_email and hsn_password:
-        hsn = HearthStatsDecks()
-        if decks_expired(hsn, expired):
-            hsn.login(hsn_email, hsn_password)
-            hsn.search_online(min_games=hsn_min_games, created_after=hsn_created_after)
-        decks.extend(hsn)
+    logging.info('所有数据源刷新完成，各数据源用时: {}'.format(
+        ', '.join('{} {:.2f} 秒'.format(source, seconds) for source, seconds in timings.items())))
 
+    if return_timings:
+        return decks, timings
     return decks
 
 
+class BackgroundRefresher(threading.Thread):
+    """
+    在后台线程中刷新卡牌或卡组合集，可定期重复
+
+    Cards.load, Decks.load, HSBoxDecks.update 等方法会在旁边构建好新数据后再一次性替换，
+    因此刷新期间其他线程仍可正常读取 (建议通过 snapshot 属性读取)，不会被阻塞，也不会读到不完整的数据
+
+        >>> decks = hsdata.HSBoxDecks()
+        >>> refresher = hsdata.BackgroundRefresher(decks.update, interval=3600)
+        >>> refresher.start()
+        >>> ...
+        >>> refresher.stop()
+
+    """
+
+    def __init__(self, refresh_func, interval=None, *args, delay=None, **kwargs):
+        """
+        :param refresh_func: 刷新函数，例如 decks.update
+        :param interval: 重复刷新的间隔秒数，不填写则只刷新一次
+        :param args: 传递给刷新函数的参数
+        :param delay: 首次刷新前等待的秒数，不填写则立即刷新，只能以关键字参数传入
+        :param kwargs: 传递给刷新函数的参数
+        """
+        super(BackgroundRefresher, self).__init__(daemon=True)
+        self.refresh_func = refresh_func
+        self.interval = interval
+        self.delay = delay
+        self.args = args
+        self.kwargs = kwargs
+
+        # 已完成的刷新次数，以及最近一次刷新的时间和异常
+        self.refreshed = 0
+        self.last_refreshed = None
+        self.last_error = None
+
+        # 后台线程沿用创建时的上下文 (HSData)
+        self._context = contextvars.copy_context()
+        self._stopped = threading.Event()
+
+    def run(self):
+        if self.delay:
+            self._stopped.wait(self.delay)
+
+        while not self._stopped.is_set():
+            try:
+                self._context.run(self.refresh_func, *self.args, **self.kwargs)
+            except Exception as e:
+                logging.exception('后台刷新失败')
+                self.last_error = e
+            else:
+                self.refreshed += 1
+                self.last_refreshed = datetime.now()
+                self.last_error = None
+
+            if not self.interval:
+                break
+            self._stopped.wait(self.interval)
+
+    def stop(self, timeout=None):
+        """
+        停止重复刷新，并等待正在进行的刷新完成
+        :param timeout: 最长等待秒数
+        """
+        self._stopped.set()
+        if self.is_alive():
+            self.join(timeout)
+
+
 class DeckGenerator:
     def __init__(
             self,
@@ -184,15 +372,15 @@ class DeckGenerator:
 
         self.career = career
 
-        if decks and not isinstance(decks, list):
-            raise TypeError('decks 应为 list')
+        if decks and not isinstance(decks, (list, DecksView)):
+            raise TypeError('decks 应为 list 或 DecksView')
         self.decks = decks or list()
 
-        if include and not isinstance(include, dict):
+        if include and not isinstance(include, Mapping):
             raise TypeError('include 应为 dict')
         self.include = include or Counter()
 
-        if exclude and not isinstance(exclude, dict):
+        if exclude and not isinstance(exclude, Mapping):
             raise TypeError('exclude 应为 dict')
         self.exclude = exclude or Counter()
 
@@ -250,14 +438,12 @@ class DeckGenerator:
     def career(self, value):
         if not value:
             raise ValueError('career 不可为空')
-        if isinstance(value, Career):
-            career = value
-        elif isinstance(value, str):
-            career = CAREERS.search(value)
+        if isinstance(value, (Career, str)):
+            career = get_career(value)
         else:
             raise TypeError('career 不支持 {} 类型的数值'.format(type(value).__name__))
 
-        if career in (CAREERS.get('NEUTRAL'), CAREERS.get('DREAM')):
+        if career and career.class_name in ('NEUTRAL', 'DREAM'):
             raise ValueError('不能为该职业: {}'.format(career.name))
 
         if not career:
@@ -271,14 +457,15 @@ class DeckGenerator:
         if key in ('career', 'decks', 'mode') and self.cards_stats:
             self._gen_cards_stats()
 
+    @timed('stats.deck_generator')
     def _gen_cards_stats(self):
-        decks = list(filter(lambda x: x.games, self.decks))
-        self.decks = Decks(decks)
+        # 视图只引用原有的卡组，不会重建索引
+        self.decks = DecksView(tuple(filter(lambda x: x.games, self.decks)))
 
         cards_stats, self.top_decks = self.decks.career_cards_stats(
             career=self.career, mode=self.mode, top_win_rate_percentage=0.1)
 
-        self.top_decks_total_games = sum(map(lambda x: x.games, self.top_decks))
+        self.top_decks_total_games = self.top_decks.total_games
 
         self.cards_stats = list(cards_stats.items())
         self.cards_stats.sort(key=lambda x: x[1]['avg_win_rate'], reverse=True)
@@ -299,14 +486,14 @@ class DeckGenerator:
 def print_cards(cards, return_text_only=False, sep=' ', rarity=True):
     """
     但法力值从小到大打印卡牌列表
-    :param cards: 卡牌 list 或 Counter
+    :param cards: 卡牌 list，或 Counter 等 dict(卡牌: 数量)，例如 deck.cards
     :param return_text_only: 选项，仅返回文本
     :param sep: 卡牌名称和数量之间的分隔符
     """
 
     if isinstance(cards, list):
         cards = Counter(cards)
-    elif not isinstance(cards, Counter):
+    elif not isinstance(cards, Mapping):
         raise TypeError('cards 参数应为 list 或 Counter 类型')
 
     cards = list(cards.items())
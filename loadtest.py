@@ -0,0 +1,204 @@
+"""
+查询服务的压力测试
+~~~~~~~~~~~~~~~
+
+向 hsdata serve 启动的服务并发发送请求，统计吞吐量和延迟
+
+    # 对已启动的服务进行测试
+    hsdata serve --port 8000 &
+    python loadtest.py --url http://127.0.0.1:8000 --requests 5000 --concurrency 50
+
+    # 使用生成的卡组数据在本地启动服务，无需网络
+    python loadtest.py --local 10000 --requests 5000 --concurrency 50
+
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+import hsdata
+from hsdata.server import HSDataServer
+
+from benchmarks import make_cards_data, iter_deck_dicts, write_json_list
+
+# 默认请求的路径，将被轮流使用
+DEFAULT_PATHS = (
+    '/health',
+    '/cards/search?in_name=Dragon&career=MAGE',
+    '/decks/search?career=MAGE&min_games=1000&top=10',
+    '/decks/search?career=HUNTER&mode=&top=50',
+    '/stats/career_cards?career=PRIEST',
+    '/generate?career=WARRIOR',
+)
+
+
+async def _read_response(reader):
+    """
+    读取单个响应
+    :return: (状态码, 响应内容)
+    """
+
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('连接已关闭')
+    status = int(status_line.split()[1])
+
+    headers = dict()
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    if headers.get('transfer-encoding') == 'chunked':
+        body = list()
+        while True:
+            size = int((await reader.readline()).strip(), 16)
+            if not size:
+                await reader.readline()
+                break
+            body.append(await reader.readexactly(size))
+            await reader.readline()
+        body = b''.join(body)
+    else:
+        body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+    return status, body
+
+
+async def _worker(host, port, paths, counter, total, latencies, errors):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while True:
+            i = counter[0]
+            if i >= total:
+                break
+            counter[0] += 1
+
+            path = paths[i % len(paths)]
+            start = time.perf_counter()
+            writer.write('GET {} HTTP/1.1\r\nHost: {}\r\n\r\n'.format(path, host).encode('latin-1'))
+            await writer.drain()
+            status, _ = await _read_response(reader)
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors.append((path, status))
+    finally:
+        writer.close()
+
+
+def _percentile(values, percent):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * percent))]
+
+
+async def run_loadtest(url, paths=DEFAULT_PATHS, num_of_requests=1000, concurrency=10):
+    """
+    运行压力测试，每个并发使用一个长连接
+    :param url: 服务地址，例如 http://127.0.0.1:8000
+    :param paths: 请求的路径列表，将被轮流使用
+    :param num_of_requests: 请求总数
+    :param concurrency: 并发数
+    :return: dict，包括 requests, errors, seconds, throughput 以及 p50, p90, p99, max 延迟 (秒)
+    """
+
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+
+    counter = [0]
+    latencies = list()
+    errors = list()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        _worker(host, port, paths, counter, num_of_requests, latencies, errors)
+        for _ in range(concurrency)])
+    seconds = time.perf_counter() - start
+
+    latencies.sort()
+    return dict(
+        requests=len(latencies),
+        errors=len(errors),
+        seconds=seconds,
+        throughput=len(latencies) / seconds,
+        p50=_percentile(latencies, 0.5),
+        p90=_percentile(latencies, 0.9),
+        p99=_percentile(latencies, 0.99),
+        max=latencies[-1] if latencies else None,
+    )
+
+
+def start_local_server(num_of_decks, num_of_cards=2000, cache_size=256):
+    """
+    使用生成的卡牌和卡组数据，在后台线程中启动查询服务
+    :return: (服务地址, 停止服务的函数)
+    """
+
+    data_dir = tempfile.mkdtemp(prefix='hsdata_loadtest_')
+    hsdata.set_data_dir(data_dir)
+
+    cards_data = make_cards_data(num_of_cards)
+    write_json_list(os.path.join(data_dir, hsdata.core.CARDS_JSON_FILE_NAME), cards_data)
+    json_path = os.path.join(data_dir, 'DECKS_{}.json'.format(hsdata.HSBoxDeck.source))
+    write_json_list(json_path, iter_deck_dicts(cards_data, num_of_decks, hsdata.HSBoxDeck.source))
+
+    server = HSDataServer(hsdata.HSBoxDecks(json_path=json_path), port=0, cache_size=cache_size)
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(server.start())
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    def stop():
+        asyncio.run_coroutine_threadsafe(server.stop(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        hsdata.set_data_dir('data')
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    return 'http://{}:{}'.format(server.host, server.port), stop
+
+
+def main():
+    parser = argparse.ArgumentParser(description='hsdata 查询服务压力测试')
+    parser.add_argument('--url', default='http://127.0.0.1:8000', help='服务地址')
+    parser.add_argument('--local', type=int, metavar='DECKS', help='使用指定数量的生成卡组在本地启动服务')
+    parser.add_argument('--no-cache', action='store_true', help='本地启动的服务不缓存响应')
+    parser.add_argument('--requests', type=int, default=1000, help='请求总数')
+    parser.add_argument('--concurrency', type=int, default=10, help='并发数')
+    parser.add_argument('--paths', nargs='+', default=DEFAULT_PATHS, help='请求的路径，将被轮流使用')
+    parser.add_argument('--output', help='将结果保存为 JSON 文件')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    url, stop = args.url, None
+    if args.local:
+        url, stop = start_local_server(args.local, cache_size=0 if args.no_cache else 256)
+
+    try:
+        result = asyncio.run(run_loadtest(url, args.paths, args.requests, args.concurrency))
+    finally:
+        if stop:
+            stop()
+
+    print('请求: {requests}  错误: {errors}  用时: {seconds:.2f}s  吞吐量: {throughput:.1f} req/s'.format(**result))
+    print('延迟: p50 {:.2f}ms  p90 {:.2f}ms  p99 {:.2f}ms  max {:.2f}ms'.format(
+        *[(result[k] or 0) * 1000 for k in ('p50', 'p90', 'p99', 'max')]))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -21,6 +21,10 @@ setup(
         'hsdata': ['career_names.json']
     },
     include_package_data=True,
+    python_requires='>=3.7',
+    entry_points={
+        'console_scripts': ['hsdata=hsdata.__main__:main']
+    },
     install_requires=[
         'requests>=2.0',
         'scrapy>=1.0'
@@ -1,8 +1,30 @@
+import asyncio
+import json
 import logging
+import math
 import os
+import pickle
+import random
+import shutil
+import tempfile
+import threading
+import time
 import unittest
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.client import HTTPConnection
 
 import hsdata
+from hsdata import deckstrings, lookup, memory, metrics, parallel, shared
+from hsdata.hearthstats import parse_deck_page, _restore_order
+from hsdata.memory import deep_sizeof
+from hsdata.server import _encode_chunks, HSDataServer
+from hsdata.storage import SQLiteStorage
+from hsdata.utils import cards_value, diff_decks
+
+import benchmarks
+from loadtest import run_loadtest
 
 logging.getLogger('scrapy').propagate = True
 logging.getLogger('requests').propagate = True
@@ -127,5 +149,998 @@ class Tests(unittest.TestCase):
         self.assertFalse(hsdata.CAREERS.search('猎人').can_have(cards.search('玉莲帮密探')))
 
 
+def make_cards_data():
+    """
+    生成用于离线测试的少量卡牌数据 (HearthstoneJSON 格式)
+    """
+    cards_data = list()
+    for i in range(20):
+        cards_data.append(dict(
+            id='T_N{:02d}'.format(i), name='中立随从{}'.format(i), type='MINION',
+            set='CORE', playerClass='NEUTRAL', cost=i % 10, rarity='COMMON',
+            collectible=True, dust=[40, 400, 5, 50]))
+    for i in range(10):
+        cards_data.append(dict(
+            id='T_M{:02d}'.format(i), name='法师法术{}'.format(i), type='SPELL',
+            set='CORE', playerClass='MAGE', cost=i % 10, rarity='RARE',
+            collectible=True, dust=[100, 800, 20, 100]))
+    cards_data.append(dict(
+        id='T_L00', name='传说随从', type='MINION', set='CORE', playerClass='NEUTRAL',
+        cost=8, rarity='LEGENDARY', collectible=True, dust=[1600, 3200, 400, 1600]))
+    cards_data.append(dict(
+        id='T_W00', name='过期随从', type='MINION', set='NAXX', playerClass='NEUTRAL',
+        cost=3, rarity='COMMON', collectible=True))
+    cards_data.append(dict(
+        id='T_H00', name='猎人法术', type='SPELL', set='CORE', playerClass='HUNTER',
+        cost=3, rarity='COMMON', collectible=True))
+    cards_data.append(dict(
+        id='T_U00', name='衍生物', type='MINION', set='CORE', playerClass='NEUTRAL', cost=1))
+    cards_data.append(dict(
+        id='T_HERO', name='吉安娜', type='HERO', set='CORE', playerClass='MAGE'))
+    return cards_data
+
+
+class OfflineTests(unittest.TestCase):
+    """无需网络的测试，使用临时目录中生成的卡牌数据"""
+
+    def setUp(self):
+        if hsdata.core.MAIN_LANGUAGE != 'zhCN':
+            hsdata.set_main_language('zhCN')
+        self.data_dir = tempfile.mkdtemp()
+        with open(os.path.join(self.data_dir, hsdata.core.CARDS_JSON_FILE_NAME), 'w') as f:
+            json.dump(make_cards_data(), f)
+        hsdata.set_data_dir(self.data_dir)
+        self.cards = hsdata.core.CARDS
+        self.cards.load()
+
+    def tearDown(self):
+        hsdata.set_data_dir('data')
+        shutil.rmtree(self.data_dir)
+
+    def make_deck(self, deck_id, career='MAGE', card_counts=None, games=100, wins=50, deck_class=hsdata.Deck):
+        deck = deck_class()
+        deck.id = deck_id
+        deck.name = 'deck {}'.format(deck_id)
+        deck.career = hsdata.CAREERS.get(career)
+        if card_counts is None:
+            card_counts = dict(('T_N{:02d}'.format(i), 2) for i in range(15))
+        deck.cards = Counter(dict((self.cards.get(k), v) for k, v in card_counts.items()))
+        deck.games = games
+        deck.wins = wins
+        return deck
+
+    def test_deck_validator(self):
+        validator = hsdata.DeckValidator(self.cards)
+        mage = hsdata.CAREERS.get('MAGE')
+
+        good = [('T_N{:02d}'.format(i), 2) for i in range(14)] + [('T_M00', 1), ('T_L00', 1)]
+        self.assertEqual(validator.validate(mage, good), [])
+
+        reasons = validator.validate(mage, good[:-1] + [('T_L00', 2)])
+        self.assertIn((hsdata.core.REJECT_TOO_MANY_LEGENDARY, 'T_L00'), reasons)
+        self.assertIn((hsdata.core.REJECT_WRONG_DECK_SIZE, 31), reasons)
+
+        reasons = validator.validate(mage, good[:-1] + [('T_H00', 1)])
+        self.assertEqual(reasons, [(hsdata.core.REJECT_WRONG_CAREER, 'T_H00')])
+
+        reasons = validator.validate(mage, good[:-1] + [('T_U00', 1)])
+        self.assertEqual(reasons, [(hsdata.core.REJECT_NOT_COLLECTIBLE, 'T_U00')])
+
+        # 同一卡牌分多项列出时合计数量，数量小于 1 的项不合法
+        reasons = validator.validate(mage, good[:-1] + [('T_L00', 1), ('T_L00', 1)])
+        self.assertIn((hsdata.core.REJECT_TOO_MANY_LEGENDARY, 'T_L00'), reasons)
+        reasons = validator.validate(mage, good + [('T_N00', 1), ('T_N00', -1)])
+        self.assertEqual(reasons, [(hsdata.core.REJECT_BAD_COUNT, 'T_N00')])
+
+        accepted, rejected = validator.validate_many([
+            ('a', mage, good),
+            ('b', None, good),
+            ('c', mage, good[:-1] + [('NOPE', 1)]),
+        ])
+        self.assertEqual(accepted, ['a'])
+        self.assertEqual([r['id'] for r in rejected], ['b', 'c'])
+        self.assertEqual(rejected[1]['reasons'], [(hsdata.core.REJECT_UNKNOWN_CARD, 'NOPE')])
+
+    def test_deck_stats_history(self):
+        history_path = os.path.join(self.data_dir, 'history.jsonl')
+        history = hsdata.DeckStatsHistory('TEST', history_path)
+
+        mage_counts = dict(('T_N{:02d}'.format(i), 2) for i in range(14))
+        mage_counts.update(T_M00=2)
+        decks = hsdata.Decks([
+            self.make_deck('a', card_counts=mage_counts, games=100, wins=50),
+            self.make_deck('b', career='HUNTER', games=200, wins=120),
+        ])
+
+        history.record(decks, datetime(2016, 12, 1, 10, 5))
+        decks[0].games, decks[0].wins = 150, 80
+        history.record(decks, datetime(2016, 12, 1, 10, 40))
+        decks[0].games, decks[0].wins = 300, 160
+        history.record(decks, datetime(2016, 12, 2, 9, 0))
+
+        for h in history, hsdata.DeckStatsHistory('TEST', history_path):
+            trend = h.trend(deck='a')
+            self.assertEqual([p['games'] for p in trend], [100, 150, 300])
+            self.assertEqual([p['games_delta'] for p in trend], [None, 50, 150])
+
+            trend = h.trend(career='MAGE', granularity=hsdata.GRANULARITY_HOUR)
+            self.assertEqual([p['games'] for p in trend], [150, 300])
+            self.assertAlmostEqual(trend[0]['win_rate'], 80 / 150)
+
+            trend = h.trend(card='T_N00', granularity=hsdata.GRANULARITY_DAY)
+            self.assertEqual([p['games'] for p in trend], [350, 500])
+
+            trend = h.trend(card='T_M00', start=datetime(2016, 12, 2))
+            self.assertEqual([p['wins'] for p in trend], [160])
+
+    def test_refresh_decks(self):
+        a = self.make_deck('a', games=100)
+        b = self.make_deck('b', games=300)
+        c = self.make_deck('c', career='HUNTER', card_counts={'T_N00': 2, 'T_H00': 2}, games=50)
+
+        hsdata.register_deck_source('TEST_1', lambda expired, **options: hsdata.Decks([a, c]))
+        hsdata.register_deck_source('TEST_2', lambda expired, **options: hsdata.Decks([b]))
+        hsdata.register_deck_source('TEST_3', lambda expired, **options: None)
+        try:
+            decks, timings = hsdata.refresh_decks(['TEST_1', 'TEST_2', 'TEST_3'])
+        finally:
+            for source in 'TEST_1', 'TEST_2', 'TEST_3':
+                del hsdata.utils.DECK_SOURCES[source]
+
+        self.assertEqual(list(timings), ['TEST_1', 'TEST_2', 'TEST_3'])
+        self.assertEqual([deck.id for deck in decks], ['b', 'c'])
+
+        # get_all_decks 可同时返回各数据源的耗时
+        registered = dict(hsdata.utils.DECK_SOURCES)
+        hsdata.utils.DECK_SOURCES.clear()
+        hsdata.register_deck_source('TEST_1', lambda expired, **options: hsdata.Decks([a]))
+        try:
+            decks, timings = hsdata.get_all_decks(return_timings=True)
+            self.assertEqual(len(hsdata.get_all_decks()), 1)
+        finally:
+            hsdata.utils.DECK_SOURCES.clear()
+            hsdata.utils.DECK_SOURCES.update(registered)
+
+        self.assertEqual(([deck.id for deck in decks], list(timings)), (['a'], ['TEST_1']))
+
+    def test_hearthstats_page_parser(self):
+        path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'fixtures', 'hearthstats_public_show.html')
+        with open(path, encoding='utf-8') as f:
+            data = parse_deck_page(f.read())
+
+        self.assertEqual(data['name'], 'Tempo Mage & Friends')
+        self.assertEqual(data['creator_id'], '27181')
+        self.assertEqual(data['career'], 'MAGE')
+        self.assertEqual((data['wins'], data['draws'], data['games']), (1204, 3, 2193))
+        self.assertEqual(sum(data['cards'].values()), 30)
+        self.assertEqual(data['cards']['EX1_277'], 2)
+        self.assertEqual(data['win_rate_by_rank'][5], 0.61)
+
+        decks = [self.make_deck(deck_id) for deck_id in 'cab']
+        self.assertEqual([d.id for d in _restore_order(decks, ['a', 'b', 'x', 'c'])], ['a', 'b', 'c'])
+
+    def test_hearthstats_session_and_checkpoint(self):
+        session_path = os.path.join(self.data_dir, 'session.json')
+        with open(session_path, 'w') as f:
+            json.dump([dict(name='_session', value='x', domain='hearthstats.net', path='/',
+                            expires=int(time.time()) + 3600)], f)
+
+        decks = hsdata.HearthStatsDecks(
+            json_path=os.path.join(self.data_dir, 'hsn.json'), auto_load=False, session_path=session_path)
+        self.assertTrue(decks.logged_in)
+
+        search_url = 'http://hearthstats.net/decks/search?q=test'
+        deck_dict = dict(
+            id='a', name='deck a', career='MAGE', cards={'T_N00': 2}, games=10, wins=6, draws=0,
+            creator_id='1', win_rate_by_rank={'5': 0.6})
+        with open(decks.checkpoint_path, 'w') as f:
+            f.write(json.dumps(dict(search_url=search_url, deck_ids=['a', 'b'], created_at=time.time())) + '\n')
+            f.write(json.dumps(deck_dict) + '\n')
+            f.write('{"id": "b", "na')
+
+        self.assertEqual(decks._load_checkpoint('http://other'), (None, {}))
+        header, crawled = decks._load_checkpoint(search_url)
+        self.assertEqual(header['deck_ids'], ['a', 'b'])
+        self.assertEqual(header['attempts'], 0)
+        self.assertEqual(list(crawled), ['a'])
+
+        # 重写检查点时保留已完成的卡组，过期的检查点不再使用
+        header['attempts'] += 1
+        header['created_at'] -= hsdata.hearthstats.CHECKPOINT_MAX_AGE + 1
+        decks._write_checkpoint(header, crawled.values())
+        self.assertEqual(decks._load_checkpoint(search_url), (None, {}))
+        header, crawled = decks._load_checkpoint(search_url, max_age=None)
+        self.assertEqual(header['attempts'], 1)
+        self.assertEqual(crawled['a']['name'], 'deck a')
+
+        with open(session_path, 'w') as f:
+            json.dump([dict(name='_session', value='x', domain='hearthstats.net', path='/', expires=1)], f)
+        decks = hsdata.HearthStatsDecks(
+            json_path=os.path.join(self.data_dir, 'hsn.json'), auto_load=False, session_path=session_path)
+        self.assertFalse(decks.logged_in)
+
+    def test_benchmarks(self):
+        results = benchmarks.run_benchmarks(deck_sizes=[50], num_of_cards=500, repeat=1)
+        self.assertIn('cards.load', results)
+        self.assertIn('hsbox.50.career_cards_stats', results)
+        self.assertIn('hearthstats.50.diff_decks', results)
+        self.assertEqual(benchmarks.compare_results(results, results), [])
+
+    def test_metrics(self):
+        self.assertIs(metrics.span('x'), metrics.span('y'))
+
+        sink = metrics.PrometheusSink(os.path.join(self.data_dir, 'metrics.prom'))
+        calls = list()
+        previous = metrics.set_sink(sink)
+        try:
+            decks = hsdata.Decks([self.make_deck('a'), self.make_deck('b')])
+            json_path = os.path.join(self.data_dir, 'decks.json')
+            decks.save(json_path)
+            decks.load(json_path)
+            decks.search(career='MAGE')
+            metrics.set_sink(metrics.CallbackSink(lambda name, seconds: calls.append(name)))
+            decks.search(career='MAGE')
+        finally:
+            metrics.set_sink(previous)
+
+        summary = sink.summary()
+        for name in 'decks.save', 'decks.load', 'decks.load.parse', 'decks.load.build', 'decks.search':
+            self.assertEqual(summary[name]['count'], 1)
+        self.assertEqual(calls, ['decks.search'])
+
+        sink.write()
+        with open(sink.path) as f:
+            text = f.read()
+        self.assertIn('hsdata_span_seconds_count{span="decks.load"} 1', text)
+        self.assertIn('hsdata_span_seconds_bucket{span="decks.load",le="+Inf"} 1', text)
+
+    def test_memory_report(self):
+        decks = hsdata.Decks([self.make_deck('a'), self.make_deck('b')])
+        report = memory.memory_report(self.cards, [decks])
+        self.assertGreater(report['cards'], 0)
+        self.assertGreater(report['cards._index'], 0)
+        self.assertGreater(report['decks[0]._index'], 0)
+
+        # 卡组中引用的卡牌已在 cards 中统计过，不会重复计算
+        seen = set()
+        self.assertLess(
+            memory.memory_report(self.cards, [decks], seen)['decks[0]'],
+            memory.deep_sizeof(decks[0]) * 2)
+
+        common = list(range(1000))
+        seen = set()
+        first = memory.deep_sizeof([common], seen)
+        self.assertLess(memory.deep_sizeof([common], seen), first / 10)
+
+        with memory.trace_memory() as t:
+            data = [list(range(100)) for _ in range(100)]
+        self.assertGreater(t.peak, 0)
+        del data
+
+    def test_hsdata_context(self):
+        with open(os.path.join(self.data_dir, 'CARDS_enUS.json'), 'w') as f:
+            cards_data = make_cards_data()
+            for card in cards_data:
+                card['name'] = card['id'] + ' en'
+            json.dump(cards_data, f)
+
+        en = hsdata.HSData('enUS', self.data_dir)
+        self.assertIs(hsdata.current_context(), hsdata.DEFAULT_CONTEXT)
+
+        def describe(context):
+            with context.use():
+                cards = hsdata.Cards()
+                card = cards.get('T_M00')
+                return cards.language, card.name, card.career.name, hsdata.get_career('mage').name
+
+        with ThreadPoolExecutor(4) as executor:
+            results = list(executor.map(describe, [en, hsdata.DEFAULT_CONTEXT] * 4))
+
+        self.assertEqual(results[0], ('enUS', 'T_M00 en', 'Mage', 'Mage'))
+        self.assertEqual(results[1], ('zhCN', '法师法术0', '法师', '法师'))
+        self.assertEqual(set(results[0::2]), {results[0]})
+        self.assertEqual(set(results[1::2]), {results[1]})
+        self.assertIs(hsdata.current_context(), hsdata.DEFAULT_CONTEXT)
+
+        # 英雄名称属于各自的上下文，不同语言之间不会混在一起
+        with en.use():
+            self.assertEqual(en.careers.search('T_HERO en'), en.careers.get('MAGE'))
+            self.assertIsNone(en.careers.search('吉安娜'))
+            self.assertEqual(en.careers.get('MAGE').heroes, ['T_HERO en'])
+        self.assertIsNone(hsdata.CAREERS.search('T_HERO en'))
+        self.assertEqual(hsdata.CAREERS.search('吉安娜'), hsdata.CAREERS.get('MAGE'))
+        self.assertEqual(hsdata.Career('MAGE').heroes, ['吉安娜'])
+
+    def test_snapshot_swap(self):
+        decks = hsdata.Decks([self.make_deck('a'), self.make_deck('b')])
+        old = decks.snapshot
+        self.assertIs(decks.snapshot, old)
+        self.assertIs(old.get('a'), decks[0])
+
+        # 快照创建后修改合集，快照的内容和索引都不会改变
+        decks.append(self.make_deck('c'))
+        self.assertEqual(len(old), 2)
+        self.assertIsNone(old.get('c'))
+        self.assertIsNotNone(decks.get('c'))
+        self.assertGreater(decks.snapshot.version, old.version)
+
+        decks.save()
+        with open(decks.json_path) as f:
+            self.assertEqual(len(json.load(f)), 3)
+
+        # 载入时在旁边构建，完成后一次性替换，并预先建好新快照
+        decks.clear()
+        empty = decks.snapshot
+        refresher = hsdata.BackgroundRefresher(decks.load)
+        refresher.start()
+        refresher.stop()
+        self.assertEqual(refresher.refreshed, 1)
+        self.assertIsNone(refresher.last_error)
+        # interval 之后的位置参数都传递给刷新函数，delay 只能以关键字参数传入
+        refreshed = list()
+        refresher = hsdata.BackgroundRefresher(refreshed.append, None, 'x', delay=0)
+        refresher.start()
+        refresher.stop()
+        self.assertEqual(refreshed, ['x'])
+        self.assertEqual(len(empty), 0)
+        self.assertEqual([deck.id for deck in decks.snapshot], ['a', 'b', 'c'])
+        self.assertIs(decks.snapshot.get('b'), decks.get('b'))
+
+        # 替换期间 (新快照已发布、其余属性尚未替换) get 也只从新快照中读取
+        published = decks.snapshot
+        decks._index = dict()
+        self.assertIs(decks.get('b'), published.get('b'))
+        decks._index = dict(published.index)
+
+        cards = hsdata.Cards()
+        snapshot = cards.snapshot
+        cards.load()
+        self.assertIsNot(cards.snapshot, snapshot)
+        self.assertEqual(len(cards.snapshot), len(snapshot))
+        self.assertIsNot(cards.get('T_M00'), snapshot.get('T_M00'))
+
+    def test_server(self):
+        # 边编码边切分，空结果也至少生成一段
+        chunks = _encode_chunks(list(range(100)), 64)
+        self.assertEqual(json.loads(next(chunks) + b''.join(chunks)), list(range(100)))
+        self.assertEqual(list(_encode_chunks([])), [b'[]'])
+
+        decks = hsdata.Decks([
+            self.make_deck('d{}'.format(i), games=2000 + i, wins=1000 + i * 10) for i in range(20)])
+        server = HSDataServer(decks, port=0, chunk_size=256)
+        loop = asyncio.new_event_loop()
+        loop.run_until_complete(server.start())
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+
+        def get(path):
+            conn = HTTPConnection(server.host, server.port)
+            conn.request('GET', path)
+            resp = conn.getresponse()
+            body = resp.read()
+            conn.close()
+            return resp.status, resp.getheader('Transfer-Encoding'), body
+
+        try:
+            status, _, body = get('/health')
+            self.assertEqual(status, 200)
+            self.assertEqual(json.loads(body.decode())['decks'], 20)
+
+            # 结果较大时分块传输，且第二次请求命中缓存
+            status, encoding, body = get('/decks/search?career=MAGE&top=3')
+            self.assertEqual(encoding, 'chunked')
+            self.assertEqual([d['id'] for d in json.loads(body.decode())], ['d19', 'd18', 'd17'])
+            hits = server.cache_hits
+            self.assertEqual(get('/decks/search?career=MAGE&top=3')[2], body)
+            self.assertEqual(server.cache_hits, hits + 1)
+
+            # 数据版本改变后，缓存不再使用
+            decks.append(self.make_deck('d99', games=5000, wins=4000))
+            self.assertEqual(json.loads(get('/decks/search?career=MAGE&top=1')[2].decode())[0]['id'], 'd99')
+
+            self.assertEqual(json.loads(get('/cards/T_M00')[2].decode())['name'], '法师法术0')
+            self.assertEqual(get('/decks/nope')[0], 404)
+            self.assertEqual(get('/decks/search?min_games=x')[0], 400)
+            status, _, body = get('/stats/career_cards?career=MAGE&min_games=0&top_percentage=1')
+            self.assertEqual(json.loads(body.decode())['top_decks'], 21)
+            self.assertIn(b'hsdata_server_requests_total', get('/metrics')[2])
+
+            result = asyncio.run(run_loadtest(
+                'http://{}:{}'.format(server.host, server.port), num_of_requests=30, concurrency=3))
+            self.assertEqual(result['requests'], 30)
+        finally:
+            asyncio.run_coroutine_threadsafe(server.stop(), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+            hsdata.metrics.set_sink(None)
+
+    def test_sqlite_storage(self):
+        decks = hsdata.Decks([
+            self.make_deck('m{}'.format(i), games=1000 + i, wins=400 + i * 20) for i in range(10)])
+        decks.append(self.make_deck('w0', card_counts={'T_W00': 2, 'T_N00': 2}, games=5000, wins=4000))
+        decks.append(self.make_deck('h0', career='HUNTER', card_counts={'T_H00': 2}, games=5000, wins=3000))
+
+        storage = SQLiteStorage(os.path.join(self.data_dir, 'test.sqlite3'))
+        storage.import_cards()
+        storage.import_decks(decks)
+        self.assertEqual(storage.count_decks(), 12)
+
+        self.assertEqual(storage.get_card('T_M00').name, '法师法术0')
+        self.assertEqual(
+            [c.id for c in storage.search_cards(career='MAGE', return_first=False)],
+            [c.id for c in self.cards.search(career='MAGE', return_first=False)])
+
+        for kwargs in (dict(career='MAGE', win_rate_top_n=3), dict(min_games=1005), dict(mode=None)):
+            self.assertEqual(
+                [d.id for d in storage.search_decks(**kwargs)],
+                [d.id for d in decks.search(**kwargs)])
+
+        mage = hsdata.CAREERS.get('MAGE')
+        expected, expected_top = decks.career_cards_stats(mage, min_games=0, top_win_rate_percentage=0.5)
+        stats, top = storage.career_cards_stats(mage, min_games=0, top_win_rate_percentage=0.5)
+        self.assertEqual(stats, expected)
+        self.assertEqual([d.id for d in top], [d.id for d in expected_top])
+
+        # 再次导入时替换原有的卡组，并保留历史快照
+        deck = storage.get_deck('m0')
+        self.assertEqual(deck.cards, decks.get('m0').cards)
+        deck.games = 3000
+        storage.import_decks([deck], time=datetime(2030, 1, 1))
+        self.assertEqual(storage.get_deck('m0').games, 3000)
+        self.assertEqual([h['games'] for h in storage.deck_history('m0')], [1000, 3000])
+
+        json_path = os.path.join(self.data_dir, 'export.json')
+        storage.export_json('', json_path)
+        loaded = hsdata.Decks(json_path=json_path, auto_load=True)
+        self.assertEqual(len(loaded), 12)
+        self.assertEqual(loaded.get('w0').cards, decks.get('w0').cards)
+
+        # 同一卡组出现多次时以最后一个为准
+        first = self.make_deck('m0', card_counts={'T_M00': 2}, games=1)
+        last = self.make_deck('m0', card_counts={'T_M01': 2}, games=2)
+        storage.import_decks([first, last], record_snapshot=False)
+        self.assertEqual(storage.count_decks(), 12)
+        m0 = storage.get_deck('m0')
+        self.assertEqual((m0.games, [card.id for card in m0.cards]), (2, ['T_M01']))
+        storage.close()
+
+    def test_shared_dataset(self):
+        decks = hsdata.HSBoxDecks(json_path=os.path.join(self.data_dir, 'hsbox.json'), auto_load=False)
+        for i in range(10):
+            deck = self.make_deck('m{}'.format(i), games=1000 + i, wins=400 + i * 20, deck_class=hsdata.HSBoxDeck)
+            deck.created_at = datetime(2016, 12, 1)
+            decks.append(deck)
+        deck = self.make_deck(
+            'w0', card_counts={'T_W00': 2, 'T_L00': 1}, games=0, wins=0, deck_class=hsdata.HSBoxDeck)
+        deck.created_at = datetime(2016, 12, 2)
+        decks.append(deck)
+        # 没有职业和创建时间的卡组 (例如只读取了部分字段)
+        deck = self.make_deck('n0', games=10, wins=5, deck_class=hsdata.HSBoxDeck)
+        deck.career = None
+        decks.append(deck)
+
+        path = os.path.join(self.data_dir, 'decks.hsd')
+        shared.export_shared(path, decks)
+
+        with shared.SharedDataset(path) as dataset:
+            self.assertEqual(len(dataset.cards), len(self.cards))
+            self.assertEqual(dataset.cards.get('T_M00').name, '法师法术0')
+            self.assertEqual(dataset.cards.search(in_name='法术0').id, 'T_M00')
+
+            shared_decks = dataset.decks
+            self.assertEqual(len(shared_decks), 12)
+            w0 = shared_decks.get('w0')
+            self.assertIsInstance(w0, hsdata.HSBoxDeck)
+            self.assertEqual(w0.mode, hsdata.MODE_WILD)
+            self.assertEqual(w0.created_at, datetime(2016, 12, 2))
+            self.assertEqual(dict((c.id, n) for c, n in w0.cards.items()), {'T_W00': 2, 'T_L00': 1})
+            self.assertIsNone(shared_decks.get('nope'))
+            n0 = shared_decks.get('n0')
+            self.assertEqual((n0.career, n0.created_at, n0.games), (None, None, 10))
+
+            for kwargs in (dict(career='MAGE', win_rate_top_n=3), dict(min_games=1005), dict(mode=None)):
+                self.assertEqual(
+                    [d.id for d in shared_decks.search(**kwargs)],
+                    [d.id for d in decks.search(**kwargs)])
+
+            expected, expected_top = decks.career_cards_stats('MAGE', min_games=0, top_win_rate_percentage=0.5)
+            stats, top = shared_decks.career_cards_stats('MAGE', min_games=0, top_win_rate_percentage=0.5)
+            self.assertEqual(
+                dict((c.id, v) for c, v in stats.items()), dict((c.id, v) for c, v in expected.items()))
+            self.assertEqual([d.id for d in top], [d.id for d in expected_top])
+            self.assertEqual(shared_decks.total_games, decks.total_games)
+
+            # 传递给其他进程时只传递路径
+            copy = pickle.loads(pickle.dumps(dataset))
+            self.assertEqual(copy.decks[3].id, 'm3')
+            copy.close()
+
+    def test_parallel_stats(self):
+        decks = hsdata.Decks()
+        for i in range(12):
+            card_counts = dict(('T_N{:02d}'.format(j), 2) for j in range(i % 5, i % 5 + 12))
+            card_counts['T_M{:02d}'.format(i % 10)] = 2
+            card_counts['T_W00' if i % 4 == 0 else 'T_M09'] = 2
+            decks.append(self.make_deck('m{}'.format(i), card_counts=card_counts, games=2000 + i * 100, wins=900 + i * 90))
+        decks.append(self.make_deck('h0', career='HUNTER', card_counts={'T_H00': 2, 'T_N00': 2}, games=3000, wins=2000))
+
+        def by_id(stats):
+            return dict((getattr(k, 'class_name', k), dict((c.id, v) for c, v in s.items())) for k, s in stats.items())
+
+        for mode in hsdata.MODE_STANDARD, hsdata.MODE_WILD:
+            self.assertEqual(
+                by_id(parallel.parallel_cards_value(decks, mode, processes=2)),
+                by_id(hsdata.cards_value(decks, mode)))
+
+        report = parallel.parallel_career_cards_stats(
+            decks, careers=['MAGE', 'HUNTER'], min_games=0, top_win_rate_percentage=0.5, processes=2)
+        self.assertEqual(len(report), 4)
+        for (class_name, mode), (cards_stats, top_decks) in report.items():
+            expected, expected_top = decks.career_cards_stats(
+                class_name, mode, min_games=0, top_win_rate_percentage=0.5)
+            self.assertEqual(cards_stats, expected)
+            self.assertEqual([d.id for d in top_decks], [d.id for d in expected_top])
+
+        generated = parallel.parallel_generate_decks(decks, careers=['MAGE'], processes=2)
+        self.assertEqual(generated['MAGE'], hsdata.DeckGenerator('MAGE', decks).cards)
+
+    def test_deck_totals(self):
+        mage = self.make_deck('m0', games=100, wins=60)
+        wild = self.make_deck('m1', card_counts={'T_W00': 2, 'T_N00': 2}, games=50, wins=20)
+        hunter = self.make_deck('h0', career='HUNTER', games=200, wins=90)
+        decks = hsdata.Decks([mage, wild])
+
+        self.assertEqual((decks.totals.decks, decks.total_games, decks.total_wins), (2, 150, 80))
+        decks.append(hunter)
+        mage.games, mage.wins, mage.draws = 120, 70, 3
+        self.assertEqual((decks.total_games, decks.total_wins, decks.total_draws), (370, 180, 3))
+        self.assertEqual(decks.avg_win_rate, 180 / 370)
+
+        by_mage = decks.totals_by('MAGE')
+        self.assertEqual((by_mage.decks, by_mage.games), (2, 170))
+        self.assertEqual(decks.totals_by(mode=hsdata.MODE_WILD).games, 50)
+        self.assertEqual(decks.totals_by('MAGE', hsdata.MODE_STANDARD).wins, 70)
+
+        found = decks.search(mode=hsdata.MODE_STANDARD)
+        self.assertEqual(found.total_games, 320)
+        hunter.games = 300
+        self.assertEqual((found.total_games, decks.total_games), (420, 470))
+
+        decks.remove(hunter)
+        self.assertEqual((decks.totals.decks, decks.total_games), (2, 170))
+        self.assertEqual(decks.totals_by('HUNTER').decks, 0)
+        decks.clear()
+        self.assertIsNone(decks.avg_win_rate)
+        self.assertEqual(found.total_games, 420)
+
+        # 没有职业的卡组只计入一次
+        unknown = self.make_deck('u0', games=40, wins=10)
+        unknown.career = None
+        decks.append(unknown)
+        unknown.games = 50
+        self.assertEqual((decks.totals.decks, decks.total_games, decks.totals_by(None).games), (1, 50, 50))
+
+        # 内部属性不应被保存或序列化
+        self.assertNotIn('_watchers', mage.to_dict())
+        self.assertEqual(pickle.loads(pickle.dumps(mage)).games, 120)
+
+    def test_fuzzy_search(self):
+        en_data = make_cards_data()
+        for data in en_data:
+            data['name'] = data['id'].replace('T_M', 'Mage Spell ').replace('T_N', 'Neutral Minion ')
+            if data['type'] == 'HERO':
+                data['name'] = 'Jaina'
+        with open(os.path.join(self.data_dir, 'CARDS_enUS.json'), 'w') as f:
+            json.dump(en_data, f)
+
+        self.assertEqual(self.cards.fuzzy_search('法师法述3', languages=[])[0].id, 'T_M03')
+        self.assertEqual(self.cards.fuzzy_search('法师法术', top_k=3, languages=[])[0].name[:4], '法师法术')
+        self.assertEqual(self.cards.fuzzy_search('mage spel 07')[0].id, 'T_M07')
+        self.assertEqual(self.cards.fuzzy_search('Nuetral Minon 12', top_k=1)[0].id, 'T_N12')
+        self.assertEqual(self.cards.fuzzy_search('衍生物')[0].id, 'T_U00')
+        self.assertNotIn('T_U00', [c.id for c in self.cards.fuzzy_search('衍生物', collectible=True)])
+        self.assertEqual(lookup.normalize_name(' Éclair-Héros! '), 'eclairheros')
+
+        # 载入其他语言的卡牌不影响当前上下文中的英雄名称，但这些英雄名称仍可用于自动补全
+        self.assertEqual(hsdata.Career('MAGE').heroes, ['吉安娜'])
+        self.assertIsNone(hsdata.CAREERS.search('Jaina'))
+        self.assertEqual(self.cards.autocomplete('jain', languages=['enUS']), [hsdata.CAREERS.get('MAGE')])
+
+        if lookup.lazy_pinyin is not None:
+            self.assertEqual(self.cards.fuzzy_search('chuanshuosuicong')[0].id, 'T_L00')
+
+    def test_autocomplete(self):
+        completed = self.cards.autocomplete('法师', languages=[])
+        self.assertEqual(len(completed), 10)
+        self.assertEqual(completed[0], hsdata.CAREERS.get('MAGE'))
+        self.assertTrue(all(card.id.startswith('T_M') for card in completed[1:]))
+        self.assertEqual(self.cards.autocomplete('hunt', limit=1, languages=['enUS']), [hsdata.CAREERS.get('HUNTER')])
+        self.assertEqual(self.cards.autocomplete('吉安', languages=[]), [hsdata.CAREERS.get('MAGE')])
+        self.assertEqual(self.cards.autocomplete('衍生', languages=[]), [])
+
+        # 按使用情况排序
+        decks = hsdata.Decks([self.make_deck('m0', card_counts={'T_M07': 2}, games=1000)])
+        self.cards.set_popularity(lookup.decks_popularity(decks))
+        self.assertEqual(self.cards.autocomplete('法师法术', limit=2, languages=[])[0].id, 'T_M07')
+
+        # 逐个按键补全
+        cursor = self.cards.prefix_index(languages=[]).cursor()
+        cursor.type('中立')
+        self.assertEqual(cursor.type('随从1')[0], (('card', 'T_N01'), '中立随从1'))
+        self.assertEqual(cursor.type('x'), [])
+        self.assertEqual(len(cursor.backspace(2)), 10)
+
+        # 卡牌更新后增量更新索引
+        index = self.cards.prefix_index(languages=[])
+        cards_data = make_cards_data()
+        cards_data[0]['name'] = '新的随从'
+        with open(self.cards.json_path, 'w') as f:
+            json.dump(cards_data, f)
+        self.cards.load()
+        self.assertIs(self.cards.prefix_index(languages=[]), index)
+        self.assertEqual([c.id for c in self.cards.autocomplete('新的', languages=[])], ['T_N00'])
+        self.assertNotIn('T_N00', [c.id for c in self.cards.autocomplete('中立随从', limit=20, languages=[])])
+
+        # 同一个值的多个名称只占用一个位置
+        index = lookup.PrefixIndex(top_k=3)
+        for text, value in (('ab', 1), ('abc', 1), ('abd', 1), ('abe', 2), ('abf', 3)):
+            index.add(text, value)
+        self.assertEqual(index.complete('ab'), [(1, 'ab'), (2, 'abe'), (3, 'abf')])
+        index.remove(2)
+        self.assertEqual(index.complete('a'), [(1, 'ab'), (3, 'abf')])
+
+        # 已下载的语言在数据目录中有文件增删时才重新查找
+        self.assertEqual(self.cards._get_languages(), ())
+        with open(os.path.join(self.data_dir, 'CARDS_enUS.json'), 'w') as f:
+            json.dump(make_cards_data(), f)
+        self.assertEqual(self.cards._get_languages(), ('enUS',))
+
+    def test_card_cooccurrence(self):
+        m0 = self.make_deck('m0', card_counts={'T_M00': 2, 'T_M01': 2, 'T_N00': 2}, games=100, wins=60)
+        m1 = self.make_deck('m1', card_counts={'T_M00': 2, 'T_M01': 1, 'T_N01': 2}, games=300, wins=150)
+        m2 = self.make_deck('m2', card_counts={'T_M02': 2, 'T_N00': 2}, games=600, wins=300)
+        decks = hsdata.Decks([m0, m1, m2])
+
+        cooccurrence = hsdata.CardCooccurrence(decks)
+        partners = cooccurrence.partners('T_M00', 'MAGE')
+        self.assertEqual(partners[0][0].id, 'T_M01')
+        stats = partners[0][1]
+        self.assertEqual((stats['decks'], stats['games'], stats['wins']), (2, 400, 210))
+        # P(M00, M01) / (P(M00) * P(M01)) = (400 / 1000) / (0.4 * 0.4)
+        self.assertAlmostEqual(stats['lift'], 2.5)
+        self.assertEqual(cooccurrence.partners('T_M00', 'MAGE', sort_by='games')[0][0].id, 'T_M01')
+        self.assertEqual(cooccurrence.partners('T_M00', 'HUNTER'), [])
+
+        # 增量更新: 修改、删除和新增卡组
+        m1.games = 1300
+        decks.remove(m2)
+        decks.append(self.make_deck('m3', card_counts={'T_M00': 1, 'T_N00': 2}, games=100, wins=50))
+        self.assertEqual(cooccurrence.update(decks), 3)
+        self.assertEqual(cooccurrence.update(decks), 0)
+
+        rebuilt = hsdata.CardCooccurrence(decks)
+        for card_id in 'T_M00', 'T_M01', 'T_N00', 'T_M02':
+            self.assertEqual(
+                cooccurrence.partners(card_id, 'MAGE', top_k=20), rebuilt.partners(card_id, 'MAGE', top_k=20))
+        self.assertIsNone(cooccurrence.card_stats('T_M02', 'MAGE'))
+        self.assertEqual(cooccurrence.card_stats('T_M00', 'MAGE')['games'], 1500)
+
+        self.assertEqual(len(hsdata.CardCooccurrence(decks, min_win_rate=0.5)), 2)
+
+    def test_decks_containing(self):
+        decks = hsdata.Decks([
+            self.make_deck('d0', card_counts={'T_M00': 2, 'T_M01': 2, 'T_N00': 1}),
+            self.make_deck('d1', card_counts={'T_M00': 1, 'T_M01': 2}),
+            self.make_deck('d2', card_counts={'T_M00': 2, 'T_M01': 1, 'T_N01': 2}),
+            self.make_deck('d3', card_counts={'T_M00': 2, 'T_M01': 2, 'T_N01': 1}),
+        ])
+
+        def ids(found):
+            return [deck.id for deck in found]
+
+        self.assertEqual(ids(decks.containing({'T_M00': 2, 'T_M01': 2})), ['d0', 'd3'])
+        self.assertEqual(ids(decks.containing({'T_M00': 2, 'T_M01': 2}, exclude=['T_N01'])), ['d0'])
+        self.assertEqual(ids(decks.containing(exclude={'T_N01': 2})), ['d0', 'd1', 'd3'])
+        self.assertEqual(ids(decks.containing([self.cards.get('T_N01')])), ['d2', 'd3'])
+        self.assertEqual(decks.card_postings('T_M00'), {'d0': 2, 'd1': 1, 'd2': 2, 'd3': 2})
+
+        found = decks.search(include={'T_M00': 2}, exclude={'T_N00': 1})
+        self.assertEqual(ids(found), ['d2', 'd3'])
+
+        # 倒排索引随合集的修改更新
+        decks.remove(decks.get('d3'))
+        decks.append(self.make_deck('d4', card_counts={'T_M00': 2, 'T_M01': 2}))
+        self.assertEqual(ids(decks.containing({'T_M00': 2, 'T_M01': 2})), ['d0', 'd4'])
+        self.assertEqual(ids(decks.containing(['T_U00'])), [])
+
+        # 其他修改方式同样更新索引
+        decks.card_postings('T_M00')
+        decks.insert(0, self.make_deck('d5', card_counts={'T_M00': 1}))
+        self.assertEqual(sorted(ids(decks.containing(['T_M00']))), ['d0', 'd1', 'd2', 'd4', 'd5'])
+        self.assertEqual(sorted(ids(decks.search(include=['T_M00'], mode=None))), ['d0', 'd1', 'd2', 'd4', 'd5'])
+        self.assertEqual(decks.get('d5').id, 'd5')
+
+        self.assertEqual(decks.pop().id, 'd4')
+        self.assertIsNone(decks.get('d4'))
+        decks[0] = self.make_deck('d6', card_counts={'T_N00': 1})
+        self.assertIsNone(decks.get('d5'))
+        self.assertEqual(sorted(ids(decks.containing(['T_N00']))), ['d0', 'd6'])
+        del decks[1:3]
+        self.assertEqual((decks.get('d0'), decks.get('d1')), (None, None))
+        decks += [self.make_deck('d7', card_counts={'T_M00': 2})]
+        self.assertEqual(sorted(ids(decks.containing({'T_M00': 2}))), ['d2', 'd7'])
+        self.assertEqual(decks.total_games, 300)
+        self.assertRaises(TypeError, decks.insert, 0, 'd8')
+
+    def test_similar_decks(self):
+        rng = random.Random(7)
+        card_ids = ['T_N{:02d}'.format(i) for i in range(20)] + ['T_M{:02d}'.format(i) for i in range(10)]
+        decks = hsdata.Decks()
+        for i in range(200):
+            card_counts = dict((card_id, rng.choice((1, 2))) for card_id in rng.sample(card_ids, 15))
+            decks.append(self.make_deck('d{}'.format(i), card_counts=card_counts, games=100 + i, wins=50))
+        query = dict((card_id, 2) for card_id in card_ids[3:12])
+        query['T_M00'] = 1
+
+        def brute_force(deck, metric):
+            counts = dict((card.id, count) for card, count in deck.cards.items())
+            if metric == hsdata.core.SIMILARITY_JACCARD:
+                keys = set(counts) | set(query)
+                return sum(min(counts.get(k, 0), query.get(k, 0)) for k in keys) / \
+                    sum(max(counts.get(k, 0), query.get(k, 0)) for k in keys)
+            dot = sum(count * counts.get(k, 0) for k, count in query.items())
+            return dot / math.sqrt(sum(c * c for c in counts.values()) * sum(c * c for c in query.values()))
+
+        for metric in hsdata.core.SIMILARITY_JACCARD, hsdata.core.SIMILARITY_COSINE:
+            found = decks.similar(query, top_k=5, metric=metric)
+            expected = sorted((brute_force(deck, metric) for deck in decks), reverse=True)[:5]
+            for (deck, similarity, _, _), value in zip(found, expected):
+                self.assertAlmostEqual(similarity, value)
+                self.assertAlmostEqual(similarity, brute_force(deck, metric))
+
+        deck, _, added, removed = decks.similar(query, top_k=1, min_games=250)[0]
+        self.assertGreaterEqual(deck.games, 250)
+        query_cards = Counter(dict((self.cards.get(k), v) for k, v in query.items()))
+        self.assertEqual(query_cards + added - removed, deck.cards)
+
+        # 以卡组查询时不包括其本身
+        self.assertNotEqual(decks.similar(decks[0], top_k=1)[0][0], decks[0])
+        self.assertEqual(decks.similar(query, career='HUNTER'), [])
+
+    def test_archetypes(self):
+        rng = random.Random(3)
+        # 两种风格明显不同的法师卡组，各自在固定的卡牌上有少量变化
+        aggro = ['T_N{:02d}'.format(i) for i in range(10)] + ['T_M{:02d}'.format(i) for i in range(5)]
+        control = ['T_N{:02d}'.format(i) for i in range(10, 20)] + ['T_M{:02d}'.format(i) for i in range(5, 10)]
+        decks = hsdata.Decks()
+        for i in range(40):
+            base = aggro if i % 2 else control
+            card_ids = rng.sample(base, 13) + rng.sample(aggro + control, 2)
+            decks.append(self.make_deck('d{}'.format(i), card_counts=dict((c, 2) for c in card_ids)))
+
+        for processes in None, 2:
+            archetypes = hsdata.Archetypes(decks, k=2, processes=processes)
+            self.assertEqual(len(archetypes), 2)
+            aggro_ids = set(archetypes.label(deck) for deck in decks[1::2])
+            control_ids = set(archetypes.label(deck) for deck in decks[::2])
+            self.assertEqual(len(aggro_ids), 1)
+            self.assertEqual(len(control_ids), 1)
+            self.assertNotEqual(aggro_ids, control_ids)
+
+        # 不迭代时按初始的中心分配
+        initial = hsdata.Archetypes(decks, k=2, max_iter=0)
+        self.assertEqual(len(initial.labels), len(decks))
+
+        aggro_id = aggro_ids.pop()
+        control_id = control_ids.pop()
+        self.assertEqual(sorted(archetypes.search('MAGE')), sorted([aggro_id, control_id]))
+        self.assertEqual(archetypes.search('HUNTER'), [])
+        self.assertEqual(archetypes.decks_of(aggro_id).total_games, 2000)
+
+        # 增量更新: 新卡组归入最近的流派，被删除的卡组移出
+        new_deck = self.make_deck('new', card_counts=dict((c, 2) for c in aggro), games=500)
+        decks.append(new_deck)
+        decks.remove(decks.get('d1'))
+        self.assertEqual(archetypes.update(decks), 1)
+        self.assertEqual(archetypes.label(new_deck), aggro_id)
+        self.assertIsNone(archetypes.label('d1'))
+        self.assertEqual(archetypes.decks_of(aggro_id).total_games, 2400)
+
+        # 按卡组数量倒排
+        decks.remove(decks.get('d0'))
+        archetypes.update(decks)
+        self.assertEqual(archetypes.search('MAGE'), [aggro_id, control_id])
+        decks.remove(decks.get('d3'))
+        decks.remove(decks.get('d5'))
+        archetypes.update(decks)
+        self.assertEqual(archetypes.search('MAGE'), [control_id, aggro_id])
+
+    def test_deckstrings(self):
+        # 官方卡组代码的示例 (猎人)
+        code = 'AAECAR8GxwPJBLsFmQfZB/gIDI0B2AGoArUDhwSSBe0G6wfbCe0JgQr+DAA='
+        heroes, card_counts, format_type = deckstrings.decode(code)
+        self.assertEqual((heroes, format_type), ([31], deckstrings.FORMAT_STANDARD))
+        self.assertEqual(sum(count for _, count in card_counts), 30)
+        self.assertEqual(deckstrings.encode(heroes, card_counts, format_type), code)
+        self.assertRaises(ValueError, deckstrings.decode, 'AAECAR8G')
+
+        cards_data = make_cards_data()
+        for dbf_id, data in enumerate(cards_data, 100):
+            data['dbfId'] = dbf_id
+        with open(self.cards.json_path, 'w') as f:
+            json.dump(cards_data, f)
+        self.cards.load()
+
+        deck = self.make_deck('d0', card_counts={'T_M00': 2, 'T_L00': 1, 'T_W00': 3})
+        decoded = hsdata.Deck()
+        decoded.from_deckstring(deck.deckstring)
+        self.assertEqual((decoded.career, decoded.cards), (deck.career, deck.cards))
+        self.assertEqual(deckstrings.decode(deck.deckstring)[2], deckstrings.FORMAT_WILD)
+
+        # 指纹与卡牌顺序和数据源无关
+        other = self.make_deck('x', card_counts={'T_W00': 3, 'T_M00': 2, 'T_L00': 1}, deck_class=hsdata.HSBoxDeck)
+        self.assertEqual(other.fingerprint, deck.fingerprint)
+        self.assertNotEqual(self.make_deck('h', career='HUNTER', card_counts={'T_L00': 1}).fingerprint,
+                            self.make_deck('m', card_counts={'T_L00': 1}).fingerprint)
+        self.assertEqual(len(hsdata.merge_decks(hsdata.Decks([deck]), hsdata.Decks([other]))), 1)
+
+    def test_deck_cards(self):
+        counts = {'T_M00': 2, 'T_L00': 1, 'T_N00': 2, 'T_N01': 1}
+        plain = [self.make_deck('d{}'.format(i), card_counts=counts) for i in range(20)]
+        decks = hsdata.Decks([self.make_deck('d{}'.format(i), card_counts=counts) for i in range(20)])
+        self.assertEqual(decks.compact(), 20)
+        self.assertEqual(decks.compact(), 0)
+
+        deck, counter = decks[0], plain[0].cards
+        self.assertIsInstance(deck.cards, hsdata.DeckCards)
+        self.assertEqual(deck.cards, counter)
+        self.assertEqual(deck.cards[self.cards.get('T_M00')], 2)
+        self.assertEqual(deck.cards[self.cards.get('T_N02')], 0)
+        self.assertEqual(deck.cards - Counter({self.cards.get('T_M00'): 1}), counter - Counter({self.cards.get('T_M00'): 1}))
+        self.assertEqual(counter & deck.cards, counter)
+        self.assertEqual(deck.crafting_cost, plain[0].crafting_cost)
+        self.assertEqual(deck.to_dict()['cards'], plain[0].to_dict()['cards'])
+        self.assertEqual(diff_decks(deck, plain[1])['intersection'], diff_decks(plain[0], plain[1])['intersection'])
+        self.assertEqual(cards_value(decks), cards_value(hsdata.Decks(plain)))
+
+        deck.cards[self.cards.get('T_N02')] = 2
+        del deck.cards[self.cards.get('T_M00')]
+        self.assertEqual(len(deck.cards), 4)
+        self.assertRaises(ValueError, deck.cards.__setitem__, self.cards.get('T_N03'), 256)
+
+        # 从 dict 读取的卡组直接使用 DeckCards，重新载入卡牌后指向新的卡牌对象
+        loaded = hsdata.Deck()
+        loaded.from_dict(plain[1].to_dict())
+        self.assertIsInstance(loaded.cards, hsdata.DeckCards)
+        self.assertEqual(pickle.loads(pickle.dumps(loaded)).cards, counter)
+        self.cards.load()
+        self.assertIs(next(iter(loaded.cards)), self.cards.get(next(iter(loaded.cards)).id))
+
+        # 可以使用卡牌ID读取，也可以直接打印
+        self.assertEqual((loaded.cards['T_M00'], loaded.cards.get('T_N02'), 'T_L00' in loaded.cards), (2, None, True))
+        self.assertIn('法师法术0 2', hsdata.print_cards(loaded.cards, return_text_only=True))
+
+        # 重新载入的卡牌数据中没有的卡牌，仍使用原有的卡牌对象
+        with open(self.cards.json_path, 'w') as f:
+            json.dump([data for data in make_cards_data() if data['id'] != 'T_M00'], f)
+        self.cards.load()
+        self.assertIsNone(self.cards.get('T_M00'))
+        self.assertEqual(loaded.crafting_cost, plain[1].crafting_cost)
+        self.assertEqual(loaded.to_dict()['cards'], plain[1].to_dict()['cards'])
+
+        seen = set()
+        deep_sizeof(self.cards, seen)
+        compact_size = deep_sizeof([deck.cards for deck in decks[1:]], set(seen))
+        self.assertLess(compact_size * 2, deep_sizeof([deck.cards for deck in plain[1:]], set(seen)))
+
+    def test_decks_from_dicts(self):
+        decks = hsdata.HSBoxDecks(json_path=os.path.join(self.data_dir, 'decks.json'), auto_load=False)
+        for i in range(3):
+            deck = self.make_deck('d{}'.format(i), card_counts={'T_M00': 2, 'T_N0{}'.format(i): 1}, deck_class=hsdata.HSBoxDeck)
+            deck.created_at = datetime(2017, 1, 2, 3, 4, i)
+            decks.append(deck)
+        decks.save()
+
+        dcts = [deck.to_dict() for deck in decks]
+        expected = list()
+        for dct in json.loads(json.dumps(dcts)):
+            deck = hsdata.HSBoxDeck()
+            deck.from_dict(dct)
+            expected.append(deck)
+        loaded = hsdata.HSBoxDeck.from_dicts(json.loads(json.dumps(dcts)))
+        self.assertEqual([deck.to_dict() for deck in loaded], [deck.to_dict() for deck in expected])
+        self.assertEqual(loaded[2].created_at, datetime(2017, 1, 2, 3, 4, 2))
+        self.assertIsNot(loaded[0].cards, loaded[1].cards)
+
+        decks.load(fields=('career', 'games'))
+        self.assertEqual(decks.total_games, 300)
+        self.assertEqual((decks.get('d1').name, len(decks.get('d1').cards)), ('', 0))
+        self.assertIsNone(decks[0].created_at)
+
+        # 只读取部分字段的卡组仍可保存，再次载入后得到相同的字段
+        decks.load(fields=('games', 'wins'))
+        partial_path = os.path.join(self.data_dir, 'partial.json')
+        decks.save(partial_path)
+        partial = hsdata.HSBoxDecks(json_path=partial_path)
+        self.assertEqual([(d.id, d.games, d.career, d.created_at) for d in partial], [
+            (d.id, d.games, None, None) for d in decks])
+        decks.load()
+        self.assertEqual(decks.get('d1').cards[self.cards.get('T_N01')], 1)
+
+        hearthstats = hsdata.HearthStatsDeck.from_dicts([dict(id='h', career='MAGE', win_rate_by_rank={'5': 0.6})])
+        self.assertEqual(hearthstats[0].win_rate_by_rank, {5: 0.6})
+
+        # 重写了 from_dict 的子类逐个调用 from_dict
+        class TaggedDeck(hsdata.Deck):
+            def from_dict(self, dct, cards=None):
+                self.tag = dct.pop('tag', None)
+                super(TaggedDeck, self).from_dict(dct, cards)
+
+        tagged = TaggedDeck.from_dicts([dict(id='t', career='MAGE', tag='x', cards={'T_M00': 2})], fields=['tag'])
+        self.assertEqual((tagged[0].tag, tagged[0].career.class_name, len(tagged[0].cards)), ('x', 'MAGE', 0))
+        self.assertEqual(TaggedDeck.from_dicts([dict(id='t', career='MAGE', cards={'T_M00': 2})])[0].cards['T_M00'], 2)
+        self.assertEqual(hsdata.core.parse_date_time('2017-01-02 03:04:05'), datetime(2017, 1, 2, 3, 4, 5))
+
+    def test_decks_view(self):
+        decks = hsdata.Decks([
+            self.make_deck('d{}'.format(i), career='MAGE' if i % 2 else 'HUNTER', games=100 + i, wins=10 * i)
+            for i in range(10)])
+
+        view = decks[2:8]
+        self.assertIsInstance(view, hsdata.DecksView)
+        self.assertEqual([deck.id for deck in view], ['d{}'.format(i) for i in range(2, 8)])
+        self.assertEqual(view[-1].id, 'd7')
+        self.assertEqual([deck.id for deck in view[::2]], ['d2', 'd4', 'd6'])
+        self.assertEqual(view.total_games, sum(range(102, 108)))
+
+        found = decks.search(career='MAGE', win_rate_top_n=-1)
+        self.assertIsInstance(found, hsdata.DecksView)
+        self.assertEqual([deck.id for deck in found], ['d9', 'd7', 'd5', 'd3', 'd1'])
+        self.assertEqual([deck.id for deck in found[:2]], ['d9', 'd7'])
+        self.assertEqual(found[1:].totals_by('MAGE').decks, 4)
+        self.assertEqual([deck.id for deck in found.search(min_games=105)], ['d9', 'd7', 'd5'])
+        self.assertEqual(len(found.search(include={'T_N00': 2})), 5)
+        self.assertEqual(len(found.search(exclude={'T_N00': 1})), 0)
+        self.assertIs(found.get('d3'), decks.get('d3'))
+        self.assertIsNone(found.get('d2'))
+
+        # 视图的累计数据随卡组的修改更新，视图本身不随合集的修改变化
+        total_games = found.total_games
+        decks.get('d1').games += 10
+        self.assertEqual(found.total_games, total_games + 10)
+        decks.remove(decks.get('d1'))
+        self.assertEqual(len(found), 5)
+
+        stats, top_decks = found.career_cards_stats('MAGE', min_games=0, top_win_rate_percentage=0.4)
+        self.assertEqual([deck.id for deck in top_decks], ['d9', 'd7'])
+        self.assertEqual(stats[self.cards.get('T_N00')]['used_in_decks'], 2)
+
+        materialized = found.to_decks()
+        self.assertIsInstance(materialized, hsdata.Decks)
+        self.assertEqual(materialized.total_games, found.total_games)
+        self.assertIs(materialized.get('d5'), decks.get('d5'))
+        self.assertEqual(hsdata.cards_value(found), hsdata.cards_value(materialized))
+
+        # 视图的只读方法与 Decks 相同
+        self.assertEqual(found, list(materialized))
+        self.assertEqual(decks[:3], decks[:3].to_decks())
+        self.assertNotEqual(found, found[1:])
+        self.assertEqual([deck.id for deck in found.containing(exclude=['T_N00'])], [])
+        self.assertEqual(found.similar(decks.get('d5'), top_k=1)[0][0].id, 'd9')
+        save_path = os.path.join(self.data_dir, 'found.json')
+        found.save(save_path)
+        with open(save_path) as f:
+            self.assertEqual([dct['id'] for dct in json.load(f)], ['d9', 'd7', 'd5', 'd3', 'd1'])
+
+        # 修改合集后不为整个合集重新生成快照
+        decks.snapshot
+        decks.append(self.make_deck('d10', career='MAGE', games=500, wins=450))
+        self.assertIsNone(decks._snapshot)
+        self.assertEqual([deck.id for deck in decks[-2:]], ['d9', 'd10'])
+        self.assertEqual([deck.id for deck in decks.search(career='MAGE', win_rate_top_n=1)], ['d10'])
+        self.assertIsNone(decks._snapshot)
+
+
 if __name__ == '__main__':
     unittest.main()